@@ -2,8 +2,11 @@ from collections import namedtuple
 from contextlib import contextmanager
 from functools import partial
 from datetime import datetime
+from fnmatch import fnmatchcase
 import logging
+import re
 import pytz
+import sqlalchemy as sa
 
 
 def _getLogger(*names):
@@ -64,6 +67,58 @@ def execute_resultset(con,sql,*args,**kwargs):
     res.close()
 
 
+def large_columns(table):
+    ''' Returns the list of large columns (type is text or nvarchar(max)) of a table.
+        Their values may be too big to be handled in one piece.
+    '''
+    def isLargeColumnType(col):
+        type=col.type
+        return isinstance(type,sa.TEXT) or (isinstance(type,sa.sql.sqltypes.NVARCHAR) and type.length=='max')
+
+    return filter(isLargeColumnType,table.columns)
+
+
+def filter_names(names,include=None,exclude=None):
+    ''' Returns the names that match one of the include patterns, or all names
+        without include patterns, and none of the exclude patterns. The patterns
+        are shell style wildcards like order_* and are matched case insensitive,
+        as table names in the database.
+
+            filter_names(['orders','order_lines','users'],['order*'],['*_lines'])
+            >>> ['orders']
+    '''
+    def matches(name,patterns):
+        return any(fnmatchcase(name.lower(),p.lower()) for p in patterns)
+
+    return [
+        n for n in names
+        if (not include or matches(n,include)) and not (exclude and matches(n,exclude))
+    ]
+
+
+def referenced_tables(table):
+    ''' Returns the set of keys of the tables, that are referenced by the foreign
+        keys of a table. The keys are the names of the tables in the meta data.
+    '''
+    return set(fk.target_fullname.rsplit('.',1)[0] for fk in table.foreign_keys)
+
+
+_trigger_table=re.compile(
+    r'\bTRIGGER\s.*?\bON\s+(?:(?:\[[^\]]+\]|"[^"]+"|\w+)\s*\.\s*)*(\[[^\]]+\]|"[^"]+"|\w+)',
+    re.I | re.U | re.S
+)
+
+def trigger_table(definition):
+    ''' Returns the lower case name of the table of a trigger from its definition,
+        or None if it can't be found
+
+            trigger_table('CREATE TRIGGER tr1 ON [dbo].[Orders] AFTER INSERT AS ...')
+            >>> 'orders'
+    '''
+    m=_trigger_table.search(definition)
+    return m.group(1).strip('[]"').lower() if m else None
+
+
 class DumpRestoreBase(object):
     ''' Base class for the dump and restore operations to capture common information
         like the backup_directory, the sqlalchemy engine, the database conneciton in use
@@ -79,18 +134,39 @@ class DumpRestoreBase(object):
         '''
         self.backup_dir=backup_dir
         self.engine=engine
+        self.schema=None
         self.con=engine.connect()
         _getLogger('DumpRestoreBase').debug('Connected to database')
         self.info={
             'started': datetime.now(pytz.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')      
         }
 
+    def _lazy_info(self,key):
+        # helper method that returns an item of the backup info. For backups
+        # with a schema, the meta data and the object definitions are read,
+        # when they are accessed the first time.
+        if key not in self.info and self.schema is not None:
+            if key=='meta':
+                self.info[key]=self.schema.metadata()
+            else:
+                self.info[key]=self.schema.objects(key)
+        return self.info[key]
+
     @property
     def meta(self):
         ''' Convenience property to retrieve the SQLAlchemy meta data from the backup
             info
         '''
-        return self.info['meta']
+        return self._lazy_info('meta')
+
+    @property
+    def table_names(self):
+        ''' Convenience property to retrieve the names of all tables in the backup.
+            For backups with a schema the meta data is not built for it.
+        '''
+        if 'meta' not in self.info and self.schema is not None:
+            return self.schema.table_names()
+        return self.meta.tables.keys()
 
     @property
     def started(self): 
@@ -109,28 +185,28 @@ class DumpRestoreBase(object):
         ''' Convenience property to retrive the list of ObjectDef objects with
             views from the backup info
         '''
-        return self.info['views']
+        return self._lazy_info('views')
 
     @property
     def procedures(self): 
         ''' Convenience property to retrive the list of ObjectDef objects with
             procedures from the backup info
         '''
-        return self.info['procedures']
+        return self._lazy_info('procedures')
 
     @property
     def functions(self): 
         ''' Convenience property to retrive the list of ObjectDef objects with
             functions from the backup info
         '''
-        return self.info['functions']
+        return self._lazy_info('functions')
 
     @property
     def triggers(self):
         ''' Convenience property to retrive the list of ObjectDef objects with
             triggers from the backup info
         '''
-        return self.info['triggers']
+        return self._lazy_info('triggers')
 
 
 import sys
@@ -1,19 +1,56 @@
 import argparse
+import sys
 import logging
 import json
+import os
+from datetime import datetime
 import sqlalchemy as sa
 
 from .dump import Dump
 from .restore import Restore
+from .convert import Convert
+from .verify import Verify
+from .orchestrate import Job,Orchestrator,write_report
+from .metrics import PrometheusTextfile,JsonLines
+from .profiling import Profiler
+from .sqltrace import SQLTracer
 from . import Password
+from .objectstore import LocalObjectStore
 
 
 if __name__ == '__main__':
 	parser=argparse.ArgumentParser("python -m albackup")
-	parser.add_argument('mode',metavar='MODE',choices=('dump','restore','chg-password'), help="mode of operation (dump or restore,chg-password)")
+	parser.add_argument('mode',metavar='MODE',choices=('dump','restore','chg-password','convert','verify','dump-all'), help="mode of operation (dump or restore,chg-password,convert,verify,dump-all)")
 	parser.add_argument('--cfg','-c',dest='cfg_file',default='albackup.json', help="Configuration for dump or restore operation")
 	parser.add_argument('--meta-cache',default=None, help="Allow caching of database meta data")
 	parser.add_argument('--backup-dir',default='backup',help="Target directory for backups")
+	parser.add_argument('--resume',metavar='BACKUP_DIR',default=None,help="Resume an interrupted dump or restore of the given backup directory")
+	parser.add_argument('--consistent',action="store_true",default=False,help="Dump all tables in one snapshot transaction (requires ALLOW_SNAPSHOT_ISOLATION)")
+	parser.add_argument('--stream-results',action="store_true",default=False,help="Fetch table data in blocks with a cursor arraysize of one block, and with server side cursors where the database driver supports them")
+	parser.add_argument('--archive',action="store_true",default=False,help="Write the dump into a single tar archive")
+	parser.add_argument('--output',metavar='FILE',default=None,help="Write the dump as a single stream into FILE, - for stdout")
+	parser.add_argument('--input',metavar='FILE',default=None,help="Restore from a dump stream in FILE, - for stdin")
+	parser.add_argument('--stripe-dir',metavar='DIR',action='append',default=None,help="Further directory to stripe the table files of a dump across, may be repeated")
+	parser.add_argument('--stripe-policy',choices=('round-robin','free-space'),default='round-robin',help="Placement of the table files in the stripe directories")
+	parser.add_argument('--object-store-root',metavar='DIR',default=None,help="Directory of a local stand-in for S3 used with s3:// backup locations")
+	parser.add_argument('--format',type=int,choices=(1,2),default=1,help="Backup format of a dump: 1 pickled, 2 binary blocks with JSON schema")
+	parser.add_argument('--tables',metavar='PATTERNS',action='append',default=None,help="Restore only the tables matching the comma separated wildcard patterns, may be repeated")
+	parser.add_argument('--exclude-tables',metavar='PATTERNS',action='append',default=None,help="Don't restore the tables matching the comma separated wildcard patterns, may be repeated")
+	parser.add_argument('--with-dependencies',action="store_true",default=False,help="Restore the tables referenced by the foreign keys of the selected tables as well")
+	parser.add_argument('--merge',action="store_true",default=False,help="Restore only the rows that differ from the backup into an existing database with the same schema")
+	parser.add_argument('--subset',metavar='TABLE:CONDITION',action='append',default=None,help="Dump only the rows of TABLE matching the SQL CONDITION and the rows they reference, may be repeated")
+	parser.add_argument('--target',metavar='LOCATION',default=None,help="Target directory or .tar archive of a convert")
+	parser.add_argument('--processes',type=int,default=None,help="Number of processes that verify the table files, by default one per CPU")
+	parser.add_argument('--jobs',type=int,default=4,help="Number of databases dumped at the same time by dump-all")
+	parser.add_argument('--jobs-per-server',type=int,default=1,help="Number of databases of the same server dumped at the same time by dump-all")
+	parser.add_argument('--report',metavar='FILE',default=None,help="Write the JSON report of a restore or dump-all into FILE, restore-<db>-<timestamp>.json for restores by default")
+	parser.add_argument('--metrics-textfile',metavar='FILE',default=None,help="Export the progress of a dump or restore as Prometheus textfile FILE, FILE-<name> per database of dump-all")
+	parser.add_argument('--metrics-jsonl',metavar='FILE',default=None,help="Write the progress events of a dump or restore as JSON lines into FILE, - for stderr")
+	parser.add_argument('--profile',action="store_true",default=False,help="Profile each phase of a dump or restore with cProfile into _profile-*.pstats files")
+	parser.add_argument('--profile-tables',action="store_true",default=False,help="Profile each table on its own as well")
+	parser.add_argument('--trace-memory',action="store_true",default=False,help="Record the memory growth of each phase of a dump or restore into _memory-*.txt")
+	parser.add_argument('--profile-dir',metavar='DIR',default=None,help="Directory of the profiles, by default the backup directory, or the current directory for archives, streams and object stores")
+	parser.add_argument('--trace-sql',metavar='N',type=int,nargs='?',const=10,default=None,help="Trace the SQL statements and log the N slowest and most frequent statement shapes at the end, 10 by default")
 	parser.add_argument('--debug','-d',action="store_true",default=False,help="Run in debug mode")
 	args=parser.parse_args()
 
@@ -27,50 +64,169 @@ if __name__ == '__main__':
 	logger=logging.getLogger()
 
 	cfg=None
-	with open(args.cfg_file,'r') as fh:
-		cfg=json.load(fh)
-		logger.info('Read configuration from %s',args.cfg_file)
+	if args.mode not in ('convert','verify'):
+		with open(args.cfg_file,'r') as fh:
+			cfg=json.load(fh)
+			logger.info('Read configuration from %s',args.cfg_file)
 
-	if args.mode!='chg-password':
-		p=Password(args.cfg_file,cfg)
-		pw=p.password
+	tracer=SQLTracer() if args.trace_sql else None
+
+	def create_engine(db_cfg):
+		pw=Password(args.cfg_file,db_cfg).password
 
 		logger.info('Database configuration:')
-		logger.info('   user    : %s',cfg['db_user'])
+		logger.info('   user    : %s',db_cfg['db_user'])
 		logger.info('   password: %s','*'*len(pw))
-		logger.info('   server  : %s',cfg['db_server'])
-		logger.info('   port    : %d',cfg['db_port'])
-		logger.info('   db      : %s',cfg['db_name'])
+		logger.info('   server  : %s',db_cfg['db_server'])
+		logger.info('   port    : %d',db_cfg['db_port'])
+		logger.info('   db      : %s',db_cfg['db_name'])
 		engine=sa.create_engine('mssql+pyodbc://{}:{}@{}:{}/{}?driver=FreeTDS&odbc_options="TDS_Version=8.0"'.format(
-			cfg['db_user'],
+			db_cfg['db_user'],
 			pw,
-			cfg['db_server'],
-			cfg['db_port'],
-			cfg['db_name']
+			db_cfg['db_server'],
+			db_cfg['db_port'],
+			db_cfg['db_name']
 		),deprecate_large_types=True)
 		logger.info('SQLAlchemy engine created.')
+		if tracer:
+			tracer.attach(engine)
+		return engine
+
+	if args.mode not in ('chg-password','convert','verify','dump-all'):
+		engine=create_engine(cfg)
+
+	def patterns(values):
+		return [p.strip() for v in values or [] for p in v.split(',') if p.strip()]
+
+	object_store=LocalObjectStore(args.object_store_root) if args.object_store_root else None
+
+	metrics_jsonl=None
+	if args.metrics_jsonl:
+		metrics_jsonl=sys.stderr if args.metrics_jsonl=='-' else open(args.metrics_jsonl,'a')
+
+	def add_metrics(report,db_cfg,name=None):
+		labels={'database': db_cfg['db_name'], 'server': db_cfg['db_server']}
+		if args.metrics_textfile:
+			file_name=args.metrics_textfile
+			if name is not None:
+				(base,ext)=os.path.splitext(file_name)
+				file_name='{}-{}{}'.format(base,name,ext)
+			report.listeners.append(PrometheusTextfile(file_name,labels))
+		if metrics_jsonl:
+			report.listeners.append(JsonLines(metrics_jsonl,labels))
+
+	def add_profiler(report,location):
+		if not (args.profile or args.profile_tables or args.trace_memory):
+			return
+		directory=args.profile_dir or (location if location and os.path.isdir(location) else '.')
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+		report.listeners.append(Profiler(directory,cpu=args.profile or args.profile_tables,memory=args.trace_memory,tables=args.profile_tables))
+		logger.info('Profiles are written to %s',directory)
 
 	if args.mode=='dump':
-		dump=Dump(args.backup_dir, args.meta_cache, engine, cfg['db_name'], cfg['db_server'])
+		subset=cfg.get('subset')
+		if args.subset:
+			subset=dict(s.split(':',1) for s in args.subset)
+		stream=None
+		if args.output:
+			stream=sys.stdout if args.output=='-' else open(args.output,'wb')
+		dump=Dump(args.backup_dir, args.meta_cache, engine, cfg['db_name'], cfg['db_server'], resume_dir=args.resume, consistent=args.consistent, stream_results=args.stream_results, archive=args.archive, stream=stream, object_store=object_store, stripe_dirs=args.stripe_dir, stripe_policy=args.stripe_policy, format=args.format, tables=cfg.get('tables'), exclude_tables=cfg.get('exclude_tables'), where=cfg.get('where'), subset=subset)
+		add_metrics(dump.report,cfg)
+		add_profiler(dump.report,dump.backup_dir)
 		dump.run()
+		if stream:
+			stream.close()
+		if tracer:
+			tracer.log_report(args.trace_sql)
 		logger.info('Dump finished')
 
 	elif args.mode=='restore':
 		if not cfg['allow_restore']:
 			raise Exception('Configuration file prohibits restore')
 		enable_ri_check=cfg['enable_ri_check']
+		selection={
+			'tables': patterns(args.tables),
+			'exclude_tables': patterns(args.exclude_tables),
+			'with_dependencies': args.with_dependencies,
+			'merge': args.merge
+		}
 			
-		restore=Restore(args.backup_dir,engine)
+		if args.input:
+			restore=Restore(args.input,engine,stream=sys.stdin if args.input=='-' else open(args.input,'rb'),**selection)
+		elif args.resume:
+			restore=Restore(args.resume,engine,resume=True,stripe_dirs=args.stripe_dir,**selection)
+		else:
+			restore=Restore(args.backup_dir,engine,object_store=object_store,stripe_dirs=args.stripe_dir,**selection)
+		add_metrics(restore.report,cfg)
+		add_profiler(restore.report,None if args.input else args.resume or args.backup_dir)
 		restore.run()
 		if enable_ri_check:
-			restore.changeRIChecks(off=False)
+			with restore.report.phase('changeRIChecks'):
+				restore.changeRIChecks(off=False)
 		else:
 			logger.info('RI checks where left off')
-		logger.info('Restore finished')
+		report_file=args.report or 'restore-{}-{}.json'.format(cfg['db_name'],datetime.utcnow().strftime('%Y%m%d-%H%M'))
+		restore.report.write(report_file)
+		restore.report.log_summary()
+		restore.report.finish()
+		if tracer:
+			tracer.log_report(args.trace_sql)
+		logger.info('Restore finished, report written to %s',report_file)
 
 	elif args.mode=='chg-password':
 		pw=Password(args.cfg_file, cfg)
 		pw.change()
 
+	elif args.mode=='convert':
+		if not args.target:
+			parser.error('convert requires --target')
+		Convert(args.backup_dir,args.target).run()
+		logger.info('Convert finished')
+
+	elif args.mode=='verify':
+		results=Verify(args.backup_dir,processes=args.processes,object_store=object_store,stripe_dirs=args.stripe_dir).run()
+		if not all([r.ok for r in results]):
+			logger.error('Verify found errors in the backup')
+			sys.exit(1)
+		logger.info('Verify finished')
+
+	elif args.mode=='dump-all':
+		defaults={k: v for (k,v) in cfg.items() if k not in ('databases','server_limits')}
+
+		def dump_job(name,db_cfg):
+			def run():
+				engine=create_engine(db_cfg)
+				try:
+					dump=Dump(args.backup_dir, args.meta_cache, engine, db_cfg['db_name'], db_cfg['db_server'], consistent=args.consistent, stream_results=args.stream_results, archive=args.archive, object_store=object_store, format=args.format, tables=db_cfg.get('tables'), exclude_tables=db_cfg.get('exclude_tables'), where=db_cfg.get('where'), subset=db_cfg.get('subset'))
+					add_metrics(dump.report,db_cfg,name)
+					dump.run()
+				finally:
+					engine.dispose()
+				return {'backup_dir': dump.backup_dir}
+			return run
+
+		jobs=[]
+		for database in cfg['databases']:
+			db_cfg=dict(defaults)
+			db_cfg.update(database)
+			if db_cfg.get('skip'):
+				logger.warn('Dump of %s skipped',db_cfg.get('name',db_cfg['db_name']))
+				continue
+			name=db_cfg.get('name',db_cfg['db_name'])
+			jobs.append(Job(name,(db_cfg['db_server'],),dump_job(name,db_cfg)))
+
+		results=Orchestrator(jobs,workers=args.jobs,per_server=args.jobs_per_server,server_limits=cfg.get('server_limits')).run()
+		if tracer:
+			tracer.log_report(args.trace_sql)
+		if args.report:
+			write_report(args.report,results)
+		if not all([r.ok for r in results]):
+			sys.exit(1)
+		logger.info('Dumps finished')
+
 	else:
-		argparse.error("Invalid program mode")
\ No newline at end of file
+		argparse.error("Invalid program mode")
+
+	if metrics_jsonl and metrics_jsonl is not sys.stderr:
+		metrics_jsonl.close()
\ No newline at end of file
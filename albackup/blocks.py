@@ -0,0 +1,224 @@
+import hashlib
+import json
+import os
+from collections import namedtuple
+
+from . import loggerFactory
+
+
+MANIFEST_FILE='_manifest.json'
+
+TRAILER_FILE='_trailer.json'
+''' Name of the trailer of a backup stream with the info, that is known after the tables '''
+
+TABLE_FILE_SUFFIXES={1: '.pickle', 2: '.blocks'}
+''' Suffix of the table files per backup format '''
+
+LARGE_VALUE_CHUNK=65535
+''' Size in characters of the chunks in which large values are written '''
+
+_getLogger=loggerFactory('blocks')
+
+
+IndexEntry=namedtuple('IndexEntry',('offset','length','rows','checksum'))
+''' simple tuple class for one block in the block index of a table file '''
+
+
+LargeValue=namedtuple('LargeValue',('column','length','unicode'))
+''' simple tuple class that replaces a large value in a row, which is written in chunks after the block '''
+
+
+def block_digest(buf):
+	''' Returns a running digest for a serialized block, which can be updated with
+		the chunks of large values that belong to the block
+	'''
+	return hashlib.sha1(buf)
+
+
+def checksum(buf):
+	''' Returns the hex digest of a serialized block, which is recorded in the
+		block index and used to verify the block later on
+	'''
+	return block_digest(buf).hexdigest()
+
+
+def table_checksum(entries):
+	''' Returns the checksum of a complete table file, which is derived from
+		the checksums of all its blocks, so it can be re-calculated from the
+		block index after an interrupted dump
+	'''
+	return checksum(''.join([e.checksum for e in entries]))
+
+
+def write_block(fh,buf):
+	''' Writes one serialized block preceded by its size to the table file and
+		returns the number of bytes written
+	'''
+	header='{}\n'.format(len(buf))
+	fh.write(header)
+	fh.write(buf)
+	return len(header)+len(buf)
+
+
+def write_large_value(fh,chunks,digest=None):
+	''' Writes the chunks of a large value after its block. Each chunk is preceded by
+		a line with a '+' and its size in bytes and the value is terminated by an
+		empty chunk:
+
+			+65535\n
+			...65535 bytes of the value...
+			+1200\n
+			...1200 bytes of the value...
+			+0\n
+
+		Unicode chunks are written utf-8 encoded. The method returns the number of
+		bytes written.
+
+		* fh - the table file
+		* chunks - iterable with the chunks of the value
+		* digest - optional block digest that is updated with the chunks
+	'''
+	size=0
+	for chunk in chunks:
+		if isinstance(chunk,unicode):
+			chunk=chunk.encode('utf-8')
+		if digest:
+			digest.update(chunk)
+		header='+{}\n'.format(len(chunk))
+		fh.write(header)
+		fh.write(chunk)
+		size+=len(header)+len(chunk)
+	fh.write('+0\n')
+	return size+3
+
+
+def read_large_value(fh,marker):
+	''' Generator that reads the chunks of a large value from a table file
+
+		* fh - the table file positioned at the first chunk of the value
+		* marker - the LargeValue from the row
+	'''
+	while True:
+		l=fh.readline()
+		if not l.startswith('+'):
+			raise Exception('Invalid chunk of large value for column {}'.format(marker.column))
+		size=int(l[1:])
+		if size==0:
+			return
+		chunk=fh.read(size)
+		yield chunk.decode('utf-8') if marker.unicode else chunk
+
+
+def skip_block(fh):
+	''' Moves a table file behind the block at the current position, including the
+		chunks of its large values, without reading it. Returns False, if the end of
+		the table file has been reached.
+	'''
+	l=fh.readline()
+	if not l or l=='EOF':
+		return False
+	fh.seek(int(l),1)
+	while True:
+		pos=fh.tell()
+		l=fh.readline()
+		if not l.startswith('+'):
+			fh.seek(pos)
+			return True
+		fh.seek(int(l[1:]),1)
+
+
+def table_file_name(table_name,version=1):
+	''' Returns the name of the table file of a table in a backup of the given format:
+
+			<table>.pickle (v1) or <table>.blocks (v2)
+	'''
+	return table_name+TABLE_FILE_SUFFIXES[version]
+
+
+def table_of_file(file_name):
+	''' Returns the name of the table for a table file, or None for other files
+	'''
+	(table_name,suffix)=os.path.splitext(file_name)
+	return table_name if suffix in TABLE_FILE_SUFFIXES.values() else None
+
+
+def index_file_name(table_file_name):
+	''' Returns the name of the block index for a given table file:
+
+			<table>.pickle -> <table>.idx
+	'''
+	return os.path.splitext(table_file_name)[0]+'.idx'
+
+
+def write_index_entry(fh,entry):
+	''' Appends an entry to an open block index file. Each line in the index
+		describes one block:
+
+			<offset>\t<length>\t<rows>\t<checksum>\n
+	'''
+	fh.write('{}\t{}\t{}\t{}\n'.format(*entry))
+	fh.flush()
+
+
+def read_index(fh):
+	''' Reads the block index of a table file from an open file and returns the
+		list of entries. An incomplete last line, left behind by an interrupted dump,
+		is ignored.
+	'''
+	ret=[]
+	for line in fh:
+		if not line.endswith('\n'):
+			break
+		(offset,length,rows,chksum)=line[:-1].split('\t')
+		ret.append(IndexEntry(int(offset),int(length),int(rows),chksum))
+	return ret
+
+
+class Manifest(object):
+	''' The manifest records every table of a backup that was written completely,
+		together with its row count, number of blocks and checksum. If the storage
+		allows to resume a backup, the manifest is saved after each table, so an
+		interrupted dump can be resumed with the tables that are still missing.
+	'''
+
+	def __init__(self,storage):
+		''' Constructor
+
+			* storage - the storage of the backup that holds the manifest
+
+			An existing manifest in the backup is loaded.
+		'''
+		self.storage=storage
+		self.tables={}
+		if storage.exists(MANIFEST_FILE):
+			with storage.open_read(MANIFEST_FILE) as fh:
+				self.tables=json.load(fh)['tables']
+			_getLogger('Manifest').info('Manifest with %d complete tables read',len(self.tables))
+
+	def is_complete(self,table_name):
+		''' Returns True, if the given table has been written completely
+		'''
+		return table_name in self.tables and self.tables[table_name]['complete']
+
+	def mark_complete(self,table_name,rows,blocks,chksum):
+		''' Records a completed table and persists the manifest, if the backup
+			can be resumed
+
+			* table_name - name of the table
+			* rows - number of rows written
+			* blocks - number of blocks written
+			* chksum - checksum of the table file
+		'''
+		self.tables[table_name]={
+			'complete': True,
+			'rows': rows,
+			'blocks': blocks,
+			'checksum': chksum
+		}
+		if self.storage.supports_resume:
+			self.save()
+
+	def save(self):
+		''' Writes the manifest into the backup
+		'''
+		self.storage.write_file(MANIFEST_FILE,json.dumps({'tables': self.tables},indent=1,sort_keys=True))
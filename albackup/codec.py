@@ -0,0 +1,230 @@
+import struct
+import uuid
+from datetime import datetime,date,time
+from decimal import Decimal
+from sqlalchemy.util import pickle,byte_buffer
+
+from .blocks import LargeValue
+
+
+class PickleCodec(object):
+	''' Codec of format v1 backups, that pickles the rows of a block.
+		Unpickling executes code from the backup, so it must only be used
+		for trusted backups.
+	'''
+
+	name='pickle'
+
+	def encode(self,rows):
+		''' Returns the serialized block for a list of rows '''
+		buf=byte_buffer()
+		pickle.dump(rows,buf)
+		return buf.getvalue()
+
+	def decode(self,buf):
+		''' Returns the list of rows of a serialized block '''
+		return pickle.loads(buf)
+
+
+_HEADER=struct.Struct('>HI')
+_LEN16=struct.Struct('>H')
+_LEN32=struct.Struct('>I')
+_INT=struct.Struct('>q')
+_FLOAT=struct.Struct('>d')
+_DATETIME=struct.Struct('>HBBBBBI')
+_DATE=struct.Struct('>HBB')
+_TIME=struct.Struct('>BBBI')
+_LARGE=struct.Struct('>QB')
+
+_INT_MIN=-2**63
+_INT_MAX=2**63-1
+
+
+class BinaryCodec(object):
+	''' Codec of format v2 backups, that writes the rows of a block in a simple
+		binary format without pickle. Decoding only creates plain values, so
+		backups from untrusted storage can be read safely. A block starts with
+		the number of columns and rows, followed by the column names and the
+		values row by row:
+
+			<columns:uint16><rows:uint32>
+			<length:uint16><utf-8 column name>...
+			<tag><value>...
+
+		Each value is a one character tag followed by its data in big endian:
+
+			N - None
+			T, F - True, False
+			i - int64
+			I - integer outside of int64 as decimal string with uint16 length
+			f - float64
+			D - Decimal as string with uint16 length
+			b - str with uint32 length
+			y - bytearray with uint32 length
+			u - unicode utf-8 encoded with uint32 length
+			d - datetime: year:uint16, month, day, hour, minute, second:uint8, microsecond:uint32
+			a - date: year:uint16, month, day:uint8
+			t - time: hour, minute, second:uint8, microsecond:uint32
+			g - UUID as 16 bytes
+			L - LargeValue: column as uint16 length and utf-8, length:uint64, unicode:uint8
+
+		Decoded rows are dicts with the column names as keys.
+	'''
+
+	name='binary'
+
+	def encode(self,rows):
+		''' Returns the serialized block for a list of rows '''
+		columns=rows[0].keys() if rows else []
+		out=[_HEADER.pack(len(columns),len(rows))]
+		for c in columns:
+			c=c.encode('utf-8') if isinstance(c,unicode) else c
+			out.append(_LEN16.pack(len(c)))
+			out.append(c)
+		append=out.append
+		for row in rows:
+			for c in columns:
+				self._encode_value(append,row[c])
+		return ''.join(out)
+
+	def _encode_value(self,append,v):
+		# helper method that appends the tag and data of one value
+		if v is None:
+			append('N')
+		elif v is True:
+			append('T')
+		elif v is False:
+			append('F')
+		elif isinstance(v,(int,long)):
+			if _INT_MIN<=v<=_INT_MAX:
+				append('i')
+				append(_INT.pack(v))
+			else:
+				s=str(v)
+				append('I')
+				append(_LEN16.pack(len(s)))
+				append(s)
+		elif isinstance(v,float):
+			append('f')
+			append(_FLOAT.pack(v))
+		elif isinstance(v,Decimal):
+			s=str(v)
+			append('D')
+			append(_LEN16.pack(len(s)))
+			append(s)
+		elif isinstance(v,unicode):
+			s=v.encode('utf-8')
+			append('u')
+			append(_LEN32.pack(len(s)))
+			append(s)
+		elif isinstance(v,str):
+			append('b')
+			append(_LEN32.pack(len(v)))
+			append(v)
+		elif isinstance(v,bytearray):
+			append('y')
+			append(_LEN32.pack(len(v)))
+			append(str(v))
+		elif isinstance(v,datetime):
+			if v.tzinfo is not None:
+				raise Exception('Values with time zones are not supported: {!r}'.format(v))
+			append('d')
+			append(_DATETIME.pack(v.year,v.month,v.day,v.hour,v.minute,v.second,v.microsecond))
+		elif isinstance(v,date):
+			append('a')
+			append(_DATE.pack(v.year,v.month,v.day))
+		elif isinstance(v,time):
+			if v.tzinfo is not None:
+				raise Exception('Values with time zones are not supported: {!r}'.format(v))
+			append('t')
+			append(_TIME.pack(v.hour,v.minute,v.second,v.microsecond))
+		elif isinstance(v,uuid.UUID):
+			append('g')
+			append(v.bytes)
+		elif isinstance(v,LargeValue):
+			c=v.column.encode('utf-8') if isinstance(v.column,unicode) else v.column
+			append('L')
+			append(_LEN16.pack(len(c)))
+			append(c)
+			append(_LARGE.pack(v.length,1 if v.unicode else 0))
+		else:
+			raise Exception('Values of type {} are not supported'.format(type(v).__name__))
+
+	def decode(self,buf):
+		''' Returns the list of rows of a serialized block '''
+		(ncolumns,nrows)=_HEADER.unpack_from(buf,0)
+		pos=_HEADER.size
+		columns=[]
+		for i in xrange(0,ncolumns):
+			(l,)=_LEN16.unpack_from(buf,pos)
+			pos+=_LEN16.size
+			columns.append(buf[pos:pos+l].decode('utf-8'))
+			pos+=l
+
+		rows=[]
+		for i in xrange(0,nrows):
+			row={}
+			for c in columns:
+				(row[c],pos)=self._decode_value(buf,pos)
+			rows.append(row)
+		return rows
+
+	def _decode_value(self,buf,pos):
+		# helper method that returns the value at the position and the position
+		# of the next one
+		tag=buf[pos]
+		pos+=1
+		if tag=='N':
+			return (None,pos)
+		if tag=='T':
+			return (True,pos)
+		if tag=='F':
+			return (False,pos)
+		if tag=='i':
+			return (_INT.unpack_from(buf,pos)[0],pos+_INT.size)
+		if tag=='f':
+			return (_FLOAT.unpack_from(buf,pos)[0],pos+_FLOAT.size)
+		if tag in 'buy':
+			(l,)=_LEN32.unpack_from(buf,pos)
+			pos+=_LEN32.size
+			s=buf[pos:pos+l]
+			if tag=='u':
+				s=s.decode('utf-8')
+			elif tag=='y':
+				s=bytearray(s)
+			return (s,pos+l)
+		if tag in 'ID':
+			(l,)=_LEN16.unpack_from(buf,pos)
+			pos+=_LEN16.size
+			s=buf[pos:pos+l]
+			return (long(s) if tag=='I' else Decimal(s),pos+l)
+		if tag=='d':
+			return (datetime(*_DATETIME.unpack_from(buf,pos)),pos+_DATETIME.size)
+		if tag=='a':
+			return (date(*_DATE.unpack_from(buf,pos)),pos+_DATE.size)
+		if tag=='t':
+			return (time(*_TIME.unpack_from(buf,pos)),pos+_TIME.size)
+		if tag=='g':
+			return (uuid.UUID(bytes=buf[pos:pos+16]),pos+16)
+		if tag=='L':
+			(l,)=_LEN16.unpack_from(buf,pos)
+			pos+=_LEN16.size
+			column=buf[pos:pos+l].decode('utf-8')
+			pos+=l
+			(length,is_unicode)=_LARGE.unpack_from(buf,pos)
+			return (LargeValue(column,length,bool(is_unicode)),pos+_LARGE.size)
+		raise Exception('Invalid value tag {!r} in block'.format(tag))
+
+
+CODECS={
+	PickleCodec.name: PickleCodec(),
+	BinaryCodec.name: BinaryCodec()
+}
+''' Available codecs for table blocks by name '''
+
+
+def get_codec(name):
+	''' Returns the codec for table blocks with the given name '''
+	if name not in CODECS:
+		raise Exception('Unknown block codec {}'.format(name))
+	return CODECS[name]
@@ -2,11 +2,13 @@ from __future__ import print_function
 import logging
 import json
 import os
+import re
+from xml.etree import ElementTree
 from jinja2 import Environment,FileSystemLoader
 from tempfile import NamedTemporaryFile
 import sh
 
-from albackup import loggerFactory
+from albackup import loggerFactory,execute_resultset
 
 
 _getLogger=loggerFactory('compare')
@@ -77,6 +79,298 @@ class DbCompare(object):
 		self._sql_cmdfile.close()
 
 
+_COLUMNS='''SELECT c.TABLE_NAME, c.COLUMN_NAME, c.DATA_TYPE, c.CHARACTER_MAXIMUM_LENGTH, c.NUMERIC_PRECISION, c.NUMERIC_SCALE,
+	c.IS_NULLABLE, c.COLUMN_DEFAULT, c.COLLATION_NAME
+FROM INFORMATION_SCHEMA.COLUMNS c
+JOIN INFORMATION_SCHEMA.TABLES t ON t.TABLE_SCHEMA=c.TABLE_SCHEMA AND t.TABLE_NAME=c.TABLE_NAME
+WHERE t.TABLE_TYPE='BASE TABLE' AND c.TABLE_SCHEMA='dbo'
+ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION'''
+
+_INDEXES='''SELECT t.name, i.name, i.type_desc, i.is_unique, i.is_primary_key, i.is_unique_constraint, c.name, ic.is_included_column
+FROM sys.indexes i
+JOIN sys.tables t ON t.object_id=i.object_id
+JOIN sys.index_columns ic ON ic.object_id=i.object_id AND ic.index_id=i.index_id
+JOIN sys.columns c ON c.object_id=ic.object_id AND c.column_id=ic.column_id
+WHERE i.type>0 AND SCHEMA_NAME(t.schema_id)='dbo'
+ORDER BY t.name, i.name, ic.key_ordinal, ic.index_column_id'''
+
+_FOREIGN_KEYS='''SELECT OBJECT_NAME(fk.parent_object_id), fk.name, pc.name, OBJECT_NAME(fk.referenced_object_id), rc.name,
+	fk.delete_referential_action_desc, fk.update_referential_action_desc
+FROM sys.foreign_keys fk
+JOIN sys.foreign_key_columns fkc ON fkc.constraint_object_id=fk.object_id
+JOIN sys.columns pc ON pc.object_id=fkc.parent_object_id AND pc.column_id=fkc.parent_column_id
+JOIN sys.columns rc ON rc.object_id=fkc.referenced_object_id AND rc.column_id=fkc.referenced_column_id
+WHERE SCHEMA_NAME(fk.schema_id)='dbo'
+ORDER BY fk.name, fkc.constraint_column_id'''
+
+_MODULES='''SELECT o.name, o.type, m.definition
+FROM sys.sql_modules m
+JOIN sys.objects o ON o.object_id=m.object_id
+WHERE o.type IN ('V','P','FN','IF','TF','TR') AND SCHEMA_NAME(o.schema_id)='dbo' '''
+
+_MODULE_TYPES={'V': 'views', 'P': 'procedures', 'FN': 'functions', 'IF': 'functions', 'TF': 'functions', 'TR': 'triggers'}
+
+OBJECT_TYPES=('views','procedures','functions','triggers')
+''' Types of the database objects compared by their definitions '''
+
+TABLE_PARTS=('columns','keys','indexes')
+''' Parts of a table that are compared '''
+
+
+def _column_type(data_type,length,precision,scale):
+	# helper that returns the type of a column as it is written in DDL
+	if length is not None:
+		return '{}({})'.format(data_type,'max' if length==-1 else length)
+	if data_type in ('decimal','numeric'):
+		return '{}({},{})'.format(data_type,precision,scale)
+	return data_type
+
+
+def _definition(text):
+	# helper that normalizes the definition of an object for the compare, white space
+	# and case don't matter
+	return re.sub(r'\s+',' ',text or '').strip().lower()
+
+
+def diff_dicts(ref,target):
+	''' Compares two dicts and returns the keys only in the reference (add), only in
+		the target (drop) and the keys with different values as tuples of the key and
+		both values (modify). The names follow the report of WbSchemaDiff: add and drop
+		are what is needed to turn the target into the reference.
+
+			diff_dicts({'a': 1, 'b': 2},{'b': 3, 'c': 4})
+			>>> {'add': ['a'], 'drop': ['c'], 'modify': [('b', 2, 3)]}
+	'''
+	return {
+		'add': sorted(k for k in ref if k not in target),
+		'drop': sorted(k for k in target if k not in ref),
+		'modify': [(k,ref[k],target[k]) for k in sorted(ref) if k in target and ref[k]!=target[k]]
+	}
+
+
+class SchemaCompare(object):
+	''' Compares the schemas of two databases in process. The catalog of each database
+		is read with one query per kind of object for all tables, so the compare takes
+		seconds even for large schemas. Tables with their columns, keys and indexes are
+		compared, as well as the definitions of views, procedures, functions and
+		triggers. The differences are written as XML and HTML report like WbSchemaDiff
+		did for DbCompare.
+	'''
+
+	TEMPLATE='schema_diff.html'
+
+	def __init__(self,ref_engine,target_engine,name,target_name=None,diff_dir='diffs'):
+		''' Constructor:
+
+			* ref_engine - SQLAlchemy engine of the reference database
+			* target_engine - SQLAlchemy engine of the target database
+			* name - name of the compare used for the report files diff-<name>.xml
+			         and diff-<name>.html
+			* target_name - optional name of the target in the report
+			* diff_dir - directory of the report files
+		'''
+		self.ref_engine=ref_engine
+		self.target_engine=target_engine
+		self.name=name
+		self.target_name=target_name or 'target'
+		self.diff_dir=diff_dir
+		self.diff=None
+
+
+	def snapshot(self,engine):
+		''' Reads the schema of a database from its catalog and returns it as dict:
+
+				{
+				 'tables': {
+				  't1': {
+				   'columns': {'id': {'type': 'int', 'nullable': False, ...}, ...},
+				   'keys': {'PRIMARY KEY': {...}, 'fk_t1_t2': {...}},
+				   'indexes': {'ix_t1_name': {...}}
+				  }
+				 },
+				 'views': {'v1': '<normalized definition>'},
+				 ...
+				}
+
+			Primary keys are stored without their name, because generated names differ
+			between databases.
+		'''
+		logger=_getLogger('SchemaCompare')
+		tables={}
+		def table(name):
+			return tables.setdefault(name,{part: {} for part in TABLE_PARTS})
+
+		con=engine.connect()
+		try:
+			with execute_resultset(con,_COLUMNS) as res:
+				for (t,c,data_type,length,precision,scale,nullable,default,collation) in res.fetchall():
+					table(t)['columns'][c]={
+						'type': _column_type(data_type,length,precision,scale),
+						'nullable': nullable=='YES',
+						'default': default,
+						'collation': collation
+					}
+
+			with execute_resultset(con,_INDEXES) as res:
+				for (t,i,type_desc,unique,primary_key,unique_constraint,c,included) in res.fetchall():
+					if primary_key:
+						key=table(t)['keys'].setdefault('PRIMARY KEY',{'type': 'PRIMARY KEY', 'clustered': type_desc=='CLUSTERED', 'columns': []})
+						key['columns'].append(c)
+						continue
+					ix=table(t)['indexes'].setdefault(i,{
+						'type': type_desc,
+						'unique': bool(unique),
+						'constraint': bool(unique_constraint),
+						'columns': [],
+						'include': []
+					})
+					ix['include' if included else 'columns'].append(c)
+
+			with execute_resultset(con,_FOREIGN_KEYS) as res:
+				for (t,fk,c,referred_table,referred_column,ondelete,onupdate) in res.fetchall():
+					key=table(t)['keys'].setdefault(fk,{
+						'type': 'FOREIGN KEY',
+						'columns': [],
+						'references': referred_table,
+						'referred_columns': [],
+						'ondelete': ondelete,
+						'onupdate': onupdate
+					})
+					key['columns'].append(c)
+					key['referred_columns'].append(referred_column)
+
+			ret={'tables': tables}
+			for key in OBJECT_TYPES:
+				ret[key]={}
+			with execute_resultset(con,_MODULES) as res:
+				for (name,type_,definition) in res.fetchall():
+					ret[_MODULE_TYPES[type_.strip()]][name]=_definition(definition)
+		finally:
+			con.close()
+
+		logger.info('Read schema with %d tables from %s',len(tables),engine.url.database)
+		return ret
+
+
+	def compare(self,ref,target):
+		''' Returns the differences between two schema snapshots. Tables and objects are
+			compared with diff_dicts, and the parts of tables in both schemas as well:
+
+				{
+				 'tables': {'add': [...], 'drop': [...], 'modify': {'t1': {'columns': {...}, ...}}},
+				 'views': {'add': [...], 'drop': [...], 'modify': [...]},
+				 ...
+				}
+		'''
+		tables=diff_dicts(ref['tables'],target['tables'])
+		modify={}
+		for (name,ref_table,target_table) in tables['modify']:
+			modify[name]={
+				part: diff_dicts(ref_table[part],target_table[part])
+				for part in TABLE_PARTS
+			}
+		tables['modify']=modify
+		ret={'tables': tables}
+		for key in OBJECT_TYPES:
+			ret[key]=diff_dicts(ref[key],target[key])
+		return ret
+
+
+	@staticmethod
+	def has_differences(diff):
+		''' True, if a result of compare has any difference '''
+		return any(
+			diff[key]['add'] or diff[key]['drop'] or diff[key]['modify']
+			for key in ('tables',)+OBJECT_TYPES
+		)
+
+
+	def write_xml(self,diff,file_name):
+		''' Writes the differences as XML in the structure of WbSchemaDiff:
+
+				<schema-diff>
+				 <reference-connection>...</reference-connection>
+				 <target-connection>...</target-connection>
+				 <add-table name="t2"/>
+				 <modify-table name="t1">
+				  <add-column name="c2"><reference>...</reference></add-column>
+				  ...
+				 </modify-table>
+				 <update-view name="v1"/>
+				</schema-diff>
+		'''
+		root=ElementTree.Element('schema-diff')
+		ElementTree.SubElement(root,'reference-connection').text=self.name
+		ElementTree.SubElement(root,'target-connection').text=self.target_name
+
+		def describe(element,tag,value):
+			ElementTree.SubElement(element,tag).text=json.dumps(value,sort_keys=True)
+
+		tables=diff['tables']
+		for name in tables['add']:
+			ElementTree.SubElement(root,'add-table',name=name)
+		for name in tables['drop']:
+			ElementTree.SubElement(root,'drop-table',name=name)
+		for (name,parts) in sorted(tables['modify'].items()):
+			if not any(d['add'] or d['drop'] or d['modify'] for d in parts.values()):
+				continue
+			element=ElementTree.SubElement(root,'modify-table',name=name)
+			for part in TABLE_PARTS:
+				kind=part[:-1] if part!='indexes' else 'index'
+				for n in parts[part]['add']:
+					ElementTree.SubElement(element,'add-'+kind,name=n)
+				for n in parts[part]['drop']:
+					ElementTree.SubElement(element,'drop-'+kind,name=n)
+				for (n,ref,target) in parts[part]['modify']:
+					e=ElementTree.SubElement(element,'modify-'+kind,name=n)
+					describe(e,'reference',ref)
+					describe(e,'target',target)
+
+		for key in OBJECT_TYPES:
+			kind=key[:-1]
+			for name in diff[key]['add']:
+				ElementTree.SubElement(root,'add-'+kind,name=name)
+			for name in diff[key]['drop']:
+				ElementTree.SubElement(root,'drop-'+kind,name=name)
+			for (name,ref,target) in diff[key]['modify']:
+				ElementTree.SubElement(root,'update-'+kind,name=name)
+
+		ElementTree.ElementTree(root).write(file_name,encoding='utf-8')
+
+
+	def write_html(self,diff,file_name):
+		''' Writes the differences as HTML page rendered from templates/schema_diff.html '''
+		template=_jina_env.get_template(self.TEMPLATE)
+		with open(file_name,'w') as fh:
+			fh.write(template.render({
+				'name': self.name,
+				'target_name': self.target_name,
+				'diff': diff,
+				'table_parts': TABLE_PARTS,
+				'object_types': OBJECT_TYPES,
+				'has_differences': self.has_differences(diff)
+			}).encode('utf-8'))
+
+
+	def run(self):
+		''' Compares the schemas of both databases and writes the differences into
+			diff-<name>.xml and diff-<name>.html. Returns the differences.
+		'''
+		logger=_getLogger('SchemaCompare')
+		self.diff=self.compare(self.snapshot(self.ref_engine),self.snapshot(self.target_engine))
+
+		if not os.path.exists(self.diff_dir):
+			os.mkdir(self.diff_dir)
+		base=os.path.join(self.diff_dir,'diff-{}'.format(self.name))
+		self.write_xml(self.diff,base+'.xml')
+		self.write_html(self.diff,base+'.html')
+		if self.has_differences(self.diff):
+			logger.warn('The schemas differ - see %s.xml and %s.html',base,base)
+		else:
+			logger.info('The schemas are the same, report in %s.xml and %s.html',base,base)
+		return self.diff
+
+
 if __name__ == '__main__': # pragma: nocover
 
 	logging.basicConfig(
@@ -0,0 +1,100 @@
+import os
+from sqlalchemy.util import pickle
+
+from . import loggerFactory,large_columns
+from .codec import get_codec
+from .schema import write_schema,SCHEMA_FILE,FORMAT_VERSION
+from .storage import DirectoryStorage,ArchiveStorage,ARCHIVE_SUFFIX,open_storage
+from .blocks import Manifest,IndexEntry,LargeValue,table_file_name,index_file_name,block_digest,table_checksum,\
+	write_block,write_large_value,read_large_value,write_index_entry
+
+
+_getLogger=loggerFactory('convert')
+
+
+class Convert(object):
+	''' Converts a format v1 backup with pickled blocks and meta data into a format v2
+		backup with binary blocks and a JSON schema manifest. The v1 backup must be
+		trusted, because its meta data and blocks are unpickled.
+	'''
+
+	def __init__(self,source,target):
+		''' Constructor
+
+			* source - location of the v1 backup, a directory or tar archive
+			* target - location of the new v2 backup, a directory or, if it
+			           ends with .tar, an archive
+		'''
+		self.source=source
+		self.target=target
+		self.source_storage=open_storage(source)
+		if target.endswith(ARCHIVE_SUFFIX):
+			self.target_storage=ArchiveStorage(target,'w')
+		else:
+			if not os.path.exists(target):
+				os.makedirs(target)
+			self.target_storage=DirectoryStorage(target)
+		self.codec=get_codec('binary')
+
+
+	def run(self):
+		''' Converts all tables and writes the schema manifest
+		'''
+		logger=_getLogger('run')
+		if self.source_storage.exists(SCHEMA_FILE):
+			raise Exception('{} is not a format v1 backup'.format(self.source))
+		with self.source_storage.open_read('_metadata.pickle') as fh:
+			info=pickle.load(fh)
+		logger.info('Converting %s into %s',self.source,self.target)
+
+		manifest=Manifest(self.target_storage)
+		for (table_name,table) in info['meta'].tables.iteritems():
+			entries=self.convert_table(table)
+			manifest.mark_complete(table_name,sum([e.rows for e in entries]),len(entries),table_checksum(entries))
+		manifest.save()
+
+		info['format']=FORMAT_VERSION
+		info['codec']=self.codec.name
+		write_schema(self.target_storage,info)
+		self.target_storage.close()
+		logger.info('%d tables converted',len(info['meta'].tables))
+
+
+	def convert_table(self,table):
+		''' Re-encodes the blocks of a table file and copies the chunks of its large
+			values. The block index is written for the new table file and its entries
+			are returned.
+		'''
+		logger=_getLogger('convert_table')
+		source_name=table_file_name(table.name,1)
+		target_name=table_file_name(table.name,FORMAT_VERSION)
+		large=[c.name for c in large_columns(table)]
+		entries=[]
+		offset=0
+
+		logger.info('Converting %s',source_name)
+		with self.source_storage.open_read(source_name) as fh,\
+			self.target_storage.open_write(target_name) as out,\
+			self.target_storage.open_write(index_file_name(target_name)) as ix:
+
+			l=fh.readline()
+			while l and l!='EOF':
+				rows=pickle.loads(fh.read(int(l)))
+				buf=self.codec.encode(rows)
+
+				digest=block_digest(buf)
+				length=write_block(out,buf)
+				# the chunks of large values follow the block in the order of the rows
+				# and their large columns
+				for row in rows:
+					for c in large:
+						if isinstance(row[c],LargeValue):
+							length+=write_large_value(out,read_large_value(fh,row[c]),digest)
+
+				entry=IndexEntry(offset,length,len(rows),digest.hexdigest())
+				write_index_entry(ix,entry)
+				entries.append(entry)
+				offset+=length
+				l=fh.readline()
+			out.write('EOF')
+		return entries
@@ -0,0 +1,186 @@
+from collections import namedtuple
+from contextlib import closing
+from multiprocessing.pool import ThreadPool
+import sqlalchemy as sa
+
+from . import loggerFactory,execute_resultset
+
+
+_getLogger=loggerFactory('datacompare')
+
+TableCheck=namedtuple('TableCheck',('table','ref_rows','target_rows','ok','keys'))
+''' Result of the compare of one table. keys has tuples of the differing primary keys
+	and missing, extra or changed, ok is None for tables that couldn't be compared.
+'''
+
+RANGES=16
+''' Number of primary key ranges a table is split into '''
+
+MIN_RANGE=32
+''' Ranges with fewer rows on both sides are not split further, their rows are
+	compared by key
+'''
+
+_NONCOMPARABLE=(sa.TEXT,sa.types.Text,sa.LargeBinary)
+
+
+def row_checksum(table):
+	''' Returns the BINARY_CHECKSUM expression over the columns of a table. Columns
+		of types that BINARY_CHECKSUM doesn't accept, like text and image, are
+		represented by their DATALENGTH.
+	'''
+	return sa.func.binary_checksum(*[
+		sa.func.datalength(c) if isinstance(c.type,_NONCOMPARABLE) else c
+		for c in table.columns
+	])
+
+
+class DataCompare(object):
+	''' Verifies that the data of two databases with the same schema, like the source
+		and the target of a restore, is the same. The tables are compared in parallel.
+		For each table the row count and CHECKSUM_AGG of the row checksums are compared,
+		which the database calculates. If they differ, the primary key range of the
+		table is split into ranges with NTILE and each range is compared the same way.
+		Ranges that differ are bisected, until they are small enough to compare the
+		checksums of the single rows. So only the aggregates and the keys of small
+		ranges are transferred, not the data.
+
+		Tables without a single column primary key are only compared as a whole.
+	'''
+
+	def __init__(self,ref_engine,target_engine,meta,workers=4,ranges=RANGES,min_range=MIN_RANGE):
+		''' Constructor:
+
+			* ref_engine - SQLAlchemy engine of the reference database
+			* target_engine - SQLAlchemy engine of the database that is verified
+			* meta - meta data with the tables to compare
+			* workers - number of tables that are compared at the same time
+			* ranges - number of key ranges a table with differences is split into
+			* min_range - ranges with fewer rows are compared row by row
+		'''
+		self.ref_engine=ref_engine
+		self.target_engine=target_engine
+		self.meta=meta
+		self.workers=workers
+		self.ranges=ranges
+		self.min_range=min_range
+
+
+	def run(self):
+		''' Compares all tables of the meta data and returns a list of TableCheck
+			results ordered by table name
+		'''
+		logger=_getLogger('DataCompare')
+		names=sorted(self.meta.tables.keys())
+		pool=ThreadPool(self.workers)
+		try:
+			results=pool.map(self.compare_table,names)
+		finally:
+			pool.close()
+			pool.join()
+		failed=[r for r in results if not r.ok]
+		if failed:
+			logger.warn('%d of %d tables differ: %s',len(failed),len(results),', '.join([r.table for r in failed]))
+		else:
+			logger.info('The data of all %d tables is the same',len(results))
+		return results
+
+
+	def compare_table(self,table_name):
+		''' Compares one table over its own connections to both databases and returns
+			the TableCheck result
+		'''
+		logger=_getLogger('compare_table')
+		table=self.meta.tables[table_name]
+		with closing(self.ref_engine.connect()) as ref,closing(self.target_engine.connect()) as target:
+			(ref_rows,ref_sum)=self._aggregate(ref,table)
+			(target_rows,target_sum)=self._aggregate(target,table)
+			if (ref_rows,ref_sum)==(target_rows,target_sum):
+				logger.info('%s: %d rows are the same',table_name,ref_rows)
+				return TableCheck(table_name,ref_rows,target_rows,True,[])
+
+			pk=list(table.primary_key.columns)
+			if len(pk)!=1:
+				logger.warn('%s: data differs, the rows can\'t be located without single column primary key',table_name)
+				return TableCheck(table_name,ref_rows,target_rows,False,[])
+
+			keys=[]
+			bounds=self._bounds(ref,table,pk[0],None,None,self.ranges)
+			for (lo,hi) in zip([None]+bounds,bounds+[None]):
+				keys.extend(self._bisect(ref,target,table,pk[0],lo,hi))
+			logger.warn('%s: %d rows differ',table_name,len(keys))
+			return TableCheck(table_name,ref_rows,target_rows,False,keys)
+
+
+	def _range(self,pk,lo,hi):
+		# helper method that returns the condition of the key range lo < pk <= hi,
+		# where None is an open end
+		conditions=[]
+		if lo is not None:
+			conditions.append(pk>lo)
+		if hi is not None:
+			conditions.append(pk<=hi)
+		return sa.and_(*conditions) if conditions else sa.true()
+
+
+	def _aggregate(self,con,table,condition=None):
+		''' Helper method that returns the row count and the checksum aggregate of a
+			table, or of the rows matching the condition
+		'''
+		select=sa.select([sa.func.count(),sa.func.checksum_agg(row_checksum(table))]).select_from(table)
+		if condition is not None:
+			select=select.where(condition)
+		with execute_resultset(con,select) as res:
+			(count,checksum)=res.fetchone()
+		return (count,checksum if count else None)
+
+
+	def _bounds(self,con,table,pk,lo,hi,n):
+		''' Helper method that splits the key range lo < pk <= hi into n ranges of the
+			same number of rows with NTILE and returns the upper bounds of all but the
+			last range
+		'''
+		tiles=sa.select([pk.label('pk'),sa.func.ntile(n).over(order_by=pk).label('tile')])\
+			.where(self._range(pk,lo,hi)).alias('tiles')
+		select=sa.select([sa.func.max(tiles.c.pk)]).group_by(tiles.c.tile).order_by(sa.func.max(tiles.c.pk))
+		with execute_resultset(con,select) as res:
+			bounds=[r[0] for r in res.fetchall()]
+		return bounds[:-1]
+
+
+	def _bisect(self,ref,target,table,pk,lo,hi):
+		''' Helper method that returns the differing keys in the key range lo < pk <= hi.
+			Ranges with the same row count and checksum on both sides are skipped,
+			small ranges are compared by the checksums of their rows, larger ones are
+			split in half.
+		'''
+		condition=self._range(pk,lo,hi)
+		(ref_rows,ref_sum)=self._aggregate(ref,table,condition)
+		(target_rows,target_sum)=self._aggregate(target,table,condition)
+		if (ref_rows,ref_sum)==(target_rows,target_sum):
+			return []
+
+		if max(ref_rows,target_rows)>self.min_range:
+			bounds=self._bounds(ref if ref_rows>=target_rows else target,table,pk,lo,hi,2)
+			if bounds and bounds[0]!=hi:
+				_getLogger('_bisect').debug('%s: bisecting range %r - %r at %r',table.name,lo,hi,bounds[0])
+				return self._bisect(ref,target,table,pk,lo,bounds[0])+self._bisect(ref,target,table,pk,bounds[0],hi)
+
+		ref_checksums=self._row_checksums(ref,table,pk,condition)
+		target_checksums=self._row_checksums(target,table,pk,condition)
+		keys=[]
+		for key in sorted(set(ref_checksums)|set(target_checksums)):
+			if key not in target_checksums:
+				keys.append((key,'missing'))
+			elif key not in ref_checksums:
+				keys.append((key,'extra'))
+			elif ref_checksums[key]!=target_checksums[key]:
+				keys.append((key,'changed'))
+		return keys
+
+
+	def _row_checksums(self,con,table,pk,condition):
+		# helper method that returns the checksums of the rows in a key range by key
+		select=sa.select([pk,row_checksum(table)]).where(condition)
+		with execute_resultset(con,select) as res:
+			return {r[0]: r[1] for r in res.fetchall()}
@@ -1,20 +1,37 @@
 import sqlalchemy as sa
+from sqlalchemy import event
 import os
+import json
+import posixpath
 import pytz
 import re
+from contextlib import contextmanager
 from datetime import datetime
-from sqlalchemy.util import pickle,byte_buffer
+from sqlalchemy.util import pickle
 
-from . import ObjectDef,loggerFactory,transaction,execute_resultset,DumpRestoreBase
+from . import ObjectDef,loggerFactory,transaction,execute_resultset,large_columns,DumpRestoreBase,filter_names,referenced_tables,trigger_table
+from .storage import DirectoryStorage,ArchiveStorage,StreamStorage,StripedStorage,ARCHIVE_SUFFIX,stripe_paths
+from .objectstore import ObjectStoreStorage,is_object_store
+from .codec import get_codec
+from .subset import Subset,key_condition,batches
+from .schema import write_schema
+from .report import Report,REPORT_FILE
+from .blocks import TRAILER_FILE,table_file_name,Manifest,IndexEntry,LargeValue,LARGE_VALUE_CHUNK,block_digest,table_checksum,write_block,write_large_value,index_file_name,write_index_entry,read_index
 
 BLOCK_SIZE=500
 
+TRAILER_KEYS=('snapshot','subset','finished')
+''' Keys of the info, that are set after the tables were dumped and are written into
+	the trailer of a stream
+'''
+
 _getLogger=loggerFactory('Dump')
 
 class Dump(DumpRestoreBase):
 	''' Class to handle database dumps '''
 
-	def __init__(self,backup_dir,meta_data_dir,engine,db_name,db_server):
+	def __init__(self,backup_dir,meta_data_dir,engine,db_name,db_server,resume_dir=None,consistent=False,stream_results=False,archive=False,stream=None,object_store=None,stripe_dirs=None,stripe_policy='round-robin',format=1,
+			tables=None,exclude_tables=None,where=None,subset=None):
 		''' Constructor
 
 			* backup_dir - parent directory in which the database directory will be created
@@ -22,37 +39,155 @@ class Dump(DumpRestoreBase):
 			* engine - The engine instance in use
 			* db_name - the name of the database that is backed up
 			* db_server - the name of the server on which the daase resides
+			* resume_dir - optional directory of an interrupted backup that should
+			               be continued instead of starting a new one
+			* consistent - read all tables within one snapshot transaction, so the
+			               table data is consistent to a single point in time
+			* stream_results - fetch the table data with streaming cursors and a
+			               bounded row buffer
+			* archive - write the backup into a single tar archive instead of a
+			               directory
+			* stream - optional file object, like stdout, into which the backup is
+			               written as a single stream. Nothing is written to disk.
+			* object_store - optional client for backups into an object store, when
+			               backup_dir is an s3://<bucket>/<prefix> location
+			* stripe_dirs - optional list of further parent directories, across which
+			               the table files are striped
+			* stripe_policy - round-robin or free-space placement of the table files
+			* format - 1 for pickled blocks and meta data, 2 for binary blocks and a
+			               JSON schema manifest
+			* tables - optional list of wildcard patterns of the tables to dump
+			* exclude_tables - optional list of wildcard patterns of tables that
+			               are not dumped
+			* where - optional dict of table name patterns and SQL conditions, only
+			               rows matching the condition are dumped for these tables
+			* subset - optional dict of table name patterns and SQL conditions of
+			               seed rows. Only these rows and the rows they reference
+			               are dumped (see Subset).
 			
 			The method creates a target directory for the backup: 
 
 				<backup_dir>/<db_name>@<db_server>-<utc timestamp>
+
+			or the archive <backup_dir>/<db_name>@<db_server>-<utc timestamp>.tar
 		'''
 		super(Dump,self).__init__(backup_dir,engine)
 		self.meta_data_dir=meta_data_dir
 		self.db_name=db_name
 		self.db_server=db_server
-
-		self.backup_dir=os.path.join(
-			backup_dir if backup_dir else '.',
-			'{}@{}-{}'.format(db_name,db_server,datetime.utcnow().strftime('%Y%m%d-%H%M'))
-		)
-		if not os.path.exists(self.backup_dir):
-			os.makedirs(self.backup_dir)
-			_getLogger('Dump').info('Backup dir %s created',backup_dir)
+		self.consistent=consistent
+		self.stream_results=stream_results
+		if format not in (1,2):
+			raise Exception('Invalid backup format {}'.format(format))
+		self.format=format
+		self.codec=get_codec('binary' if format==2 else 'pickle')
+		self.info['format']=format
+		self.info['codec']=self.codec.name
+		self.tables=tables or []
+		self.exclude_tables=exclude_tables or []
+		self.where=where or {}
+		if self.tables or self.exclude_tables or self.where:
+			self.info['filter']={
+				'tables': self.tables,
+				'exclude_tables': self.exclude_tables,
+				'where': self.where
+			}
+		self.subset=subset or {}
+		self.subset_keys=None
+		if self.subset:
+			self.info['subset']={'seeds': self.subset}
+		else:
+			# the rows of tables with a primary key are dumped in key order (see
+			# _select_table), which merge restores rely on
+			self.info['pk_ordered']=True
+
+		if stream is not None:
+			if resume_dir or archive:
+				raise Exception('Backups into streams can\'t be resumed or archived')
+			self.storage=StreamStorage(stream,'w')
+			self.backup_dir=self.storage.name
+		elif resume_dir:
+			if archive:
+				raise Exception('Backups into archives can\'t be resumed')
+			if not os.path.isdir(resume_dir):
+				raise Exception('Backup dir {} to resume does not exist'.format(resume_dir))
+			self.backup_dir=resume_dir
+			self.storage=DirectoryStorage(self.backup_dir)
+			_getLogger('Dump').info('Resuming backup in %s',resume_dir)
+		elif is_object_store(backup_dir):
+			if archive:
+				raise Exception('Backups into object stores can\'t be archived')
+			self.backup_dir=posixpath.join(
+				backup_dir,
+				'{}@{}-{}'.format(db_name,db_server,datetime.utcnow().strftime('%Y%m%d-%H%M'))
+			)
+			self.storage=ObjectStoreStorage(object_store,self.backup_dir,'w')
+		else:
+			self.backup_dir=os.path.join(
+				backup_dir if backup_dir else '.',
+				'{}@{}-{}'.format(db_name,db_server,datetime.utcnow().strftime('%Y%m%d-%H%M'))
+			)
+			parent_dir=os.path.dirname(self.backup_dir) if archive else self.backup_dir
+			if not os.path.exists(parent_dir):
+				os.makedirs(parent_dir)
+				_getLogger('Dump').info('Backup dir %s created',parent_dir)
+
+			if archive:
+				self.backup_dir+=ARCHIVE_SUFFIX
+				self.storage=ArchiveStorage(self.backup_dir,'w')
+			else:
+				self.storage=DirectoryStorage(self.backup_dir)
+
+		if stripe_dirs:
+			if not isinstance(self.storage,DirectoryStorage):
+				raise Exception('Only backup directories can be striped')
+			paths=[self.backup_dir]+stripe_paths(self.backup_dir,stripe_dirs)
+			for path in paths[1:]:
+				if not os.path.exists(path):
+					os.makedirs(path)
+					_getLogger('Dump').info('Stripe dir %s created',path)
+			self.storage=StripedStorage(paths,stripe_policy)
+
+		self.manifest=Manifest(self.storage)
+		self.report=Report('dump')
 
 
 	def run(self): # pragma: nocover
-		''' Main worker method that performs the complete backup process
+		''' Main worker method that performs the complete backup process. The time of
+			every phase and table is recorded in the report _report.json of the backup.
+		'''
+		report=self.report
+		with report.phase('get_meta_data'):
+			self.get_meta_data()
+		with report.phase('fix_primary_key_order'):
+			self.fix_primary_key_order()
+		with report.phase('fix_indexes_with_included_columns'):
+			self.fix_indexes_with_included_columns()
+		if self.storage.sequential:
+			# a stream is restored in one pass, so the meta data goes first
+			with report.phase('get_object_definitions'):
+				self.get_object_definitions()
+			with report.phase('write_meta_data'):
+				self.write_meta_data()
+			with report.phase('backup_tables'):
+				self.backup_tables()
+		else:
+			with report.phase('backup_tables'):
+				self.backup_tables()
+			with report.phase('get_object_definitions'):
+				self.get_object_definitions()
+		self.finsih_backup()
+		report.log_summary()
+		report.finish()
+
+
+	def get_object_definitions(self):
+		''' Reads the definitions of procedures, functions, triggers and views
 		'''
-		self.get_meta_data()
-		self.fix_primary_key_order()
-		self.fix_indexes_with_included_columns()
-		self.backup_tables()
 		self.get_procedures()
 		self.get_functions()
 		self.get_triggers()
 		self.get_views()
-		self.finsih_backup()
 
 
 	def get_meta_data(self):
@@ -72,54 +207,401 @@ class Dump(DumpRestoreBase):
 		if meta is None:
 			logger.info('Reflecting the database meta data - this will take some time...')
 			meta=sa.MetaData()
-			meta.reflect(bind=self.engine)
+			if pickle_name or not self.filtered:
+				meta.reflect(bind=self.engine)
+			else:
+				# the cache always has the complete meta data
+				meta.reflect(bind=self.engine,only=lambda name,meta: bool(self.filter_tables([name])))
 			logger.info('Reflected database')
 			if pickle_name:
 				pickle.dump(meta, open(pickle_name,'wb'))
 				logger.info('Refelected metadata chached in %s',pickle_name)
 
+		if self.filtered:
+			self._filter_meta_data(meta)
 		self.info['meta']=meta
 		return meta
 
 
- 	def backup_tables(self,):
- 		''' Iterates over all backup tables and writes them into individual pickle files.
- 			Each table file is made of blocks with pickeled row data preced by a line that
- 			contains the size of the block in bytes:
+	@property
+	def filtered(self):
+		''' True, if only some tables are dumped '''
+		return bool(self.tables or self.exclude_tables)
+
+
+	def filter_tables(self,names):
+		''' Returns the table names that match the table patterns of the dump and
+			none of its exclude patterns
+		'''
+		return filter_names(names,self.tables,self.exclude_tables)
+
+
+	def _filter_meta_data(self,meta):
+		''' Helper method that removes the tables, that aren't dumped, from the meta
+			data. Tables referenced by the foreign keys of dumped tables are kept, so
+			the backup can be restored with RI checks.
+		'''
+		logger=_getLogger('_filter_meta_data')
+		selected=set(self.filter_tables(meta.tables.keys()))
+		if not selected:
+			raise Exception('No tables in the database match {}'.format(', '.join(self.tables or ['*'])))
+		pending=list(selected)
+		while pending:
+			for name in referenced_tables(meta.tables[pending.pop()]):
+				if name not in selected and name in meta.tables:
+					logger.warn('Table %s is referenced by a dumped table and dumped as well',name)
+					selected.add(name)
+					pending.append(name)
+		for (name,table) in meta.tables.items():
+			if name not in selected:
+				meta.remove(table)
+		logger.info('Dumping %d tables',len(meta.tables))
+
+
+	def _table_condition(self,table):
+		''' Helper method that returns the SQL condition for the rows of a table, or
+			None if all rows are dumped. The first matching pattern of the where
+			option is used.
+		'''
+		for pattern in sorted(self.where.keys()):
+			if filter_names([table.name],[pattern]):
+				return sa.text(self.where[pattern])
+		return None
+
+
+	def backup_tables(self):
+		''' Iterates over all backup tables and writes them into individual table files.
+			Each table file is made of blocks with the serialized row data preced by a line
+			that contains the size of the block in bytes:
+
+				117536\n
+				....17536 bytes of row data...
+				1200\n
+				...1200 bytes of row data...
+
+			The rows are pickled in format v1 and written with the BinaryCodec in format v2.
+
+			Values of large columns that exceed LARGE_VALUE_CHUNK characters are not part
+			of the serialized rows, but follow their block in chunks (see write_large_value).
+
+			Next to each table file a block index <table>.idx records offset, size, rows
+			and checksum of every block. Completed tables are recorded in the manifest,
+			which allows to resume an interrupted backup: completed tables are skipped
+			and partial table files are truncated to their last complete block before
+			the remaining rows are fetched.
+
+			In consistent mode all tables are read in one snapshot transaction.
+		'''
+		with self._snapshot():
+			self._backup_tables()
+
+
+	@contextmanager
+	def _snapshot(self):
+		''' Context manager that wraps the table backup in a single transaction with
+			SNAPSHOT isolation, if the dump runs in consistent mode. The per table
+			transactions become nested transactions and all tables are read from the
+			same version of the database. The start time of the snapshot transaction
+			is recorded in the backup info.
+
+			SQL Server can't share a snapshot between sessions, so consistent dumps
+			always read all tables over one connection.
+		'''
+		logger=_getLogger('_snapshot')
+		if not self.consistent:
+			yield
+			return
+
+		with execute_resultset(self.con,'select snapshot_isolation_state from sys.databases where database_id=db_id()') as res:
+			if not res.fetchone()[0]:
+				msg='Snapshot isolation is not allowed for database {} - enable it with ALTER DATABASE {} SET ALLOW_SNAPSHOT_ISOLATION ON'.format(self.db_name,self.db_name)
+				logger.error(msg)
+				raise Exception(msg)
 
- 				117536\n
- 				....17536 bytes of pickled row data...
- 				1200\n
- 				...1200 bytes of pickled row data...
- 		'''
+		if len(self.manifest.tables)>0:
+			logger.warn('Resumed backup - tables from the previous run were read from an older snapshot')
+
+		self.con.execute('SET TRANSACTION ISOLATION LEVEL SNAPSHOT')
+		try:
+			with transaction(self.con):
+				with execute_resultset(self.con,'select sysutcdatetime()') as res:
+					started=res.fetchone()[0]
+				self.info['snapshot']={
+					'isolation': 'SNAPSHOT',
+					'started': started.strftime('%Y-%m-%dT%H:%M:%S.%f')
+				}
+				logger.info('Snapshot transaction started at %s',self.info['snapshot']['started'])
+				yield
+		finally:
+			self.con.execute('SET TRANSACTION ISOLATION LEVEL READ COMMITTED')
+
+
+	def _backup_tables(self):
+		''' Helper method that writes the table files for backup_tables
+		'''
 		logger=_getLogger('backup_tables')
 		meta=self.info['meta']
+		if self.subset and self.subset_keys is None:
+			logger.info('Collecting the rows of the subset')
+			self.subset_keys=Subset(self.con,meta,self.subset).collect()
+			self.info['subset']['rows']={name: len(keys) for (name,keys) in self.subset_keys.items()}
 
 		for (table_name,table) in meta.tables.iteritems():
-			file_name=os.path.join(self.backup_dir,'{}.pickle'.format(table_name))
+			if self.manifest.is_complete(table_name):
+				logger.info('Table %s is already complete - skipped',table_name)
+				continue
+
+			file_name=table_file_name(table_name,self.format)
+			index_name=index_file_name(file_name)
+			entries=self._truncate_partial_table(table,file_name,index_name)
+			offset=entries[-1].offset+entries[-1].length if entries else 0
+			rows_done=sum([e.rows for e in entries])
 
 			logger.info('Fetch data from %s',table_name) 
-			with transaction(self.con):
-				res=self.con.execute(table.select())
+			with transaction(self.con), self.report.table(table_name) as stats:
+				large=large_columns(table)
+				if self.subset_keys is not None:
+					res=None
+					blocks=self._fetch_subset_blocks(table,self.subset_keys[table_name],rows_done)
+				elif large and len(list(table.primary_key.columns))==1:
+					logger.debug('   table has large columns: %s',','.join([c.name for c in large]))
+					res=None
+					blocks=self._fetch_blocks_with_large_columns(table,large,rows_done)
+				else:
+					res=self._execute_table_select(self._select_table(table,rows_done))
+					blocks=self._fetch_blocks(res)
 
-				with open(file_name,'wb') as fh:
-					rows=res.fetchmany(BLOCK_SIZE)
-					
-					while len(rows)>0:
+				append=len(entries)>0
+				with self.storage.open_write(file_name,append) as fh, self.storage.open_write(index_name,append) as ix:
+					for (rows,large_values) in stats.timed('fetch',blocks):
 						logger.debug("  Got %d rows - writing to backup file",len(rows))
 						
-						buf=byte_buffer()
-						pickle.dump(rows,buf)
-						buf=buf.getvalue()
-
-						fh.write('{}\n'.format(len(buf)))
-						fh.write(buf)
-
-						rows=res.fetchmany(BLOCK_SIZE)
+						with stats.timer('serialize'):
+							buf=self.codec.encode(rows)
+							digest=block_digest(buf)
+
+						# the chunks of large values are fetched while they are written
+						with stats.timer('write'):
+							length=write_block(fh,buf)
+							for chunks in large_values:
+								length+=write_large_value(fh,chunks,digest)
+							fh.flush()
+
+							entry=IndexEntry(offset,length,len(rows),digest.hexdigest())
+							write_index_entry(ix,entry)
+						entries.append(entry)
+						offset+=length
+						stats.add(rows=len(rows),bytes=length,blocks=1)
+
+						# release the block before the next one is fetched, so only
+						# one block is held in memory at any time
+						del rows,large_values,buf
 					fh.write("EOF")
 
 				logger.info("Written backup to %s",file_name)
-				res.close()
+				if res is not None:
+					res.close()
+
+			self.manifest.mark_complete(
+				table_name,
+				sum([e.rows for e in entries]),
+				len(entries),
+				table_checksum(entries)
+			)
+
+
+	def _fetch_blocks(self,res):
+		''' Generator that fetches the rows of a result set in blocks. It yields
+			tuples of the rows and an empty list of large values.
+		'''
+		while True:
+			rows=res.fetchmany(BLOCK_SIZE)
+			if len(rows)==0:
+				break
+			yield (rows,[])
+			del rows
+
+
+	def _fetch_subset_blocks(self,table,keys,skip=0):
+		''' Generator that fetches the rows of a table in a subset dump. The rows are
+			selected by their keys in batches, which are yielded as blocks with an
+			empty list of large values. Subsets are meant to be small, so large values
+			are fetched with their rows.
+
+			* table - the table to backup
+			* keys - the sorted keys of the rows in the subset
+			* skip - number of rows already in the backup
+
+			Tables without rows in the subset, like tables without a primary key, yield
+			no blocks.
+		'''
+		keys=keys[skip:]
+		if not keys:
+			return
+		columns=list(table.primary_key.columns)
+		for batch in batches(keys,columns):
+			select=table.select().where(key_condition(columns,batch)).order_by(*columns)
+			with execute_resultset(self.con,select) as res:
+				rows=res.fetchall()
+			yield (rows,[])
+			del rows
+
+
+	def _fetch_blocks_with_large_columns(self,table,large,skip=0):
+		''' Generator that fetches the blocks of a table with large columns. Only the
+			first LARGE_VALUE_CHUNK characters of the large columns are selected with the
+			rows, together with the DATALENGTH of the values. Longer values are replaced
+			by a LargeValue marker in the row and read in chunks with SUBSTRING, while they
+			are written to the table file after the block. That way no value is ever held
+			in memory completely.
+
+			The blocks are paged by primary key, so the result of each page is closed
+			before the chunks are read over the same connection. It yields tuples of
+			the rows and a list of chunk generators for the marked values.
+
+			* table - the table to backup
+			* large - the large columns of the table
+			* skip - number of rows already in the backup
+		'''
+		pk=list(table.primary_key.columns)[0]
+		large_names=set([c.name for c in large])
+		columns=[
+			sa.func.substring(c,1,LARGE_VALUE_CHUNK).label(c.name) if c.name in large_names else c
+			for c in table.columns
+		]
+		columns+=[sa.func.datalength(c).label('datalength_'+c.name) for c in large]
+		select=sa.select(columns).order_by(pk).limit(BLOCK_SIZE)
+		condition=self._table_condition(table)
+		if condition is not None:
+			select=select.where(condition)
+
+		last=None
+		while True:
+			if last is not None:
+				page=select.where(pk>last)
+			elif skip:
+				page=select.offset(skip)
+			else:
+				page=select
+			with execute_resultset(self.con,page) as res:
+				fetched=res.fetchall()
+			if len(fetched)==0:
+				break
+
+			rows=[]
+			large_values=[]
+			for r in fetched:
+				row={ c.name: r[c.name] for c in table.columns }
+				for c in large:
+					value=row[c.name]
+					if value is None:
+						continue
+					length=r['datalength_'+c.name]/(2 if isinstance(c.type,(sa.Unicode,sa.UnicodeText)) else 1)
+					if length>len(value):
+						row[c.name]=LargeValue(c.name,length,isinstance(value,unicode))
+						large_values.append(self._large_value_chunks(pk,r[pk.name],c,value,length))
+				rows.append(row)
+			last=fetched[-1][pk.name]
+			del fetched
+
+			yield (rows,large_values)
+			del rows,large_values
+
+
+	def _large_value_chunks(self,pk,pk_value,col,first_chunk,length):
+		''' Generator that returns the chunks of a large value. The first chunk has
+			been selected with the row, the remaining ones are read with SUBSTRING.
+
+			* pk - the primary key column of the table
+			* pk_value - primary key of the row
+			* col - the large column
+			* first_chunk - the start of the value, which was read with the row
+			* length - length of the value in characters
+		'''
+		_getLogger('_large_value_chunks').debug('Reading large value of %s in row with pk %s',col.name,str(pk_value))
+		yield first_chunk
+
+		select=sa.select([sa.func.substring(col,sa.bindparam('pos'),LARGE_VALUE_CHUNK)]).where(pk==pk_value)
+		pos=len(first_chunk)+1
+		while pos<=length:
+			with execute_resultset(self.con,select,pos=pos) as res:
+				chunk=res.fetchone()[0]
+			if not chunk:
+				break
+			yield chunk
+			pos+=len(chunk)
+
+
+	def _execute_table_select(self,select):
+		''' Executes the select statement for the data of a table. In streaming mode
+			the arraysize of the DBAPI cursor is set to one block before the statement
+			is executed, and dialects with server side cursors stream the result with a
+			row buffer of one block. The blocks are fetched with fetchmany (see
+			_fetch_blocks). Dialects without server side cursors, like mssql+pyodbc in
+			SQLAlchemy 1.0, ignore stream_results, how many rows their driver buffers
+			depends on the driver.
+		'''
+		if not self.stream_results:
+			return self.con.execute(select)
+
+		def set_arraysize(conn,cursor,statement,parameters,context,executemany):
+			cursor.arraysize=BLOCK_SIZE
+
+		con=self.con.execution_options(stream_results=True,max_row_buffer=BLOCK_SIZE)
+		event.listen(con,'before_cursor_execute',set_arraysize)
+		try:
+			return con.execute(select)
+		finally:
+			event.remove(con,'before_cursor_execute',set_arraysize)
+
+
+	def _select_table(self,table,skip=0):
+		''' Returns the select statement to fetch the data of a table. Tables with a
+			primary key are read in key order, so a partial table can be continued
+			by skipping the rows that are already in the backup. Only the rows matching
+			the condition of the table in the where option are selected.
+		'''
+		select=table.select()
+		condition=self._table_condition(table)
+		if condition is not None:
+			select=select.where(condition)
+		pk=list(table.primary_key.columns)
+		if pk:
+			select=select.order_by(*pk)
+		if skip:
+			select=select.offset(skip)
+		return select
+
+
+	def _truncate_partial_table(self,table,file_name,index_name):
+		''' Helper method for resumed backups that cuts a partial table file and its
+			block index back to the last complete block and returns the remaining index
+			entries. Tables without primary key can't be continued reliable and are
+			started from scratch.
+		'''
+		logger=_getLogger('_truncate_partial_table')
+		if not self.storage.exists(file_name):
+			return []
+
+		entries=[]
+		if self.storage.exists(index_name):
+			with self.storage.open_read(index_name) as ix:
+				entries=read_index(ix)
+		size=self.storage.size(file_name)
+		entries=[e for e in entries if e.offset+e.length<=size]
+		if entries and not list(table.primary_key.columns):
+			logger.warn('Table %s has no primary key - restarting it from scratch',table.name)
+			entries=[]
+
+		end=entries[-1].offset+entries[-1].length if entries else 0
+		self.storage.truncate(file_name,end)
+		with self.storage.open_write(index_name) as ix:
+			for e in entries:
+				write_index_entry(ix,e)
+
+		logger.info('Partial table file %s truncated to %d blocks with %d rows',
+			file_name,len(entries),sum([e.rows for e in entries]))
+		return entries
 
 
 	def fix_indexes_with_included_columns(self):
@@ -269,7 +751,8 @@ class Dump(DumpRestoreBase):
 	def get_views(self):
 		''' Retrieves all view objects from the data dictionary and preserves
 			them in the current backup info. The views are ordered by their
-			dependencies, so they can be recreated without missing dependencies
+			dependencies, so they can be recreated without missing dependencies.
+			Filtered dumps skip the views depending on tables that are not dumped.
 		'''
 		logger=_getLogger('get_views')
 		logger.info('Retrieving all views')
@@ -312,6 +795,10 @@ class Dump(DumpRestoreBase):
 					ordered_views.append(view)
 				else:
 					remaining_views.append(view)
+			if len(new_views)==len(remaining_views) and self.filtered:
+				logger.warn('Views depending on tables, that are not dumped, are skipped: %s',
+					', '.join([x.name for x in remaining_views]))
+				break
 			if len(new_views)==len(remaining_views):
 				msg='No changes were made during ordering views'
 				logger.error('No changes were made during ordering views')
@@ -362,7 +849,8 @@ class Dump(DumpRestoreBase):
 
 	def get_triggers(self):
 		''' Fetches all trigger databaase objects from the data dictionary and
-			preserves them in the current backup info.
+			preserves them in the current backup info. Filtered dumps only keep
+			the triggers of the dumped tables.
 		'''
 		logger=_getLogger('get_triggers')
 		logger.info('Retrieving all triggers')
@@ -375,19 +863,44 @@ class Dump(DumpRestoreBase):
 			return ObjectDef(objdef.name, text, objdef.dependencies)
 
 		self.info['triggers']=map(fix_view_name,self.info['triggers'])
+		if self.filtered:
+			tables=set(n.lower() for n in self.meta.tables.keys())
+			self.info['triggers']=[t for t in self.info['triggers'] if trigger_table(t.defintion) in tables]
 		return self.info['triggers']
 
 
+	def write_meta_data(self):
+		''' Persists the info object as _metadata.pickle in the backup, or as schema
+			manifest _schema.json and schema entries _schema.jsonl in format v2
+		'''
+		if self.format==2:
+			write_schema(self.storage,self.info)
+		else:
+			with self.storage.open_write('_metadata.pickle') as fh:
+				pickle.dump(self.info,fh)
+		_getLogger('write_meta_data').info('Meta data written to %s',self.backup_dir)
+
+
 	def finsih_backup(self):
 		''' The method finished the backup operations by recording the end time in the
 			current info objec and then persists the info object as _metadata.pickle
-			in the backup target directory
+			in the backup target directory, or as the last member of the archive.
+
+			Streams have their meta data written ahead of the tables, so the manifest
+			and the trailer _trailer.json with the info, that is only known after the
+			tables, like the start of the snapshot and the row counts of a subset, are
+			added at the end.
 		'''
-		logger=_getLogger('finsih_backup')
 		self.info['finished']=datetime.now(pytz.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')
-		file_name=os.path.join(self.backup_dir,'_metadata.pickle')
-		with open(file_name,'wb') as fh:
-			pickle.dump(self.info,fh)
-		logger.info('Meta data written to %s',file_name)
+		if isinstance(self.storage,StripedStorage):
+			self.info['stripes']=self.storage.layout()
+		with self.report.phase('finish_backup'):
+			self.manifest.save()
+			if self.storage.sequential:
+				self.storage.write_file(TRAILER_FILE,json.dumps({k: self.info[k] for k in TRAILER_KEYS if k in self.info}))
+			else:
+				self.write_meta_data()
+		self.storage.write_file(REPORT_FILE,self.report.dumps())
+		self.storage.close()
 
 
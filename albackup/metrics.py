@@ -0,0 +1,194 @@
+from abc import ABCMeta,abstractmethod
+from datetime import datetime
+import json
+import os
+import threading
+import time
+
+from .report import ReportListener
+
+
+INTERVAL=10
+''' Minimum number of seconds between two writes of a Prometheus textfile '''
+
+RATE_WINDOW=60
+''' Number of seconds over which blocks/sec is calculated '''
+
+
+class MetricsListener(ReportListener):
+	''' Base class of the metrics exports, that follow a Report while the dump or
+		restore runs. It keeps the current table and calculates the
+		blocks/sec over the last RATE_WINDOW seconds. Subclasses write the metrics
+		in emit().
+	'''
+	__metaclass__=ABCMeta
+
+	def __init__(self,labels=None):
+		''' Constructor
+
+			* labels - optional dict of labels added to all metrics, like the
+			           name of the database
+		'''
+		self.labels=dict(labels or {})
+		self.current_table=None
+		self.last_progress=time.time()
+		self._blocks=[]
+
+
+	def blocks_per_second(self,report,now=None):
+		''' Returns the number of blocks per second in the last RATE_WINDOW seconds '''
+		now=now or time.time()
+		self._blocks=[(t,b) for (t,b) in self._blocks if t>=now-RATE_WINDOW]
+		if len(self._blocks)<2:
+			return 0.0
+		((t0,b0),(t1,b1))=(self._blocks[0],self._blocks[-1])
+		return (b1-b0)/(t1-t0) if t1>t0 else 0.0
+
+
+	def _progress(self,report):
+		# helper method that records the progress for the rate of blocks
+		self.last_progress=time.time()
+		self._blocks.append((self.last_progress,sum([s.blocks for s in report.tables.values()])))
+
+
+	def phase_started(self,report,name):
+		self.emit(report,'phase_started',{'phase': name})
+
+	def phase_finished(self,report,name,seconds):
+		self.emit(report,'phase_finished',{'phase': name, 'seconds': round(seconds,3)})
+
+	def table_started(self,report,stats):
+		self.current_table=stats.name
+		self._progress(report)
+		self.emit(report,'table_started',{'table': stats.name})
+
+	def table_progress(self,report,stats):
+		self._progress(report)
+		self.emit(report,'table_progress',{'table': stats.name, 'rows': stats.rows, 'bytes': stats.bytes, 'blocks': stats.blocks})
+
+	def table_finished(self,report,stats):
+		self.current_table=None
+		self.emit(report,'table_finished',{'table': stats.name, 'rows': stats.rows, 'bytes': stats.bytes, 'blocks': stats.blocks, 'seconds': round(stats.seconds,3)})
+
+	def counter_changed(self,report,name,value):
+		self.emit(report,'counter',{'counter': name, 'value': value})
+
+	def finished(self,report):
+		self.emit(report,'finished',{},force=True)
+
+
+	@abstractmethod
+	def emit(self,report,event,data,force=False):
+		''' Writes the metrics after an event '''
+
+
+def _escape(value):
+	# escapes a label value of the Prometheus text format
+	return unicode(value).replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')
+
+
+class PrometheusTextfile(MetricsListener):
+	''' Writes the metrics of a dump or restore into a file in the Prometheus text
+		format, which the textfile collector of the node exporter picks up. The file
+		is replaced atomically at most every interval seconds and after the
+		operation finished:
+
+			albackup_rows_total{operation="dump",table="orders"} 120000
+			albackup_bytes_total{operation="dump",table="orders"} 10485760
+			albackup_blocks_total{operation="dump",table="orders"} 240
+			albackup_current_table{operation="dump",table="orders"} 1
+			albackup_current_phase{operation="dump",phase="backup_tables"} 1
+			albackup_blocks_per_second{operation="dump"} 4.2
+			albackup_connection_recycles_total{operation="dump"} 12
+			albackup_last_progress_timestamp_seconds{operation="dump"} 1461764400.5
+			albackup_finished{operation="dump"} 0
+
+		Alerts on stalls compare albackup_last_progress_timestamp_seconds with time().
+	'''
+
+	def __init__(self,file_name,labels=None,interval=INTERVAL):
+		''' Constructor
+
+			* file_name - the .prom file in the directory of the textfile collector
+			* labels - optional dict of labels added to all metrics
+			* interval - minimum number of seconds between two writes
+		'''
+		super(PrometheusTextfile,self).__init__(labels)
+		self.file_name=file_name
+		self.interval=interval
+		self._written=None
+		self._finished=False
+
+
+	def emit(self,report,event,data,force=False):
+		if event=='finished':
+			self._finished=True
+		now=time.time()
+		if not force and event not in ('phase_started','phase_finished') and self._written is not None and now-self._written<self.interval:
+			return
+		self._written=now
+		tmp_name=self.file_name+'.tmp'
+		with open(tmp_name,'w') as fh:
+			fh.write(self.render(report,now).encode('utf-8'))
+		os.rename(tmp_name,self.file_name)
+
+
+	def render(self,report,now=None):
+		''' Returns the metrics of the report in the Prometheus text format '''
+		labels=dict(self.labels,operation=report.operation)
+		lines=[]
+
+		def metric(name,type,help,samples):
+			lines.append(u'# HELP {} {}'.format(name,help))
+			lines.append(u'# TYPE {} {}'.format(name,type))
+			for (extra,value) in samples:
+				l=dict(labels,**extra)
+				lines.append(u'{}{{{}}} {}'.format(name,','.join([u'{}="{}"'.format(k,_escape(l[k])) for k in sorted(l)]),value))
+
+		tables=sorted(report.tables.values(),key=lambda s: s.name)
+		metric('albackup_rows_total','counter','Rows dumped or restored per table',[({'table': s.name},s.rows) for s in tables])
+		metric('albackup_bytes_total','counter','Bytes of the blocks dumped or restored per table',[({'table': s.name},s.bytes) for s in tables])
+		metric('albackup_blocks_total','counter','Blocks dumped or restored per table',[({'table': s.name},s.blocks) for s in tables])
+		metric('albackup_current_table','gauge','Table that is dumped or restored',[({'table': self.current_table},1)] if self.current_table else [])
+		metric('albackup_current_phase','gauge','Phase that is running',[({'phase': report.current_phase},1)] if report.current_phase else [])
+		metric('albackup_blocks_per_second','gauge','Blocks per second in the last {} seconds'.format(RATE_WINDOW),[({},round(self.blocks_per_second(report,now),3))])
+		for name in sorted(report.counters):
+			metric('albackup_{}_total'.format(name),'counter','Number of {}'.format(name.replace('_',' ')),[({},report.counters[name])])
+		metric('albackup_last_progress_timestamp_seconds','gauge','Time of the last finished block',[({},round(self.last_progress,3))])
+		metric('albackup_finished','gauge','1 after the operation finished',[({},1 if self._finished else 0)])
+		return u'\n'.join(lines)+u'\n'
+
+
+class JsonLines(MetricsListener):
+	''' Writes every event of a dump or restore as one JSON object per line into a
+		stream, for log shippers or a tail -f:
+
+			{"event": "table_progress", "operation": "dump", "table": "orders", "rows": 1000,
+			 "bytes": 81920, "blocks": 2, "blocks_per_second": 3.5, "time": "2016-04-27T15:33:00.123456Z"}
+
+		The lines of several exports into the same stream are not interleaved. The
+		stream is not closed by the export.
+	'''
+
+	_lock=threading.Lock()
+
+	def __init__(self,fileobj,labels=None):
+		''' Constructor
+
+			* fileobj - file object the lines are written to, like sys.stderr
+			* labels - optional dict of fields added to all lines
+		'''
+		super(JsonLines,self).__init__(labels)
+		self.fileobj=fileobj
+
+
+	def emit(self,report,event,data,force=False):
+		line=dict(self.labels,event=event,operation=report.operation,time=datetime.utcnow().isoformat()+'Z')
+		line.update(data)
+		if event in ('table_progress','finished'):
+			line['blocks_per_second']=round(self.blocks_per_second(report),3)
+		if event=='finished':
+			line['counters']=dict(report.counters)
+		with self._lock:
+			self.fileobj.write(json.dumps(line,sort_keys=True)+'\n')
+			self.fileobj.flush()
@@ -0,0 +1,420 @@
+import os
+import uuid
+import hashlib
+from StringIO import StringIO
+from multiprocessing.pool import ThreadPool
+
+from . import loggerFactory
+
+
+OBJECT_STORE_SCHEME='s3://'
+
+PART_SIZE=8*1024*1024
+''' Size of the parts in which objects are uploaded and downloaded '''
+
+_getLogger=loggerFactory('objectstore')
+
+
+def is_object_store(location):
+	''' Returns True, if the location is in an object store:
+
+			s3://<bucket>/<prefix>
+	'''
+	return location is not None and location.startswith(OBJECT_STORE_SCHEME)
+
+
+def s3_client(): # pragma: nocover
+	''' Returns a client for Amazon S3. The boto3 package is only required, if
+		backups are stored in S3.
+	'''
+	try:
+		import boto3
+	except ImportError:
+		raise Exception('The boto3 package is required for backups in S3')
+	return boto3.client('s3')
+
+
+class LocalObjectStore(object):
+	''' Stand-in for an S3 client that keeps the objects in a local directory. It
+		implements the subset of the boto3 S3 client API used by the
+		ObjectStoreStorage, so backups into object stores can be tested without S3:
+
+			<root>/<bucket>/<key>
+	'''
+
+	def __init__(self,root):
+		''' Constructor
+
+			* root - directory with one subdirectory per bucket
+		'''
+		self.root=root
+
+	def _path(self,Bucket,Key):
+		return os.path.join(self.root,Bucket,*Key.split('/'))
+
+	def _upload_path(self,UploadId,PartNumber=None):
+		path=os.path.join(self.root,'.uploads',UploadId)
+		return path if PartNumber is None else os.path.join(path,str(PartNumber))
+
+	def _write(self,path,Body):
+		if not os.path.exists(os.path.dirname(path)):
+			os.makedirs(os.path.dirname(path))
+		with open(path,'wb') as fh:
+			fh.write(Body if isinstance(Body,str) else Body.read())
+
+	def put_object(self,Bucket,Key,Body):
+		self._write(self._path(Bucket,Key),Body)
+		return {}
+
+	def get_object(self,Bucket,Key,Range=None):
+		with open(self._path(Bucket,Key),'rb') as fh:
+			if Range:
+				(start,end)=Range[len('bytes='):].split('-')
+				fh.seek(int(start))
+				data=fh.read(int(end)-int(start)+1)
+			else:
+				data=fh.read()
+		return {'Body': StringIO(data), 'ContentLength': len(data)}
+
+	def list_objects_v2(self,Bucket,Prefix=''):
+		contents=[]
+		bucket_dir=os.path.join(self.root,Bucket)
+		for (dir_path,dir_names,file_names) in os.walk(bucket_dir):
+			for file_name in file_names:
+				path=os.path.join(dir_path,file_name)
+				key=os.path.relpath(path,bucket_dir).replace(os.sep,'/')
+				if key.startswith(Prefix):
+					contents.append({'Key': key, 'Size': os.path.getsize(path)})
+		contents.sort(key=lambda c: c['Key'])
+		return {'Contents': contents, 'KeyCount': len(contents)}
+
+	def create_multipart_upload(self,Bucket,Key):
+		upload_id=uuid.uuid4().hex
+		os.makedirs(self._upload_path(upload_id))
+		return {'UploadId': upload_id}
+
+	def upload_part(self,Bucket,Key,UploadId,PartNumber,Body):
+		self._write(self._upload_path(UploadId,PartNumber),Body)
+		return {'ETag': hashlib.md5(Body).hexdigest()}
+
+	def complete_multipart_upload(self,Bucket,Key,UploadId,MultipartUpload):
+		parts=[]
+		for part in MultipartUpload['Parts']:
+			with open(self._upload_path(UploadId,part['PartNumber']),'rb') as fh:
+				data=fh.read()
+			if hashlib.md5(data).hexdigest()!=part['ETag']:
+				raise Exception('ETag of part {} does not match'.format(part['PartNumber']))
+			parts.append(data)
+		self._write(self._path(Bucket,Key),''.join(parts))
+		self.abort_multipart_upload(Bucket,Key,UploadId)
+		return {}
+
+	def abort_multipart_upload(self,Bucket,Key,UploadId):
+		path=self._upload_path(UploadId)
+		for file_name in os.listdir(path):
+			os.remove(os.path.join(path,file_name))
+		os.rmdir(path)
+		return {}
+
+
+class _ObjectWriter(object):
+	''' File object that uploads an object in parts, while it is written. Each part
+		is uploaded by the worker threads of the storage as soon as it is complete.
+		Small objects are uploaded with a single request, when they are closed.
+	'''
+
+	def __init__(self,storage,key):
+		self.storage=storage
+		self.key=key
+		self.buf=[]
+		self.buf_size=0
+		self.size=0
+		self.upload_id=None
+		self.parts=[]
+
+	def write(self,data):
+		self.buf.append(data)
+		self.buf_size+=len(data)
+		self.size+=len(data)
+		if self.buf_size>=self.storage.part_size:
+			self._upload_part()
+
+	def _upload_part(self):
+		# helper method that hands the buffered data as next part to the workers
+		if self.upload_id is None:
+			self.upload_id=self.storage.client.create_multipart_upload(
+				Bucket=self.storage.bucket,
+				Key=self.key
+			)['UploadId']
+		body=''.join(self.buf)
+		self.buf=[]
+		self.buf_size=0
+		number=len(self.parts)+1
+		self.parts.append((number,self.storage._submit(self.storage._upload_part,self.key,self.upload_id,number,body)))
+
+	def flush(self):
+		pass
+
+	def tell(self):
+		return self.size
+
+	def close(self):
+		client=self.storage.client
+		try:
+			if self.upload_id is None:
+				client.put_object(Bucket=self.storage.bucket,Key=self.key,Body=''.join(self.buf))
+			else:
+				if self.buf:
+					self._upload_part()
+				client.complete_multipart_upload(
+					Bucket=self.storage.bucket,
+					Key=self.key,
+					UploadId=self.upload_id,
+					MultipartUpload={'Parts': [
+						{'PartNumber': number, 'ETag': result.get()}
+						for (number,result) in self.parts
+					]}
+				)
+				_getLogger('_ObjectWriter').debug('%s uploaded in %d parts',self.key,len(self.parts))
+		except:
+			if self.upload_id is not None:
+				client.abort_multipart_upload(Bucket=self.storage.bucket,Key=self.key,UploadId=self.upload_id)
+			raise
+		finally:
+			self.buf=[]
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self,*args):
+		self.close()
+
+
+class _RangeReader(object):
+	''' File object that reads an object in ranges of the part size through the
+		_read_range method of its storage. The ranges following the current one are
+		prefetched by the worker threads of the storage.
+	'''
+
+	def __init__(self,storage,key,size):
+		self.storage=storage
+		self.key=key
+		self.size=size
+		self.pos=0
+		self.pending={}
+		self.current=None
+		self.current_index=None
+
+	def prefetch(self):
+		''' Starts reading the ranges at the current position, before they are
+			requested
+		'''
+		self._schedule(self.pos//self.storage.part_size)
+
+	def _schedule(self,index):
+		# helper method that submits the reads of the range with the given index
+		# and the ranges following it
+		part_size=self.storage.part_size
+		for i in self.pending.keys():
+			if i<index or i>index+self.storage.prefetch:
+				del self.pending[i]
+		for i in xrange(index,index+self.storage.prefetch+1):
+			if i not in self.pending and i*part_size<self.size:
+				self.pending[i]=self.storage._submit(
+					self.storage._read_range,
+					self.key,
+					i*part_size,
+					min(self.size,(i+1)*part_size)-1
+				)
+
+	def _chunk(self,index):
+		# helper method that returns the data of the range with the given index
+		if index!=self.current_index:
+			self._schedule(index)
+			self.current=self.pending.pop(index).get()
+			self.current_index=index
+		return self.current
+
+	def _data(self):
+		# helper method that returns the current range and the offset of the
+		# position in it
+		index=self.pos//self.storage.part_size
+		return (self._chunk(index),self.pos-index*self.storage.part_size)
+
+	def read(self,size=-1):
+		if size<0 or self.pos+size>self.size:
+			size=max(self.size-self.pos,0)
+		parts=[]
+		while size>0:
+			(data,offset)=self._data()
+			part=data[offset:offset+size]
+			parts.append(part)
+			self.pos+=len(part)
+			size-=len(part)
+		return ''.join(parts)
+
+	def readline(self):
+		parts=[]
+		while self.pos<self.size:
+			(data,offset)=self._data()
+			end=data.find('\n',offset)
+			part=data[offset:end+1 if end>=0 else len(data)]
+			parts.append(part)
+			self.pos+=len(part)
+			if end>=0:
+				break
+		return ''.join(parts)
+
+	def __iter__(self):
+		while True:
+			l=self.readline()
+			if not l:
+				return
+			yield l
+
+	def seek(self,offset,whence=0):
+		if whence==1:
+			offset+=self.pos
+		elif whence==2:
+			offset+=self.size
+		self.pos=offset
+
+	def tell(self):
+		return self.pos
+
+	def close(self):
+		self.pending={}
+		self.current=None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self,*args):
+		self.close()
+
+
+class ObjectStoreStorage(object):
+	''' Storage of a backup in an S3 style object store with one object per file:
+
+			s3://<bucket>/<prefix>/<file name>
+
+		Table files are uploaded in parts as they are written and the upload of the
+		parts runs concurrently in a pool of worker threads, while the next blocks are
+		fetched from the database. Readers download ranges of the objects and prefetch
+		the following ranges with the same workers.
+	'''
+
+	supports_resume=False
+	''' Objects can't be truncated or appended to '''
+
+	sequential=False
+	''' Objects can be read in any order '''
+
+	def __init__(self,client,location,mode='r',workers=4,part_size=PART_SIZE,prefetch=4):
+		''' Constructor
+
+			* client - S3 client, a boto3 client is created, if None is given
+			* location - location of the backup, s3://<bucket>/<prefix>
+			* mode - 'r' to read a backup or 'w' to write a new one
+			* workers - number of threads that upload or download parts
+			* part_size - size of the uploaded parts and downloaded ranges in bytes
+			* prefetch - number of ranges downloaded ahead of the reader
+		'''
+		if not is_object_store(location):
+			raise Exception('{} is not an object store location'.format(location))
+		self.client=client if client is not None else s3_client()
+		self.location=location
+		(self.bucket,_,self.prefix)=location[len(OBJECT_STORE_SCHEME):].partition('/')
+		self.mode=mode
+		self.part_size=part_size
+		self.prefetch=prefetch
+		self.max_pending=2*workers
+		self._pool=ThreadPool(workers)
+		self._inflight=[]
+		_getLogger('ObjectStoreStorage').info(
+			'%s backup in %s with %d workers',
+			'Writing' if mode=='w' else 'Reading',
+			location,
+			workers
+		)
+
+	def _key(self,name):
+		return '{}/{}'.format(self.prefix,name) if self.prefix else name
+
+	def _submit(self,func,*args):
+		# helper method that runs a request in the worker threads. The number of
+		# requests in flight is limited, so the parts waiting for upload don't
+		# grow without bounds, if the object store is slower than the database.
+		self._inflight=[r for r in self._inflight if not r.ready()]
+		while len(self._inflight)>=self.max_pending:
+			self._inflight.pop(0).wait()
+		result=self._pool.apply_async(func,args)
+		self._inflight.append(result)
+		return result
+
+	def _upload_part(self,key,upload_id,number,body):
+		# helper method that uploads one part and returns its ETag
+		return self.client.upload_part(
+			Bucket=self.bucket,
+			Key=key,
+			UploadId=upload_id,
+			PartNumber=number,
+			Body=body
+		)['ETag']
+
+	def _read_range(self,key,start,end):
+		# helper method that downloads a range of an object
+		return self.client.get_object(
+			Bucket=self.bucket,
+			Key=key,
+			Range='bytes={}-{}'.format(start,end)
+		)['Body'].read()
+
+	def _object(self,name):
+		# helper method that returns the listing entry of an object or None
+		key=self._key(name)
+		res=self.client.list_objects_v2(Bucket=self.bucket,Prefix=key)
+		for obj in res.get('Contents',[]):
+			if obj['Key']==key:
+				return obj
+		return None
+
+	def exists(self,name):
+		''' Returns True, if an object with the given name is in the backup '''
+		return self._object(name) is not None
+
+	def size(self,name):
+		''' Returns the size of an object in the backup '''
+		obj=self._object(name)
+		if obj is None:
+			raise Exception('{} does not exist in {}'.format(name,self.location))
+		return obj['Size']
+
+	def open_write(self,name,append=False):
+		''' Opens a new object in the backup for writing '''
+		if append:
+			raise Exception('Objects in {} can\'t be appended'.format(self.location))
+		return _ObjectWriter(self,self._key(name))
+
+	def open_read(self,name):
+		''' Opens an object in the backup for reading '''
+		return _RangeReader(self,self._key(name),self.size(name))
+
+	def read_range(self,name,offset,length):
+		''' Returns length bytes from the given offset of an object in the backup '''
+		return self._read_range(self._key(name),offset,offset+length-1)
+
+	def write_file(self,name,data):
+		''' Replaces an object in the backup with the given content '''
+		self.client.put_object(Bucket=self.bucket,Key=self._key(name),Body=data)
+
+	def table_order(self,table_names):
+		''' Returns the order in which the given tables are read from the backup '''
+		return table_names
+
+	def close(self):
+		''' Waits for the workers to finish '''
+		self._pool.close()
+		self._pool.join()
+		if self.mode=='w':
+			_getLogger('ObjectStoreStorage').info('Backup %s uploaded',self.location)
@@ -0,0 +1,163 @@
+from collections import namedtuple
+from datetime import datetime
+import threading
+import time
+import json
+
+from . import loggerFactory
+
+
+_getLogger=loggerFactory('orchestrate')
+
+Job=namedtuple('Job',('name','servers','run'))
+''' A job of the Orchestrator. servers are the database servers the job works on,
+	run is called without arguments and returns a dict with details for the report.
+'''
+
+JobResult=namedtuple('JobResult',('name','servers','ok','started','seconds','error','details'))
+''' Result of one job, error is the message of the exception that failed the job '''
+
+
+class Orchestrator(object):
+	''' Runs jobs, like the dumps of many databases, concurrently in a number of
+		worker threads. Besides the global limit of workers, the number of jobs that
+		run on the same database server at the same time is limited, so one server
+		isn't overloaded while the jobs of others wait. A worker takes the first
+		pending job whose servers all have a free slot, so the jobs of different
+		servers are interleaved.
+
+		The failure of a job is recorded in its result and doesn't stop the others.
+	'''
+
+	def __init__(self,jobs,workers=4,per_server=1,server_limits=None):
+		''' Constructor
+
+			* jobs - list of Job tuples
+			* workers - number of jobs running at the same time
+			* per_server - number of jobs running on the same server at the same time
+			* server_limits - optional dict with the limits of single servers,
+			               overriding per_server
+		'''
+		self.jobs=list(jobs)
+		self.workers=workers
+		self.per_server=per_server
+		self.server_limits=server_limits or {}
+		for job in self.jobs:
+			for server in job.servers:
+				if self._limit(server)<1:
+					raise Exception('Limit of server {} doesn\'t allow job {} to run'.format(server,job.name))
+		self._pending=[]
+		self._running={}
+		self._condition=threading.Condition()
+
+
+	def _limit(self,server):
+		# helper method that returns the number of concurrent jobs allowed on a server
+		return self.server_limits.get(server,self.per_server)
+
+
+	def run(self):
+		''' Runs all jobs and returns the list of JobResult in the order of the jobs '''
+		logger=_getLogger('Orchestrator')
+		logger.info('Running %d jobs with %d workers',len(self.jobs),self.workers)
+		self._pending=list(enumerate(self.jobs))
+		self._running={}
+		results={}
+		threads=[
+			threading.Thread(target=self._worker,args=(results,),name='albackup-job-{}'.format(i))
+			for i in xrange(0,min(self.workers,len(self.jobs)))
+		]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+
+		results=[results[i] for i in xrange(0,len(self.jobs))]
+		failed=[r.name for r in results if not r.ok]
+		if failed:
+			logger.error('%d of %d jobs failed: %s',len(failed),len(results),', '.join(failed))
+		else:
+			logger.info('All %d jobs finished',len(results))
+		return results
+
+
+	def _next_job(self):
+		''' Helper method that waits until a pending job can run on its servers and
+			reserves their slots. Returns the index and the job, or None when no jobs
+			are left.
+		'''
+		with self._condition:
+			while self._pending:
+				for (i,job) in self._pending:
+					if all([self._running.get(s,0)<self._limit(s) for s in set(job.servers)]):
+						self._pending.remove((i,job))
+						for s in set(job.servers):
+							self._running[s]=self._running.get(s,0)+1
+						return (i,job)
+				self._condition.wait()
+			return None
+
+
+	def _release(self,job):
+		# helper method that frees the server slots of a finished job
+		with self._condition:
+			for s in set(job.servers):
+				self._running[s]-=1
+			self._condition.notify_all()
+
+
+	def _worker(self,results):
+		# main loop of a worker thread
+		while True:
+			next_job=self._next_job()
+			if next_job is None:
+				return
+			(i,job)=next_job
+			try:
+				results[i]=self._execute(job)
+			finally:
+				self._release(job)
+
+
+	def _execute(self,job):
+		''' Helper method that runs one job and returns its JobResult '''
+		logger=_getLogger('_execute')
+		logger.info('Job %s started',job.name)
+		started=datetime.utcnow()
+		start=time.time()
+		try:
+			details=job.run() or {}
+		except Exception as e:
+			logger.exception('Job %s failed',job.name)
+			return JobResult(job.name,job.servers,False,started,time.time()-start,str(e),{})
+		seconds=time.time()-start
+		logger.info('Job %s finished in %.1fs',job.name,seconds)
+		return JobResult(job.name,job.servers,True,started,seconds,None,details)
+
+
+def report(results):
+	''' Aggregates the JobResult list of an Orchestrator run into one report dict '''
+	return {
+		'jobs': [
+			{
+				'name': r.name,
+				'servers': list(r.servers),
+				'ok': r.ok,
+				'started': r.started.isoformat()+'Z',
+				'seconds': round(r.seconds,3),
+				'error': r.error,
+				'details': r.details
+			}
+			for r in results
+		],
+		'ok': len([r for r in results if r.ok]),
+		'failed': len([r for r in results if not r.ok]),
+		'seconds': round(sum([r.seconds for r in results]),3)
+	}
+
+
+def write_report(file_name,results):
+	''' Writes the aggregated report of the results as JSON into file_name '''
+	with open(file_name,'w') as fh:
+		json.dump(report(results),fh,indent=3,sort_keys=True,default=str)
+	_getLogger('write_report').info('Report written to %s',file_name)
@@ -0,0 +1,123 @@
+from collections import Counter
+import cProfile
+import gc
+import os
+import re
+import resource
+import sys
+
+from . import loggerFactory
+from .report import ReportListener
+
+
+_getLogger=loggerFactory('profiling')
+
+
+def peak_rss():
+	''' Returns the peak resident memory of the process in bytes '''
+	rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# Linux reports kilobytes, OS X bytes
+	return rss if sys.platform=='darwin' else rss*1024
+
+
+def object_counts():
+	''' Returns a Counter of the objects tracked by the garbage collector by type name.
+		Python 2 has no tracemalloc, so this stands in for the allocations: it counts
+		dicts, lists, tuples, rows and other containers, but not strings or numbers.
+	'''
+	gc.collect()
+	return Counter([type(o).__name__ for o in gc.get_objects()])
+
+
+class Profiler(ReportListener):
+	''' Listener of a Report, that profiles each phase of a dump or restore with
+		cProfile and writes the stats into _profile-<operation>-<phase>.pstats of a
+		directory:
+
+			python -m pstats _profile-restore-import_tables.pstats
+
+		With tables each table is profiled into _profile-<operation>-table-<table>.pstats
+		and its time is left out of the profile of the phase. With memory the growth
+		of the peak RSS and of the objects by type is written for each phase (and
+		table) into _memory-<operation>.txt.
+	'''
+
+	def __init__(self,directory,cpu=True,memory=False,tables=False,top=20):
+		''' Constructor
+
+			* directory - directory of the .pstats and memory files
+			* cpu - profile with cProfile
+			* memory - record the growth of the memory
+			* tables - profile every table on its own
+			* top - number of object types in the memory report
+		'''
+		self.directory=directory
+		self.cpu=cpu
+		self.memory=memory
+		self.tables=tables
+		self.top=top
+		self._profiles={}
+		self._snapshots={}
+		self._phase=None
+		self._memory_lines=[]
+
+
+	def _file_name(self,report,kind,key,ext):
+		# helper method that returns the name of an output file
+		return os.path.join(self.directory,'_{}-{}{}.{}'.format(kind,report.operation,'-'+re.sub(r'[^\w.-]','_',key) if key else '',ext))
+
+
+	def _start(self,key):
+		# helper method that starts to profile a phase or table
+		if self.memory:
+			self._snapshots[key]=(object_counts(),peak_rss())
+		if self.cpu:
+			profile=self._profiles.get(key)
+			if profile is None:
+				profile=self._profiles[key]=cProfile.Profile()
+			profile.enable()
+
+
+	def _stop(self,report,key):
+		# helper method that stops to profile a phase or table and writes the results
+		if self.cpu:
+			profile=self._profiles[key]
+			profile.disable()
+			file_name=self._file_name(report,'profile',key,'pstats')
+			profile.dump_stats(file_name)
+			_getLogger('Profiler').debug('Profile of %s written to %s',key,file_name)
+		if self.memory:
+			(counts,rss)=self._snapshots.pop(key)
+			growth=object_counts()
+			growth.subtract(counts)
+			new_rss=peak_rss()
+			self._memory_lines.append('{}: peak RSS {:.1f} MB (+{:.1f} MB), objects {:+d}'.format(
+				key,new_rss/2.0**20,(new_rss-rss)/2.0**20,sum(growth.values())
+			))
+			for (name,n) in growth.most_common(self.top):
+				if n<=0:
+					break
+				self._memory_lines.append('   {:+10d} {}'.format(n,name))
+			with open(self._file_name(report,'memory',None,'txt'),'w') as fh:
+				fh.write('\n'.join(self._memory_lines)+'\n')
+
+
+	def phase_started(self,report,name):
+		self._phase=name
+		self._start(name)
+
+	def phase_finished(self,report,name,seconds):
+		self._stop(report,name)
+		self._phase=None
+
+	def table_started(self,report,stats):
+		if self.tables:
+			if self.cpu and self._phase:
+				self._profiles[self._phase].disable()
+			self._start('table-'+stats.name)
+
+	def table_finished(self,report,stats):
+		if self.tables:
+			self._stop(report,'table-'+stats.name)
+			if self.cpu and self._phase:
+				self._profiles[self._phase].enable()
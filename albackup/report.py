@@ -0,0 +1,231 @@
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import time
+import pytz
+
+from . import loggerFactory
+
+
+_getLogger=loggerFactory('report')
+
+REPORT_FILE='_report.json'
+''' Name of the timing report in a backup '''
+
+
+class TableStats(object):
+	''' Counters and timers of one table in a Report. The time of a table is split
+		into the time spent in the steps of its blocks, like fetch, serialize and
+		write for a dump, or read, deserialize and insert for a restore.
+	'''
+
+	def __init__(self,name,report=None):
+		self.name=name
+		self.report=report
+		self.seconds=0.0
+		self.rows=0
+		self.bytes=0
+		self.blocks=0
+		self.steps={}
+
+
+	def add(self,rows=0,bytes=0,blocks=0):
+		''' Adds the counts of processed data and tells the listeners of the report '''
+		self.rows+=rows
+		self.bytes+=bytes
+		self.blocks+=blocks
+		if self.report is not None:
+			self.report._notify('table_progress',self)
+
+
+	@contextmanager
+	def timer(self,step):
+		''' Context manager that adds its wall time to the time of a step '''
+		start=time.time()
+		try:
+			yield
+		finally:
+			self.steps[step]=self.steps.get(step,0.0)+time.time()-start
+
+
+	def timed(self,step,iterable):
+		''' Generator that returns the items of iterable and adds the time spent to get
+			them to the time of a step, like the fetch of blocks from a result set
+		'''
+		it=iter(iterable)
+		while True:
+			start=time.time()
+			try:
+				item=next(it)
+			except StopIteration:
+				self.steps[step]=self.steps.get(step,0.0)+time.time()-start
+				return
+			self.steps[step]=self.steps.get(step,0.0)+time.time()-start
+			yield item
+			# the item must not survive the fetch of the next one
+			del item
+
+
+	def as_dict(self):
+		''' Returns the stats as dict for the JSON report '''
+		return {
+			'seconds': round(self.seconds,3),
+			'rows': self.rows,
+			'bytes': self.bytes,
+			'blocks': self.blocks,
+			'rows_per_second': round(self.rows/self.seconds,1) if self.seconds else None,
+			'steps': {k: round(v,3) for (k,v) in self.steps.items()}
+		}
+
+
+class ReportListener(object):
+	''' Base class of listeners, that follow the progress of a Report while the
+		operation runs, like the metrics exports. All methods get the report as
+		first argument and do nothing by default.
+	'''
+
+	def phase_started(self,report,name):
+		pass
+
+	def phase_finished(self,report,name,seconds):
+		pass
+
+	def table_started(self,report,stats):
+		pass
+
+	def table_progress(self,report,stats):
+		''' Called after each block of a table '''
+		pass
+
+	def table_finished(self,report,stats):
+		pass
+
+	def counter_changed(self,report,name,value):
+		pass
+
+	def finished(self,report):
+		pass
+
+
+class Report(object):
+	''' Timing and throughput report of a dump or restore. The operation runs its
+		phases in phase() and its tables in table(), which record their wall time:
+
+			with report.phase('backup_tables'):
+				for name in tables:
+					with report.table(name) as stats:
+						...
+						stats.add(rows=len(rows),bytes=len(buf),blocks=1)
+
+		Other events, like connection recycles, are counted with count(). Listeners
+		(see ReportListener) in the listeners list are told about all changes.
+	'''
+
+	def __init__(self,operation):
+		''' Constructor
+
+			* operation - dump or restore
+		'''
+		self.operation=operation
+		self.started=datetime.now(pytz.utc)
+		self.phases=[]
+		self.tables={}
+		self.counters={}
+		self.current_phase=None
+		self.listeners=[]
+
+
+	def _notify(self,event,*args):
+		''' Helper method that calls the method event of all listeners. Errors of the
+			listeners are logged, they must not stop the operation.
+		'''
+		for listener in self.listeners:
+			try:
+				getattr(listener,event)(self,*args)
+			except Exception:
+				_getLogger('Report').exception('Listener %r failed in %s',listener,event)
+
+
+	@contextmanager
+	def phase(self,name):
+		''' Context manager that records the wall time of a phase '''
+		logger=_getLogger('Report')
+		logger.debug('Phase %s started',name)
+		self.current_phase=name
+		self._notify('phase_started',name)
+		start=time.time()
+		try:
+			yield
+		finally:
+			seconds=time.time()-start
+			self.phases.append((name,seconds))
+			self.current_phase=None
+			logger.debug('Phase %s finished in %.3fs',name,seconds)
+			self._notify('phase_finished',name,seconds)
+
+
+	@contextmanager
+	def table(self,name):
+		''' Context manager that yields the TableStats of a table and adds its wall time '''
+		stats=self.tables.get(name)
+		if stats is None:
+			stats=self.tables[name]=TableStats(name,self)
+		self._notify('table_started',stats)
+		start=time.time()
+		try:
+			yield stats
+		finally:
+			stats.seconds+=time.time()-start
+			self._notify('table_finished',stats)
+
+
+	def count(self,name,n=1):
+		''' Adds n to the counter of an event, like connection_recycles '''
+		self.counters[name]=self.counters.get(name,0)+n
+		self._notify('counter_changed',name,self.counters[name])
+
+
+	def finish(self):
+		''' Tells the listeners that the operation finished '''
+		self._notify('finished')
+
+
+	def as_dict(self):
+		''' Returns the report as dict '''
+		return {
+			'operation': self.operation,
+			'started': self.started.strftime('%Y-%m-%dT%H:%M:%S.%f'),
+			'seconds': round((datetime.now(pytz.utc)-self.started).total_seconds(),3),
+			'phases': [{'name': name, 'seconds': round(seconds,3)} for (name,seconds) in self.phases],
+			'tables': {name: stats.as_dict() for (name,stats) in self.tables.items()},
+			'counters': dict(self.counters),
+			'rows': sum([s.rows for s in self.tables.values()]),
+			'bytes': sum([s.bytes for s in self.tables.values()])
+		}
+
+
+	def dumps(self):
+		''' Returns the report as JSON '''
+		return json.dumps(self.as_dict(),indent=3,sort_keys=True)
+
+
+	def write(self,file_name):
+		''' Writes the report as JSON into file_name '''
+		with open(file_name,'w') as fh:
+			fh.write(self.dumps())
+
+
+	def log_summary(self,slowest=10):
+		''' Logs the times of the phases and of the slowest tables '''
+		logger=_getLogger('Report')
+		report=self.as_dict()
+		logger.info('%s of %d rows and %.1f MB took %.1fs',self.operation.capitalize(),report['rows'],report['bytes']/2.0**20,report['seconds'])
+		for p in report['phases']:
+			logger.info('   %-28s %9.1fs',p['name'],p['seconds'])
+		tables=sorted(self.tables.values(),key=lambda s: s.seconds,reverse=True)[:slowest]
+		if tables:
+			logger.info('Slowest tables:')
+			for s in tables:
+				logger.info('   %-28s %9.1fs %10d rows %9.1f MB   %s',s.name,s.seconds,s.rows,s.bytes/2.0**20,
+					' '.join(['{} {:.1f}s'.format(k,v) for (k,v) in sorted(s.steps.items())])
+				)
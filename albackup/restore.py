@@ -1,53 +1,240 @@
+import json
 import sqlalchemy as sa
-import os
 from sqlalchemy.util import pickle
 from sqlalchemy.dialects.mssql import NTEXT
 
-from . import DumpRestoreBase,loggerFactory,transaction
+from . import DumpRestoreBase,loggerFactory,transaction,execute_resultset,large_columns,filter_names,referenced_tables,trigger_table
+from .codec import get_codec
+from .schema import BackupSchema,SCHEMA_FILE
+from .subset import key_condition,batches
+from .blocks import TRAILER_FILE,table_file_name,LargeValue,index_file_name,read_index,read_large_value,skip_block
+from .storage import StreamStorage,StripedStorage,open_storage,stripe_paths
+from .report import Report
 
 
 _getLogger=loggerFactory('restore')
 
+_checkpoint_meta=sa.MetaData()
+_checkpoints=sa.Table(
+	'_albackup_checkpoint',
+	_checkpoint_meta,
+	sa.Column('table_name',sa.Unicode(255),primary_key=True),
+	sa.Column('block',sa.Integer,nullable=False)
+)
+''' Table in the restore target that records the last committed block per table '''
+
+_referencing_foreign_keys='''SELECT fk.name, OBJECT_NAME(fk.parent_object_id), pc.name, OBJECT_NAME(fk.referenced_object_id), rc.name,
+	fk.delete_referential_action_desc, fk.update_referential_action_desc
+FROM sys.foreign_keys fk
+JOIN sys.foreign_key_columns fkc ON fkc.constraint_object_id=fk.object_id
+JOIN sys.columns pc ON pc.object_id=fkc.parent_object_id AND pc.column_id=fkc.parent_column_id
+JOIN sys.columns rc ON rc.object_id=fkc.referenced_object_id AND rc.column_id=fkc.referenced_column_id
+ORDER BY fk.name, fkc.constraint_column_id'''
+''' Lists the columns of all foreign keys in the restore target '''
+
+
+def _row_values(row,columns):
+	''' Returns the values of a row, which are compared between the backup and the
+		target in merge restores. The values are compared and not their hashes or
+		representations, because the values from the backup and the database may
+		have different types, like str and unicode or decimals with another scale,
+		and still be equal.
+	'''
+	return tuple(row[c.name] for c in columns)
+
+
+def _key_after(columns,key):
+	''' Returns the condition selecting the rows whose primary key comes after key in
+		key order. Composite keys are compared column by column, because SQL Server
+		doesn't support row value comparisons.
+	'''
+	if len(columns)==1:
+		return columns[0]>key[0]
+	return sa.or_(*[
+		sa.and_(*[c==v for (c,v) in zip(columns[:i],key[:i])]+[columns[i]>key[i]])
+		for i in xrange(0,len(columns))
+	])
+
+
+def _check_key_order(table_name,keys,last):
+	''' Raises an exception, if the keys of a block are not ascending or don't come
+		after the last key of the previous block, as a merge requires. Keys with
+		strings are not checked, because SQL Server orders them by the collation of
+		the column, not like Python.
+	'''
+	if any(isinstance(v,basestring) for k in keys for v in k):
+		return
+	for k in keys:
+		if last is not None and k<=last:
+			raise Exception('Blocks of table {} are not in primary key order at key {}, it can\'t be merged'.format(table_name,k))
+		last=k
+
+
 class Restore(DumpRestoreBase):
 	''' Main class to handle a restore operation
 	'''
 
-	def __init__(self,backup_dir,engine):
+	def __init__(self,backup_dir,engine,resume=False,stream=None,object_store=None,stripe_dirs=None,
+			tables=None,exclude_tables=None,with_dependencies=False,merge=False):
 		''' Constructor
 
-			* backup_dir - location of backup to be restored
+			* backup_dir - location of backup to be restored, either a directory,
+			               a tar archive or an s3://<bucket>/<prefix> location
 			* engine - the SQLAlchemy ening in use
+			* resume - continue an interrupted restore of the backup from the
+			           checkpoints in the target database
+			* stream - optional file object, like stdin, from which a backup stream
+			           is read instead of the backup_dir
+			* object_store - optional client for backups in an object store
+			* stripe_dirs - parent directories of the stripes of a striped backup,
+			           if they moved since the dump
+			* tables - optional list of wildcard patterns of the tables to restore,
+			           all other tables in the database are kept
+			* exclude_tables - optional list of wildcard patterns of tables that
+			           are not restored
+			* with_dependencies - restore the tables referenced by the foreign keys
+			           of the selected tables as well
+			* merge - apply only the differences between the backup and the tables
+			           of the restore target, instead of re-creating them (see merge_tables)
 		'''
 		super(Restore,self).__init__(backup_dir,engine)
-
-		file_name=os.path.join(self.backup_dir,'_metadata.pickle')
-		with open(file_name,'rb') as fh:
-			self.info=pickle.load(fh)
-			_getLogger('Restore').info('Meta data read from %s',file_name)
-
-
-	def run(self): #pragma: nocover
-		''' Main method that runs the complete restore operation
+		if merge and resume:
+			raise Exception('Merge restores can\'t be resumed, but can be run again')
+		self.resume=resume
+		self.merge=merge
+		self.merge_stats={}
+		self.checkpoints={}
+		self.report=Report('restore')
+
+		if stream is not None:
+			if resume:
+				raise Exception('Restores from streams can\'t be resumed')
+			self.storage=StreamStorage(stream,'r')
+			self.backup_dir=self.storage.name
+		else:
+			self.storage=open_storage(self.backup_dir,object_store)
+		if self.storage.exists(SCHEMA_FILE):
+			self.schema=BackupSchema.load(self.storage)
+			self.info=self.schema.info()
+			_getLogger('Restore').info('Schema manifest read from %s',self.backup_dir)
+		else:
+			with self.storage.open_read('_metadata.pickle') as fh:
+				self.info=pickle.load(fh)
+				_getLogger('Restore').info('Meta data read from %s',self.backup_dir)
+		self.format=self.info.get('format',1)
+		self.codec=get_codec(self.info.get('codec','pickle'))
+
+		if 'stripes' in self.info:
+			layout=self.info['stripes']
+			paths=[self.backup_dir]+(stripe_paths(self.backup_dir,stripe_dirs) if stripe_dirs else layout['paths'][1:])
+			self.storage=StripedStorage(paths,layout['policy'],layout['files'])
+			_getLogger('Restore').info('Backup is striped across %s',', '.join(paths))
+
+		self.selected_tables=None
+		if tables or exclude_tables:
+			self.select_tables(tables,exclude_tables,with_dependencies)
+
+
+	def select_tables(self,tables=None,exclude_tables=None,with_dependencies=False):
+		''' Restricts the restore to the tables matching the patterns (see filter_names).
+			Only these tables are dropped, re-created and loaded. For format v2 backups
+			the meta data is only built for them and the tables they reference.
+
+			* tables - wildcard patterns of the tables to restore, all tables if empty
+			* exclude_tables - wildcard patterns of tables that are not restored
+			* with_dependencies - add the tables referenced by the foreign keys of
+			           the selected tables, and the tables they reference in turn
+		'''
+		logger=_getLogger('select_tables')
+		selected=filter_names(self.table_names,tables,exclude_tables)
+		if not selected:
+			raise Exception('No tables in the backup match {}'.format(', '.join(tables or ['*'])))
+
+		if 'meta' not in self.info and self.schema is not None:
+			# the referenced tables are needed in the meta data for the foreign keys
+			meta=sa.MetaData()
+			pending=list(selected)
+			while pending:
+				name=pending.pop()
+				if name not in meta.tables:
+					pending.extend(referenced_tables(self.schema.table(meta,name)))
+			self.info['meta']=meta
+
+		if with_dependencies:
+			pending=list(selected)
+			while pending:
+				for name in referenced_tables(self.meta.tables[pending.pop()]):
+					if name not in selected:
+						selected.append(name)
+						pending.append(name)
+
+		self.selected_tables=sorted(selected)
+		logger.info('Restoring %d tables: %s',len(self.selected_tables),', '.join(self.selected_tables))
+		return self.selected_tables
+
+
+	@property
+	def restore_tables(self):
+		''' The names of the tables, that are restored '''
+		return self.selected_tables if self.selected_tables is not None else self.table_names
+
+
+	def run(self):
+		''' Main method that runs the complete restore operation. The time of every
+			phase and table is recorded in the report.
+
+			If the restore fails, the RI checks and the triggers, that were turned off,
+			are turned on again. The RI checks of a restore that succeeded are turned
+			on by the caller, depending on the enable_ri_check option. The storage of
+			the backup is closed in any case.
 		'''
-		self.getTablesWithLargeColumnTypes()
-		self.fixTextColumns()
-		self.createSchema()
-		self.changeRIChecks(off=True)
-		self.import_tables()
-		self.import_objects()
+		report=self.report
+		try:
+			with report.phase('fixTextColumns'):
+				self.getTablesWithLargeColumnTypes()
+				self.fixTextColumns()
+			if self.merge:
+				try:
+					with report.phase('createCheckpoints'):
+						self.createCheckpoints()
+						self.changeRIChecks(off=True)
+						self.changeTriggers(off=True)
+					with report.phase('merge_tables'):
+						self.merge_tables()
+				except:
+					self._turnOnChecks(triggers=True)
+					raise
+				with report.phase('dropCheckpoints'):
+					self.changeTriggers(off=False)
+					self.dropCheckpoints()
+				return
+			if self.resume:
+				with report.phase('readCheckpoints'):
+					self.readCheckpoints()
+			else:
+				with report.phase('createSchema'):
+					self.createSchema()
+			try:
+				with report.phase('import_tables'):
+					self.changeRIChecks(off=True)
+					self.import_tables()
+			except:
+				self._turnOnChecks()
+				raise
+			with report.phase('import_objects'):
+				self.import_objects()
+			with report.phase('dropCheckpoints'):
+				self.dropCheckpoints()
+		finally:
+			self.storage.close()
 
 
 	def getTablesWithLargeColumnTypes(self):
 		''' Helper method that creates a lookup dict with a list of all
 			large columns (type is text or nvarchar(max)) per table
 		'''
-
-		def isLargeColumnType(col):
-			type=col.type
-			return isinstance(type,sa.TEXT) or (isinstance(type,sa.sql.sqltypes.NVARCHAR) and type.length=='max')
-
 		self._largeColumns={
-			tname: filter(isLargeColumnType,table.columns)
+			tname: large_columns(table)
 			for (tname,table) in self.meta.tables.iteritems()
 		}
 		return self._largeColumns
@@ -75,37 +262,226 @@ class Restore(DumpRestoreBase):
 
 	def createSchema(self):
 		''' The method deletes all views and tables before re-creating the schema from
-			the meta data in the backup
+			the meta data in the backup.
+
+			If only some tables are restored, only these tables and the views depending
+			on them are deleted. Foreign keys of the other tables, that reference them,
+			are deleted before and added again after the tables are re-created.
 		'''
 		logger=_getLogger('createSchema')
 		with transaction(self.con):
-			self._drop_views()
+			if self.selected_tables is None:
+				self._drop_views()
+
+				logger.info("Deleting tables ....")
+				self.meta.drop_all(self.con)
+
+				logger.info('Re-creating tables ....')
+				self.meta.create_all(self.con)
+			else:
+				tables=[self.meta.tables[n] for n in self.selected_tables]
+				foreign_keys=self._referencing_foreign_keys()
+				self._drop_views(self._affected_views())
+				for fk in foreign_keys:
+					logger.debug('Deleting foreign key %s of %s',fk['name'],fk['table'])
+					self.con.execute('ALTER TABLE [%s] DROP CONSTRAINT [%s]' % (fk['table'],fk['name']))
+
+				logger.info('Deleting %d tables ....',len(tables))
+				self.meta.drop_all(self.con,tables=tables)
+
+				logger.info('Re-creating %d tables ....',len(tables))
+				self.meta.create_all(self.con,tables=tables)
+
+				for fk in foreign_keys:
+					logger.debug('Adding foreign key %s of %s',fk['name'],fk['table'])
+					self.con.execute(
+						'ALTER TABLE [%s] WITH NOCHECK ADD CONSTRAINT [%s] FOREIGN KEY (%s) REFERENCES [%s] (%s) ON DELETE %s ON UPDATE %s' % (
+							fk['table'],
+							fk['name'],
+							', '.join(['[%s]' % c for c in fk['columns']]),
+							fk['referred_table'],
+							', '.join(['[%s]' % c for c in fk['referred_columns']]),
+							fk['ondelete'],
+							fk['onupdate']
+						)
+					)
+
+			_checkpoints.drop(self.con,checkfirst=True)
+			_checkpoints.create(self.con)
+
+
+	def readCheckpoints(self):
+		''' Reads the last committed block per table from the checkpoint table of an
+			interrupted restore. Views are dropped, because they get re-created with
+			the other database objects at the end of the restore.
+		'''
+		logger=_getLogger('readCheckpoints')
+		with transaction(self.con):
+			res=self.con.execute(_checkpoints.select())
+			self.checkpoints={ r[0]: r[1] for r in res.fetchall() }
+			res.close()
+
+			self._drop_views(self._affected_views() if self.selected_tables is not None else None)
+		logger.info('Resuming restore with checkpoints for %d tables',len(self.checkpoints))
+		return self.checkpoints
+
+
+	def createCheckpoints(self):
+		''' Creates an empty checkpoint table, which createSchema does for a full restore
+		'''
+		with transaction(self.con):
+			_checkpoints.drop(self.con,checkfirst=True)
+			_checkpoints.create(self.con)
+
+
+	def dropCheckpoints(self):
+		''' Removes the checkpoint table after a successful restore
+		'''
+		with transaction(self.con):
+			_checkpoints.drop(self.con,checkfirst=True)
+		_getLogger('dropCheckpoints').info('Checkpoints removed')
+
 
-			logger.info("Deleting tables ....")
-			self.meta.drop_all(self.con)
+	def _setCheckpoint(self,table_name,block):
+		''' Helper method to record the last block of a table that was imported. It has
+			to be called in the same transaction as the block insert.
+		'''
+		if table_name in self.checkpoints:
+			self.con.execute(
+				_checkpoints.update()\
+					.where(_checkpoints.c.table_name==table_name)\
+					.values(block=block)
+			)
+		else:
+			self.con.execute(_checkpoints.insert(),{'table_name': table_name, 'block': block})
+		self.checkpoints[table_name]=block
 
-			logger.info('Re-creating tables ....')
-			self.meta.create_all(self.con)
 
+	def _seekBlock(self,fh,file_name,block):
+		''' Helper method to position a table file at the start of the given block. The
+			block index is used for a direct seek. Backups without index are scanned,
+			skipping over the blocks without reading them.
+		'''
+		if block==0:
+			return
+
+		entries=[]
+		index_name=index_file_name(file_name)
+		if self.storage.exists(index_name):
+			with self.storage.open_read(index_name) as ix:
+				entries=read_index(ix)
+		if len(entries)>=block:
+			if block<len(entries):
+				fh.seek(entries[block].offset)
+			else:
+				fh.seek(entries[-1].offset+entries[-1].length)
+		else:
+			for i in xrange(0,block):
+				if not skip_block(fh):
+					break
 
-	def changeRIChecks(self,off):
+
+	def changeRIChecks(self,off,check=True):
 		''' Method to turn Referential Integrity checks on or off
+
+			* off - turn the checks off
+			* check - check the existing rows, when the checks are turned on
 		'''
 		logger=_getLogger('turnOffRIChecks')
 		with transaction(self.con):
 			if off:
 				logger.info('Turn off RI checks')
 				self.con.execute('EXEC sp_msforeachtable "ALTER TABLE ? NOCHECK CONSTRAINT all"')
-			else:
+			elif check:
 				logger.info('Turn on RI checks')
 				self.con.execute('EXEC sp_msforeachtable "ALTER TABLE ? WITH CHECK CHECK CONSTRAINT all"')
+			else:
+				logger.info('Turn on RI checks without checking the existing rows')
+				self.con.execute('EXEC sp_msforeachtable "ALTER TABLE ? CHECK CONSTRAINT all"')
+
+
+	def _turnOnChecks(self,triggers=False):
+		''' Helper method that turns the RI checks, and the triggers of a merge, on again
+			after a restore failed. The rows of a partial restore are not checked, and
+			errors are only logged, so they don't hide the error of the restore.
+		'''
+		logger=_getLogger('_turnOnChecks')
+		try:
+			self._recycleConnection()
+			if triggers:
+				self.changeTriggers(off=False)
+			self.changeRIChecks(off=False,check=False)
+		except Exception:
+			logger.exception('Turning the checks on again failed')
+
+
+	def _referencing_foreign_keys(self):
+		''' Helper method that returns the foreign keys of tables in the database, that
+			are not restored, referencing one of the restored tables. They are read from
+			the database, because the tables may differ from the backup.
+		'''
+		selected=set(n.lower() for n in self.selected_tables)
+		foreign_keys=[]
+		res=self.con.execute(_referencing_foreign_keys)
+		for (name,table,column,referred_table,referred_column,ondelete,onupdate) in res.fetchall():
+			if referred_table.lower() not in selected or table.lower() in selected:
+				continue
+			if not foreign_keys or foreign_keys[-1]['name']!=name:
+				foreign_keys.append({
+					'name': name,
+					'table': table,
+					'columns': [],
+					'referred_table': referred_table,
+					'referred_columns': [],
+					'ondelete': ondelete.replace('_',' '),
+					'onupdate': onupdate.replace('_',' ')
+				})
+			foreign_keys[-1]['columns'].append(column)
+			foreign_keys[-1]['referred_columns'].append(referred_column)
+		res.close()
+		return foreign_keys
+
+
+	def _affected_views(self):
+		''' Helper method that returns the views depending on the restored tables,
+			directly or through other views, in the order they are created.
+		'''
+		affected=set(n.lower() for n in self.selected_tables)
+		views=[]
+		for v in self.views:
+			if any(d in affected for d in v.dependencies or []):
+				affected.add(v.name.lower())
+				views.append(v)
+		return views
+
+
+	def _affected_triggers(self):
+		''' Helper method that returns the triggers of the restored tables, which were
+			deleted with their tables.
+		'''
+		selected=set(n.lower() for n in self.selected_tables)
+		return [t for t in self.triggers if trigger_table(t.defintion) in selected]
+
+
+	def changeTriggers(self,off):
+		''' Method to disable or enable the triggers of all tables, so a merge restore
+			doesn't fire them
+		'''
+		logger=_getLogger('changeTriggers')
+		with transaction(self.con):
+			if off:
+				logger.info('Disable triggers')
+				self.con.execute('EXEC sp_msforeachtable "ALTER TABLE ? DISABLE TRIGGER all"')
+			else:
+				logger.info('Enable triggers')
+				self.con.execute('EXEC sp_msforeachtable "ALTER TABLE ? ENABLE TRIGGER all"')
 
 
-	def _drop_views(self):
-		''' Helper method to delete all views
+	def _drop_views(self,views=None):
+		''' Helper method to delete all views, or the given views
 		'''
 		_getLogger('_drop_views').info('Dropping views')
-		for v in reversed(self.views):
+		for v in reversed(self.views if views is None else views):
 			self.con.execute("IF EXISTS (SELECT * FROM INFORMATION_SCHEMA.VIEWS WHERE table_name= '%s') DROP VIEW %s" % (v.name,v.name))
 
 
@@ -118,61 +494,269 @@ class Restore(DumpRestoreBase):
 			restored row by row without the blobs and then the blobs will be added in chunks of 65k.
 
 			Every 50 blocks the current database connection with be recycled as well.
+
+			The number of the last block imported for each table is recorded in a checkpoint
+			table in the same transaction as the block. A resumed restore continues each table
+			with the block after its checkpoint.
 		'''
 		logger=_getLogger('import_tables')
 		logger.info('Importing tables')
-		for (table_name,table) in self.meta.tables.iteritems():
-
-			large_columns=self._largeColumns[table_name]
-			file_name=os.path.join(self.backup_dir,'{}.pickle'.format(table_name))
-
-			logger.info('Restore data for table %s',table_name)
-			logger.debug('   table has large columns: %s',','.join([c.name for c in large_columns]))
-			logger.debug('   reading content from %s',file_name)
-			cnt=100
-			pks=self._getPrimaryKeyColumns(table)
-			if len(large_columns)>0 and len(pks)!=1:
-				logger.warn('Table %s with blobs has more or no primary key columns - falling back to block insert',table_name)
-			with open(file_name,'rb') as fh:
-				l=fh.readline()
-				while l and l!='EOF':
-					l=int(l)
+		for table_name in self.storage.table_order(self.restore_tables):
+			self._import_table(table_name)
+		self._read_trailer()
+
+
+	def _import_table(self,table_name):
+		''' Helper method that restores the content of one table for import_tables
+		'''
+		logger=_getLogger('import_tables')
+		table=self.meta.tables[table_name]
+		large_columns=self._largeColumns[table_name]
+		file_name=table_file_name(table_name,self.format)
+
+		logger.info('Restore data for table %s',table_name)
+		logger.debug('   table has large columns: %s',','.join([c.name for c in large_columns]))
+		logger.debug('   reading content from %s',file_name)
+		cnt=100
+		pks=self._getPrimaryKeyColumns(table)
+		if len(large_columns)>0 and len(pks)!=1:
+			logger.warn('Table %s with blobs has more or no primary key columns - falling back to block insert',table_name)
+		block=self.checkpoints.get(table_name,-1)+1
+		if block>0:
+			logger.info('   continuing with block %d',block)
+		with self.storage.open_read(file_name) as fh, self.report.table(table_name) as stats:
+			self._seekBlock(fh,file_name,block)
+			l=fh.readline()
+			while l and l!='EOF':
+				l=int(l)
+				with stats.timer('read'):
 					buf=fh.read(l)
-					rows=pickle.loads(buf)
-					logger.debug('Importing block with %d bytes and %d rows', l,len(rows))
-
-					# freetds seems to have a bug, where the odbc connection after a number
-					# of requests gets bad. So, we recyle the connection after a while
-					if cnt>=50:
-						logger.debug('Recyling connection')
-						self._recycleConnection()
-						cnt=0
+				with stats.timer('deserialize'):
+					rows=self.codec.decode(buf)
+				logger.debug('Importing block with %d bytes and %d rows', l,len(rows))
+
+				# freetds seems to have a bug, where the odbc connection after a number
+				# of requests gets bad. So, we recyle the connection after a while
+				if cnt>=50:
+					logger.debug('Recyling connection')
+					self._recycleConnection()
+					cnt=0
+				else:
+					cnt=cnt+1
+
+				# the chunks of large values are read while they are inserted
+				with transaction(self.con), stats.timer('insert'):
+					if len(large_columns)>0 and len(pks)==1:
+						self._insertBlockWithLargeColumns(table,rows,fh)
+					else:
+						self._insertBlock(table,rows)
+					self._setCheckpoint(table_name,block)
+				stats.add(rows=len(rows),bytes=l,blocks=1)
+
+				block+=1
+				l=fh.readline()
+
+
+	def merge_tables(self):
+		''' Restores the tables into a target that has the same schema as the backup and
+			probably most of its rows, like a copy of the database from the day before.
+			Only the rows that differ from the backup are inserted, updated or deleted.
+
+			The blocks of a table are in primary key order, so each block covers the key
+			range from the last key of the previous block up to its own last key. The
+			rows of the target in this range are read and compared with the rows of the
+			block by their values. New rows are inserted, changed rows are loaded into a
+			staging table and updated from there with one statement, and rows that are
+			not in the block are deleted by key. Rows after the last block are deleted
+			at the end.
+
+			Only backups dumped in primary key order can be merged, older backups have
+			to be restored without merge. Rows are identified by all columns of their
+			primary key. Tables without a
+			primary key can't be merged. Their rows are deleted and restored completely.
+		'''
+		logger=_getLogger('merge_tables')
+		if not self.info.get('pk_ordered'):
+			raise Exception('The backup {} was not dumped in primary key order, it can\'t be merged'.format(self.backup_dir))
+		logger.info('Merging tables')
+		for table_name in self.storage.table_order(self.restore_tables):
+			table=self.meta.tables[table_name]
+			if not self._getPrimaryKeyColumns(table):
+				logger.warn('Table %s has no primary key - restoring it completely',table_name)
+				with transaction(self.con):
+					self.con.execute(table.delete())
+				self._import_table(table_name)
+				continue
+			self.merge_stats[table_name]=self._merge_table(table)
+			logger.info('Merged %s: %d inserted, %d updated, %d deleted',table_name,*self.merge_stats[table_name])
+		self._read_trailer()
+		return self.merge_stats
+
+
+	def _read_trailer(self):
+		''' Helper method that merges the trailer of a stream into the info. The trailer
+			follows the tables and has the info, that was only known after the tables
+			were dumped, like the start of the snapshot (see Dump.finsih_backup).
+		'''
+		if self.storage.sequential and self.storage.exists(TRAILER_FILE):
+			with self.storage.open_read(TRAILER_FILE) as fh:
+				self.info.update(json.load(fh))
+
+
+	def _merge_table(self,table):
+		''' Helper method that merges the blocks of a table into the target and returns
+			the number of inserted, updated and deleted rows
+		'''
+		logger=_getLogger('_merge_table')
+		pk=self._getPrimaryKeyColumns(table)
+		columns=list(table.columns)
+		large_columns=self._largeColumns[table.name]
+		file_name=table_file_name(table.name,self.format)
+		stats=[0,0,0]
+		last=None
+		cnt=100
+		with self.storage.open_read(file_name) as fh, self.report.table(table.name) as table_stats:
+			l=fh.readline()
+			while l and l!='EOF':
+				with table_stats.timer('read'):
+					rows=self._materialize_large_values(self.codec.decode(fh.read(int(l))),large_columns,fh)
+				table_stats.add(rows=len(rows),bytes=int(l),blocks=1)
+				_check_key_order(table.name,[_row_values(r,pk) for r in rows],last)
+
+				if cnt>=50:
+					self._recycleConnection()
+					cnt=0
+				else:
+					cnt=cnt+1
+
+				with transaction(self.con), table_stats.timer('merge'):
+					key_range=sa.not_(_key_after(pk,_row_values(rows[-1],pk)))
+					if last is not None:
+						key_range=sa.and_(_key_after(pk,last),key_range)
+					with execute_resultset(self.con,table.select().where(key_range)) as res:
+						target={_row_values(r,pk): _row_values(r,columns) for r in res.fetchall()}
+
+					inserts=[r for r in rows if _row_values(r,pk) not in target]
+					updates=[r for r in rows if _row_values(r,pk) in target and target[_row_values(r,pk)]!=_row_values(r,columns)]
+					keys=set(_row_values(r,pk) for r in rows)
+					deletes=sorted(k for k in target if k not in keys)
+					logger.debug('Block with %d rows: %d inserts, %d updates, %d deletes',len(rows),len(inserts),len(updates),len(deletes))
+
+					self._deleteKeys(table,pk,deletes)
+					if large_columns:
+						# changed values of large columns may exceed what can be updated in one
+						# piece, so changed rows are deleted and inserted again
+						self._deleteKeys(table,pk,sorted(_row_values(r,pk) for r in updates))
+						if (inserts or updates) and len(pk)==1:
+							self._insertBlockWithLargeColumns(table,inserts+updates)
+						elif inserts or updates:
+							self._insertBlock(table,inserts+updates)
 					else:
-						cnt=cnt+1
+						if inserts:
+							self._insertBlock(table,inserts)
+						self._updateFromStage(table,pk,updates)
+
+				stats=[stats[0]+len(inserts),stats[1]+len(updates),stats[2]+len(deletes)]
+				last=_row_values(rows[-1],pk)
+				l=fh.readline()
+
+		with transaction(self.con):
+			res=self.con.execute(table.delete().where(_key_after(pk,last)) if last is not None else table.delete())
+			stats[2]+=res.rowcount if res.rowcount>0 else 0
+		return tuple(stats)
+
+
+	def _materialize_large_values(self,rows,large_columns,fh):
+		''' Helper method that replaces the LargeValue markers in the rows of a block by
+			their values, which are read from the table file, so the rows can be compared
+		'''
+		if not large_columns:
+			return rows
+		ret=[]
+		for row in rows:
+			row=dict(row)
+			for c in large_columns:
+				v=row[c.name]
+				if isinstance(v,LargeValue):
+					row[c.name]=(u'' if v.unicode else '').join(read_large_value(fh,v))
+			ret.append(row)
+		return ret
+
+
+	def _deleteKeys(self,table,pk,keys):
+		''' Helper method that deletes the rows with the given primary keys in batches
+
+			* pk - the primary key columns
+			* keys - sorted list of key tuples
+		'''
+		for batch in batches(keys,pk):
+			self.con.execute(table.delete().where(key_condition(pk,batch)))
+
+
+	def _updateFromStage(self,table,pk,rows):
+		''' Helper method that updates changed rows set based. The rows are bulk inserted
+			into a temporary staging table and the target rows are updated from it with
+			one UPDATE ... FROM statement joining it on the primary key, so the staging
+			table is read once.
+		'''
+		if not rows:
+			return
+		stage=self._stageTable(table)
+		stage.create(self.con)
+		try:
+			self.con.execute(stage.insert(),[{c.name: r[c.name] for c in table.columns} for r in rows])
+			self.con.execute(self._updateFromStageStatement(table,pk,stage))
+		finally:
+			stage.drop(self.con)
+
+
+	def _stageTable(self,table):
+		''' Helper method that returns the temporary staging table of a table '''
+		return sa.Table(
+			'#albackup_stage_'+table.name,
+			sa.MetaData(),
+			*[sa.Column(c.name,c.type) for c in table.columns]
+		)
+
+
+	def _updateFromStageStatement(self,table,pk,stage):
+		''' Helper method that returns the statement, which sets all columns of the rows
+			of a table from the rows of the staging table with the same primary key:
 
-					with transaction(self.con):
-						if len(large_columns)>0 and len(pks)==1:
-							self._insertBlockWithLargeColumns(table,rows)
-						else:
-							self._insertBlock(table,rows)
+				UPDATE t SET a=#stage.a, ... FROM t, #stage WHERE t.id = #stage.id
+		'''
+		return table.update()\
+			.values({c: stage.c[c.name] for c in table.columns if c not in pk})\
+			.where(sa.and_(*[k==stage.c[k.name] for k in pk]))
 
-					l=fh.readline()  
 
-	def _insertBlockWithLargeColumns(self,table,rows):
+	def _insertBlockWithLargeColumns(self,table,rows,fh=None):
 		''' Helper method that restores tables with large columns. The method first
 			bulk inserts all rows in the block that don't contain any blob fields
 			that exceed 65k. Then the problem rows will be inserted row by row without
 			the blob fields, before the blob fields are loaded in blocks of 65k each.
+
+			Values that were dumped in chunks after the block are replaced by a
+			LargeValue in the row. Their chunks are read from the table file fh
+			while they are loaded, in the same order in which they were written.
 		'''
 		logger=_getLogger('_insertBlockWithLargeColumns')
 		large_columns=self._largeColumns[table.name]
 
+		def isLargeValue(value):
+			return isinstance(value,LargeValue) or (value and len(value)>65535)
+
 		def hasLargeField(row):
 			for c in large_columns:
-				if row[c.name] and len(row[c.name])>65535:
+				if isLargeValue(row[c.name]):
 					return True
 			return False
 
+		def splitValue(value):
+			while len(value)>0:
+				yield value[0:65535]
+				value=value[65535:]
+
 		def insertRow(row):
 			try:
 				self.con.execute(table.insert(),row)
@@ -180,11 +764,9 @@ class Restore(DumpRestoreBase):
 				logger.exception("Error inserting rows into %s:",table.name)
 				raise
 
-		def updateLargeColumn(pk,pk_value,col,value):
+		def updateLargeColumn(pk,pk_value,col,chunks):
 			logger.debug('Setting large value for column %s in row with pk %s',col.name,str(pk_value))
-			while len(value)>0:
-				chunk=value[0:65535]
-				value=value[65535:]
+			for chunk in chunks:
 				args={col.name: col+chunk}
 				try:
 					self.con.execute(table.update()\
@@ -221,7 +803,7 @@ class Restore(DumpRestoreBase):
 			large_value_map={}
 			new_row={}
 			for col in table.columns:
-				if col in large_columns and row[col.name] and len(row[col.name])>65535:
+				if col in large_columns and isLargeValue(row[col.name]):
 					large_value_map[col.name]=row[col.name]
 					new_row[col.name]=u''
 				else:
@@ -231,9 +813,15 @@ class Restore(DumpRestoreBase):
 			insertRow(new_row)
 
 			logger.debug('  -> setting the large columns')
-			for (c,v) in large_value_map.iteritems():
-				col=table.columns[c]
-				updateLargeColumn(pk,pk_value,col,v)
+			for c in large_columns:
+				if c.name not in large_value_map:
+					continue
+				v=large_value_map[c.name]
+				col=table.columns[c.name]
+				if isinstance(v,LargeValue):
+					updateLargeColumn(pk,pk_value,col,read_large_value(fh,v))
+				else:
+					updateLargeColumn(pk,pk_value,col,splitValue(v))
 
 	def _recycleConnection(self):
 		# helper method to close the current connection and getting a new one
@@ -241,11 +829,15 @@ class Restore(DumpRestoreBase):
 		self.con=self.engine.connect()
 		con.invalidate()
 		con.close()
+		self.report.count('connection_recycles')
 
 
 	def _insertBlock(self,table,rows):
 		''' Helper method to bulk insert a block of rows
 		'''
+		if not rows:
+			# an insert without parameters would add a row with default values
+			return
 		try:
 			self.con.execute(table.insert(),rows)
 		except: # pragma: nocover
@@ -263,9 +855,21 @@ class Restore(DumpRestoreBase):
 		
 
 	def import_objects(self):
-		''' Restores procedures, functions and triggers that were preserved with the backup
+		''' Restores procedures, functions and triggers that were preserved with the backup.
+			If only some tables are restored, only the views depending on them and their
+			triggers are restored.
 		'''
 		logger=_getLogger('import_objects')
+		if self.selected_tables is not None:
+			logger.info('Importing views and triggers of the restored tables')
+			self._import_object(None,self._affected_views())
+			self._import_object(
+				"if exists (select * from sysobjects o where type='TR' and name='%s')"+\
+					"drop trigger %s",
+				self._affected_triggers()
+			)
+			return
+
 		objects=(
 			(	self.procedures, 	
 				"if exists (select * from information_schema.routines where routine_schema='dbo' "+\
@@ -0,0 +1,295 @@
+import json
+from functools import partial
+import sqlalchemy as sa
+from sqlalchemy.dialects import mssql
+
+from . import ObjectDef,loggerFactory
+
+
+SCHEMA_FILE='_schema.json'
+''' Manifest of format v2 backups with the backup information and the index of the schema entries '''
+
+SCHEMA_ENTRIES_FILE='_schema.jsonl'
+''' Table and object definitions of format v2 backups '''
+
+FORMAT_VERSION=2
+
+OBJECT_TYPES=('procedures','functions','triggers','views')
+''' Keys of the object definitions in the backup info '''
+
+_getLogger=loggerFactory('schema')
+
+
+def _type_classes():
+	# column types that can be rebuilt from a schema manifest. Only the types of
+	# SQLAlchemy and its mssql dialect are allowed, types of the dialect take
+	# precedence over generic types with the same name.
+	ret={}
+	for module in (sa.types,mssql):
+		for (name,cls) in vars(module).items():
+			if isinstance(cls,type) and issubclass(cls,sa.types.TypeEngine):
+				ret[name]=cls
+	return ret
+
+_TYPES=_type_classes()
+
+
+def _is_json(value):
+	if isinstance(value,(list,tuple)):
+		return all(map(_is_json,value))
+	return value is None or isinstance(value,(bool,int,long,float,basestring))
+
+
+def type_to_dict(type_):
+	''' Returns a dict with the class name and constructor arguments of a column type:
+
+			{"type": "NVARCHAR", "args": {"length": 50, "collation": "..."}}
+	'''
+	cls=type(type_)
+	if _TYPES.get(cls.__name__) is not cls:
+		raise Exception('Column type {} is not supported in format v2 backups'.format(cls.__name__))
+	args={}
+	for name in sa.util.get_cls_kwargs(cls):
+		if name.startswith('_') or not hasattr(type_,name):
+			continue
+		value=getattr(type_,name)
+		if _is_json(value):
+			args[name]=value
+	return {'type': cls.__name__, 'args': args}
+
+
+def type_from_dict(d):
+	''' Returns the column type for a dict created with type_to_dict '''
+	if d['type'] not in _TYPES:
+		raise Exception('Unknown column type {}'.format(d['type']))
+	return _TYPES[d['type']](**{str(k): v for (k,v) in d['args'].items()})
+
+
+def table_to_dict(table):
+	''' Returns a dict with the definition of a table, its columns, constraints
+		and indexes, that can be written as JSON
+	'''
+	def column_to_dict(col):
+		d={
+			'name': col.name,
+			'type': type_to_dict(col.type),
+			'nullable': col.nullable,
+			'autoincrement': col.autoincrement,
+			'default': None
+		}
+		if col.server_default is not None:
+			arg=col.server_default.arg
+			d['default']=arg.text if hasattr(arg,'text') else unicode(arg)
+		if isinstance(col.default,sa.Sequence):
+			d['identity']={
+				'name': col.default.name,
+				'start': col.default.start,
+				'increment': col.default.increment
+			}
+		return d
+
+	def dialect_kwargs(item):
+		return {k: v for (k,v) in item.dialect_kwargs.items() if _is_json(v)}
+
+	return {
+		'name': table.name,
+		'schema': table.schema,
+		'columns': [column_to_dict(c) for c in table.columns],
+		'primary_key': {
+			'name': table.primary_key.name,
+			'columns': [c.name for c in table.primary_key.columns]
+		},
+		'foreign_keys': [
+			{
+				'name': fk.name,
+				'columns': [c for c in fk.column_keys],
+				'references': [e.target_fullname for e in fk.elements],
+				'ondelete': fk.ondelete,
+				'onupdate': fk.onupdate
+			}
+			for fk in sorted(table.foreign_key_constraints,key=lambda fk: fk.name)
+		],
+		'unique_constraints': [
+			{'name': uc.name, 'columns': [c.name for c in uc.columns]}
+			for uc in table.constraints if isinstance(uc,sa.UniqueConstraint)
+		],
+		'indexes': [
+			{
+				'name': ix.name,
+				'columns': [c.name for c in ix.columns],
+				'unique': ix.unique,
+				'dialect_kwargs': dialect_kwargs(ix)
+			}
+			for ix in sorted(table.indexes,key=lambda ix: ix.name)
+		]
+	}
+
+
+def table_from_dict(meta,d):
+	''' Adds the table defined by a dict created with table_to_dict to the meta data
+		and returns it
+	'''
+	def column_from_dict(c):
+		args=[type_from_dict(c['type'])]
+		if 'identity' in c:
+			identity=c['identity']
+			args.append(sa.Sequence(identity['name'],start=identity['start'],increment=identity['increment']))
+		return sa.Column(
+			c['name'],
+			*args,
+			nullable=c['nullable'],
+			autoincrement=c['autoincrement'],
+			server_default=sa.text(c['default']) if c['default'] is not None else None
+		)
+
+	args=[column_from_dict(c) for c in d['columns']]
+	if d['primary_key']['columns']:
+		args.append(sa.PrimaryKeyConstraint(*d['primary_key']['columns'],name=d['primary_key']['name']))
+	for fk in d['foreign_keys']:
+		args.append(sa.ForeignKeyConstraint(
+			fk['columns'],
+			fk['references'],
+			name=fk['name'],
+			ondelete=fk['ondelete'],
+			onupdate=fk['onupdate']
+		))
+	for uc in d['unique_constraints']:
+		args.append(sa.UniqueConstraint(*uc['columns'],name=uc['name']))
+
+	table=sa.Table(d['name'],meta,*args,schema=d['schema'])
+	for ix in d['indexes']:
+		sa.Index(
+			ix['name'],
+			*[table.columns[c] for c in ix['columns']],
+			unique=ix['unique'],
+			**{str(k): v for (k,v) in ix['dialect_kwargs'].items()}
+		)
+	return table
+
+
+def write_schema(storage,info):
+	''' Writes the schema of a backup in two files. The schema entries _schema.jsonl
+		have one line of JSON for every table definition and every type of object
+		definitions:
+
+			{"name": "t1", "columns": [...], ...}\n
+			[{"name": "v1", "definition": "...", "dependencies": [...]}, ...]\n
+
+		The schema manifest _schema.json has the other information of the backup and
+		the offset and length of every entry, so single entries can be read without
+		parsing the others:
+
+			{
+			 "format": 2,
+			 "codec": "binary",
+			 "started": "...",
+			 "entries": {
+			  "tables": {"t1": [0, 1200], ...},
+			  "objects": {"views": [1200, 5400], ...}
+			 },
+			 ...
+			}
+
+		The manifest is written first, so it is the first file in backup streams.
+
+		* storage - the storage of the backup
+		* info - the backup info
+	'''
+	meta=info.get('meta')
+	entries=[]
+	for name in sorted(meta.tables.keys()) if meta is not None else []:
+		entries.append(('tables',name,table_to_dict(meta.tables[name])))
+	for key in OBJECT_TYPES:
+		if key in info:
+			entries.append(('objects',key,[
+				{'name': o.name, 'definition': o.defintion, 'dependencies': o.dependencies}
+				for o in info[key]
+			]))
+
+	lines=[]
+	index={'tables': {}, 'objects': {}}
+	offset=0
+	for (kind,key,entry) in entries:
+		line=json.dumps(entry,sort_keys=True)+'\n'
+		index[kind][key]=[offset,len(line)]
+		lines.append(line)
+		offset+=len(line)
+
+	doc={k: v for (k,v) in info.items() if k!='meta' and k not in OBJECT_TYPES}
+	doc['format']=FORMAT_VERSION
+	doc['entries']=index
+	storage.write_file(SCHEMA_FILE,json.dumps(doc,indent=1,sort_keys=True))
+	storage.write_file(SCHEMA_ENTRIES_FILE,''.join(lines))
+
+
+class BackupSchema(object):
+	''' Reader of the schema of format v2 backups (see write_schema). Loading the
+		schema only reads the small schema manifest. The definition of a table is
+		read from the schema entries, when the table is needed, and the SQLAlchemy
+		meta data is only built for these tables. Reading the schema doesn't execute
+		any code from the backup.
+	'''
+
+	def __init__(self,doc,read_entry):
+		''' Constructor
+
+			* doc - the parsed schema manifest
+			* read_entry - function that returns the given number of bytes from
+			               the given offset of the schema entries
+		'''
+		if doc.get('format')!=FORMAT_VERSION:
+			raise Exception('Unsupported backup format {}'.format(doc.get('format')))
+		self.doc=doc
+		self._read_entry=read_entry
+
+	@classmethod
+	def load(cls,storage):
+		''' Reads the schema manifest from the storage of a backup. The schema
+			entries of sequential storages are kept in memory, because they can't
+			be read later on.
+		'''
+		with storage.open_read(SCHEMA_FILE) as fh:
+			doc=json.load(fh)
+		if storage.sequential:
+			with storage.open_read(SCHEMA_ENTRIES_FILE) as fh:
+				data=fh.read()
+			read_entry=lambda offset,length: data[offset:offset+length]
+		else:
+			read_entry=partial(storage.read_range,SCHEMA_ENTRIES_FILE)
+		return cls(doc,read_entry)
+
+	def _entry(self,kind,key):
+		# helper method that reads and parses one schema entry
+		(offset,length)=self.doc['entries'][kind][key]
+		return json.loads(self._read_entry(offset,length))
+
+	def info(self):
+		''' Returns the backup info without the meta data and the object definitions,
+			which are read with the metadata and objects methods
+		'''
+		return {k: v for (k,v) in self.doc.items() if k!='entries'}
+
+	def table_names(self):
+		''' Returns the names of all tables in the backup '''
+		return sorted(self.doc['entries']['tables'].keys())
+
+	def table(self,meta,name):
+		''' Reads the definition of a table and adds it to the meta data '''
+		return table_from_dict(meta,self._entry('tables',name))
+
+	def metadata(self,table_names=None):
+		''' Builds the SQLAlchemy meta data of the given tables, or all tables '''
+		meta=sa.MetaData()
+		for name in table_names if table_names is not None else self.table_names():
+			self.table(meta,name)
+		_getLogger('BackupSchema').debug('Meta data of %d tables built',len(meta.tables))
+		return meta
+
+	def objects(self,key):
+		''' Returns the list of ObjectDef objects of the given type, for example views '''
+		if key not in self.doc['entries']['objects']:
+			raise KeyError(key)
+		return [
+			ObjectDef(o['name'],o['definition'],o['dependencies'])
+			for o in self._entry('objects',key)
+		]
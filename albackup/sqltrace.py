@@ -0,0 +1,142 @@
+import re
+import threading
+import time
+from sqlalchemy import event
+
+from . import loggerFactory
+
+
+_getLogger=loggerFactory('sqltrace')
+
+_START_KEY='albackup_sqltrace_start'
+
+_LITERALS=[
+	(re.compile(r"(?:\bN)?'(?:[^']|'')*'"),'?'),
+	(re.compile(r'\b0x[0-9a-fA-F]+\b'),'?'),
+	(re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b'),'?'),
+	(re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)'),'(?, ...)'),
+	(re.compile(r'\s+'),' ')
+]
+
+
+def statement_shape(statement):
+	''' Returns the shape of a SQL statement: string and number literals are replaced
+		by ?, lists of them by (?, ...) and whitespace is collapsed, so the lookups of
+		all tables, like exec sp_helptext 'dbo.v1', have the same shape
+	'''
+	for (pattern,replacement) in _LITERALS:
+		statement=pattern.sub(replacement,statement)
+	return statement.strip()
+
+
+class StatementStats(object):
+	''' Count and latency of the statements of one shape '''
+
+	def __init__(self,shape):
+		self.shape=shape
+		self.count=0
+		self.seconds=0.0
+		self.max_seconds=0.0
+		self.errors=0
+
+
+	def as_dict(self):
+		''' Returns the stats as dict for the report '''
+		return {
+			'shape': self.shape,
+			'count': self.count,
+			'errors': self.errors,
+			'seconds': round(self.seconds,3),
+			'avg_ms': round(1000*self.seconds/self.count,2) if self.count else None,
+			'max_ms': round(1000*self.max_seconds,2)
+		}
+
+
+class SQLTracer(object):
+	''' Traces the round trips to the database with the before_cursor_execute and
+		after_cursor_execute events of SQLAlchemy engines and aggregates their count
+		and latency by statement shape (see statement_shape):
+
+			tracer=SQLTracer()
+			tracer.attach(engine)
+			...
+			tracer.log_report(top=10)
+
+		A tracer can be attached to several engines, which are used by different
+		threads.
+	'''
+
+	def __init__(self):
+		self.statements={}
+		self._lock=threading.Lock()
+
+
+	def attach(self,engine):
+		''' Starts to trace the statements of an engine '''
+		event.listen(engine,'before_cursor_execute',self._before_cursor_execute)
+		event.listen(engine,'after_cursor_execute',self._after_cursor_execute)
+		event.listen(engine,'handle_error',self._handle_error)
+
+
+	def detach(self,engine):
+		''' Stops to trace the statements of an engine '''
+		event.remove(engine,'before_cursor_execute',self._before_cursor_execute)
+		event.remove(engine,'after_cursor_execute',self._after_cursor_execute)
+		event.remove(engine,'handle_error',self._handle_error)
+
+
+	def _before_cursor_execute(self,conn,cursor,statement,parameters,context,executemany):
+		conn.info.setdefault(_START_KEY,[]).append(time.time())
+
+
+	def _after_cursor_execute(self,conn,cursor,statement,parameters,context,executemany):
+		self._record(conn,statement,False)
+
+
+	def _handle_error(self,context):
+		if context.connection is not None and context.statement is not None:
+			self._record(context.connection,context.statement,True)
+
+
+	def _record(self,conn,statement,error):
+		# helper method that adds a finished statement to the stats of its shape
+		starts=conn.info.get(_START_KEY)
+		if not starts:
+			return
+		seconds=time.time()-starts.pop()
+		shape=statement_shape(statement)
+		with self._lock:
+			stats=self.statements.get(shape)
+			if stats is None:
+				stats=self.statements[shape]=StatementStats(shape)
+			stats.count+=1
+			stats.seconds+=seconds
+			stats.max_seconds=max(stats.max_seconds,seconds)
+			if error:
+				stats.errors+=1
+
+
+	def report(self,top=10):
+		''' Returns the totals and the top shapes by cumulative latency and by count '''
+		with self._lock:
+			statements=list(self.statements.values())
+		return {
+			'statements': sum([s.count for s in statements]),
+			'shapes': len(statements),
+			'seconds': round(sum([s.seconds for s in statements]),3),
+			'slowest': [s.as_dict() for s in sorted(statements,key=lambda s: s.seconds,reverse=True)[:top]],
+			'most_frequent': [s.as_dict() for s in sorted(statements,key=lambda s: s.count,reverse=True)[:top]]
+		}
+
+
+	def log_report(self,top=10,width=100):
+		''' Logs the top shapes by cumulative latency and by count '''
+		logger=_getLogger('SQLTracer')
+		report=self.report(top)
+		logger.info('%d SQL statements of %d shapes took %.1fs',report['statements'],report['shapes'],report['seconds'])
+		for (title,key) in (('Slowest statements:','slowest'),('Most frequent statements:','most_frequent')):
+			logger.info(title)
+			logger.info('   %8s %10s %10s %10s  %s','count','seconds','avg ms','max ms','statement')
+			for s in report[key]:
+				shape=s['shape'] if len(s['shape'])<=width else s['shape'][:width-3]+'...'
+				logger.info('   %8d %10.3f %10.2f %10.2f  %s',s['count'],s['seconds'],s['avg_ms'],s['max_ms'],shape)
@@ -0,0 +1,719 @@
+import os
+import time
+import tarfile
+from tempfile import SpooledTemporaryFile
+from multiprocessing.pool import ThreadPool
+
+from . import loggerFactory
+from .objectstore import ObjectStoreStorage,is_object_store,_RangeReader
+from .blocks import MANIFEST_FILE,TABLE_FILE_SUFFIXES,table_of_file
+from .report import REPORT_FILE
+from .schema import SCHEMA_FILE,SCHEMA_ENTRIES_FILE
+
+
+ARCHIVE_SUFFIX='.tar'
+
+STREAM_MAGIC='ALBACKUP-STREAM 1\n'
+''' First line of a backup stream '''
+
+STREAM_END='END\n'
+''' Last line of a backup stream '''
+
+_getLogger=loggerFactory('storage')
+
+
+def open_storage(location,client=None):
+	''' Returns the storage for an existing backup. Locations starting with s3://
+		are in an object store, locations ending with .tar are archives, everything
+		else is a backup directory.
+
+		* location - location of the backup
+		* client - optional client for the object store
+	'''
+	if is_object_store(location):
+		return ObjectStoreStorage(client,location,'r')
+	if location.endswith(ARCHIVE_SUFFIX):
+		return ArchiveStorage(location,'r')
+	return DirectoryStorage(location)
+
+
+class DirectoryStorage(object):
+	''' Storage of a backup in a directory with one file for each table and
+		the meta data. This is the default storage.
+	'''
+
+	supports_resume=True
+	''' Files in a directory can be truncated and appended to '''
+
+	sequential=False
+	''' Files can be written and read in any order '''
+
+	def __init__(self,path):
+		''' Constructor
+
+			* path - the backup directory
+		'''
+		self.path=path
+
+	def _path(self,name):
+		return os.path.join(self.path,name)
+
+	def exists(self,name):
+		''' Returns True, if a file with the given name exists in the backup '''
+		return os.path.exists(self._path(name))
+
+	def size(self,name):
+		''' Returns the size of a file in the backup '''
+		return os.path.getsize(self._path(name))
+
+	def truncate(self,name,size):
+		''' Truncates a file in the backup to the given size '''
+		with open(self._path(name),'r+b') as fh:
+			fh.truncate(size)
+
+	def open_write(self,name,append=False):
+		''' Opens a file in the backup for writing
+
+			* name - name of the file
+			* append - append to an existing file instead of replacing it
+		'''
+		return open(self._path(name),'ab' if append else 'wb')
+
+	def open_read(self,name):
+		''' Opens a file in the backup for reading '''
+		return open(self._path(name),'rb')
+
+	def read_range(self,name,offset,length):
+		''' Returns length bytes from the given offset of a file in the backup '''
+		with open(self._path(name),'rb') as fh:
+			fh.seek(offset)
+			return fh.read(length)
+
+	def write_file(self,name,data):
+		''' Replaces a file in the backup with the given content. The content is
+			written into a temporary file first, which is renamed afterwards, so
+			an interruption never leaves a partial file behind.
+		'''
+		tmp_name=self._path(name+'.tmp')
+		with open(tmp_name,'wb') as fh:
+			fh.write(data)
+		os.rename(tmp_name,self._path(name))
+
+	def table_order(self,table_names):
+		''' Returns the order in which the given tables are read from the backup '''
+		return table_names
+
+	def close(self):
+		''' Nothing to do for a backup directory '''
+		pass
+
+
+STRIPE_POLICIES=('round-robin','free-space')
+
+_PRIMARY_FILES=('_metadata.pickle',SCHEMA_FILE,SCHEMA_ENTRIES_FILE,MANIFEST_FILE,REPORT_FILE)
+''' Files of a striped backup, that are always in the first directory '''
+
+
+def stripe_paths(backup_dir,stripe_dirs):
+	''' Returns the directories of a backup in the given parent directories of
+		its stripes, which are named like the backup directory
+	'''
+	name=os.path.basename(os.path.normpath(backup_dir))
+	return [os.path.join(d,name) for d in stripe_dirs]
+
+
+def free_space(path):
+	''' Returns the free space in bytes of the file system with the given path '''
+	st=os.statvfs(path)
+	return st.f_bavail*st.f_frsize
+
+
+class StripedStorage(object):
+	''' Storage of a backup in several directories, usually on different disks. Each
+		table file is placed in one of the directories together with its block index,
+		either round-robin or in the directory with the most free space. The meta data
+		and the manifest are in the first directory and the layout is recorded in the
+		meta data.
+
+		Files are read in ranges by a pool of worker threads. While one table is
+		restored, the start of the next one is already read from its directory, so
+		the reads of all directories overlap.
+	'''
+
+	supports_resume=True
+	''' Files in the directories can be truncated and appended to '''
+
+	sequential=False
+	''' Files can be written and read in any order '''
+
+	part_size=1024*1024
+	''' Size of the ranges in which files are read '''
+
+	prefetch=4
+	''' Number of ranges read ahead of the reader '''
+
+	def __init__(self,paths,policy='round-robin',layout=None):
+		''' Constructor
+
+			* paths - list of backup directories, the first one holds the meta data
+			* policy - round-robin or free-space
+			* layout - dict with the directory index per file from an existing backup
+		'''
+		if policy not in STRIPE_POLICIES:
+			raise Exception('Invalid stripe policy {}'.format(policy))
+		self.paths=paths
+		self.policy=policy
+		self.files=dict(layout) if layout else {}
+		self._next=0
+		self._pool=None
+		self._prefetched={}
+
+	def _group(self,name):
+		# files of a table are kept together in the same directory
+		return os.path.splitext(name)[0]
+
+	def _index(self,name):
+		# helper method that returns the index of the directory for a file, new
+		# table files are placed according to the policy
+		group=self._group(name)
+		if name in _PRIMARY_FILES:
+			return 0
+		if group not in self.files:
+			existing=[i for (i,p) in enumerate(self.paths) if os.path.exists(os.path.join(p,name))]
+			if existing:
+				self.files[group]=existing[0]
+			elif self.policy=='free-space':
+				self.files[group]=max(range(0,len(self.paths)),key=lambda i: free_space(self.paths[i]))
+			else:
+				self.files[group]=self._next
+				self._next=(self._next+1) % len(self.paths)
+		return self.files[group]
+
+	def _path(self,name):
+		return os.path.join(self.paths[self._index(name)],name)
+
+	def layout(self):
+		''' Returns the layout of the backup, that is recorded in the meta data '''
+		return {'paths': list(self.paths), 'policy': self.policy, 'files': dict(self.files)}
+
+	def exists(self,name):
+		''' Returns True, if a file with the given name exists in the backup '''
+		return os.path.exists(self._path(name))
+
+	def size(self,name):
+		''' Returns the size of a file in the backup '''
+		return os.path.getsize(self._path(name))
+
+	def truncate(self,name,size):
+		''' Truncates a file in the backup to the given size '''
+		with open(self._path(name),'r+b') as fh:
+			fh.truncate(size)
+
+	def open_write(self,name,append=False):
+		''' Opens a file in the backup for writing '''
+		return open(self._path(name),'ab' if append else 'wb')
+
+	def open_read(self,name):
+		''' Opens a file in the backup for reading. Table files are read ahead by
+			the worker threads.
+		'''
+		if name in self._prefetched:
+			return self._prefetched.pop(name)
+		if name in _PRIMARY_FILES:
+			return open(self._path(name),'rb')
+		if self._pool is None:
+			self._pool=ThreadPool(2*len(self.paths))
+		return _RangeReader(self,self._path(name),self.size(name))
+
+	def read_range(self,name,offset,length):
+		''' Returns length bytes from the given offset of a file in the backup '''
+		return self._read_range(self._path(name),offset,offset+length-1)
+
+	def write_file(self,name,data):
+		''' Replaces a file in the backup with the given content '''
+		path=self._path(name)
+		with open(path+'.tmp','wb') as fh:
+			fh.write(data)
+		os.rename(path+'.tmp',path)
+
+	def _submit(self,func,*args):
+		return self._pool.apply_async(func,args)
+
+	def _read_range(self,path,start,end):
+		# helper method that reads a range of a file
+		with open(path,'rb') as fh:
+			fh.seek(start)
+			return fh.read(end-start+1)
+
+	def table_order(self,table_names):
+		''' Generator that returns the tables in the given order and starts reading
+			the file of the next table, while the current one is restored
+		'''
+		table_names=list(table_names)
+		for (i,table_name) in enumerate(table_names):
+			if i+1<len(table_names):
+				for suffix in TABLE_FILE_SUFFIXES.values():
+					name=table_names[i+1]+suffix
+					if name not in self._prefetched and self.exists(name):
+						reader=self.open_read(name)
+						reader.prefetch()
+						self._prefetched[name]=reader
+			yield table_name
+
+	def close(self):
+		''' Waits for the workers to finish '''
+		if self._pool is not None:
+			self._pool.close()
+			self._pool.join()
+			self._pool=None
+
+
+class _ArchiveMemberReader(tarfile.ExFileObject):
+	''' File object for reading an archive member, which can be used as
+		context manager like a regular file
+	'''
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self,*args):
+		self.close()
+
+
+class _StreamedMember(object):
+	''' File object that writes an archive member directly into the archive. The
+		header of the member is written with size 0 first and updated with the real
+		size, when the member is closed. This way table files don't need to be
+		staged anywhere, before they are added to the archive.
+	'''
+
+	def __init__(self,storage,name):
+		self.storage=storage
+		self.tar=storage._tar
+		self.info=tarfile.TarInfo(name)
+		self.info.mtime=time.time()
+		self.size=0
+
+		self.header_offset=self.tar.offset
+		header=self.info.tobuf(self.tar.format,self.tar.encoding,self.tar.errors)
+		self.tar.fileobj.write(header)
+		self.header_size=len(header)
+
+	def write(self,data):
+		self.tar.fileobj.write(data)
+		self.size+=len(data)
+
+	def flush(self):
+		self.tar.fileobj.flush()
+
+	def tell(self):
+		return self.size
+
+	def close(self):
+		fileobj=self.tar.fileobj
+		remainder=self.size % tarfile.BLOCKSIZE
+		if remainder>0:
+			fileobj.write(tarfile.NUL*(tarfile.BLOCKSIZE-remainder))
+		end=fileobj.tell()
+
+		self.info.size=self.size
+		header=self.info.tobuf(self.tar.format,self.tar.encoding,self.tar.errors)
+		if len(header)!=self.header_size: # pragma: nocover
+			raise Exception('Header size of archive member {} changed'.format(self.info.name))
+		fileobj.seek(self.header_offset)
+		fileobj.write(header)
+		fileobj.seek(end)
+
+		self.tar.offset=end
+		self.tar.members.append(self.info)
+		self.storage._closed(self)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self,*args):
+		self.close()
+
+
+class _SpooledMember(object):
+	''' File object for an archive member that is written, while another member
+		is streamed into the archive. The content is kept in a spooled temporary
+		file and added to the archive after the streamed member.
+	'''
+
+	MAX_MEMORY=16*1024*1024
+
+	def __init__(self,storage,name):
+		self.storage=storage
+		self.info=tarfile.TarInfo(name)
+		self.info.mtime=time.time()
+		self.fh=SpooledTemporaryFile(max_size=self.MAX_MEMORY)
+
+	def write(self,data):
+		self.fh.write(data)
+
+	def flush(self):
+		pass
+
+	def tell(self):
+		return self.fh.tell()
+
+	def close(self):
+		self.info.size=self.fh.tell()
+		self.fh.seek(0)
+		self.storage._closed(self)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self,*args):
+		self.close()
+
+
+class ArchiveStorage(object):
+	''' Storage of a backup in a single tar archive. Table files are streamed into
+		the archive as they are written and the meta data is the last member of the
+		archive. Readers access the members directly in the archive without
+		extracting them.
+
+		Only one member is streamed into the archive at a time. Files that are
+		written at the same time, like the block index of a table, are spooled and
+		added after it.
+	'''
+
+	supports_resume=False
+	''' Members in the archive can't be truncated or appended to '''
+
+	sequential=False
+	''' Members can be read in any order '''
+
+	def __init__(self,file_name,mode='r'):
+		''' Constructor
+
+			* file_name - name of the archive
+			* mode - 'r' to read an existing archive or 'w' to create a new one
+		'''
+		self.file_name=file_name
+		self.mode=mode
+		if mode=='w':
+			self._fh=open(file_name,'wb')
+			self._tar=tarfile.open(fileobj=self._fh,mode='w',format=tarfile.GNU_FORMAT)
+			self._streamed=None
+			self._pending=[]
+			_getLogger('ArchiveStorage').info('Writing backup into archive %s',file_name)
+		else:
+			self._fh=None
+			self._tar=tarfile.open(file_name,'r')
+			self._tar.fileobject=_ArchiveMemberReader
+			_getLogger('ArchiveStorage').info('Reading backup from archive %s',file_name)
+
+	def exists(self,name):
+		''' Returns True, if a member with the given name is in the archive '''
+		return name in self._tar.getnames()
+
+	def open_write(self,name,append=False):
+		''' Opens a new member of the archive for writing. The first member that is
+			opened is streamed into the archive, all others are spooled until it is
+			closed.
+		'''
+		if append:
+			raise Exception('Members of archive {} can\'t be appended'.format(self.file_name))
+		if self._streamed is None:
+			self._streamed=_StreamedMember(self,name)
+			return self._streamed
+		return _SpooledMember(self,name)
+
+	def open_read(self,name):
+		''' Opens a member of the archive for reading '''
+		return self._tar.extractfile(name)
+
+	def read_range(self,name,offset,length):
+		''' Returns length bytes from the given offset of a member of the archive '''
+		with self.open_read(name) as fh:
+			fh.seek(offset)
+			return fh.read(length)
+
+	def write_file(self,name,data):
+		''' Adds a member with the given content to the archive '''
+		with self.open_write(name) as fh:
+			fh.write(data)
+
+	def table_order(self,table_names):
+		''' Returns the order in which the given tables are read from the backup '''
+		return table_names
+
+	def _closed(self,member):
+		# helper method that adds spooled members to the archive, once no
+		# member is streamed any more
+		if member is self._streamed:
+			self._streamed=None
+		else:
+			self._pending.append(member)
+
+		if self._streamed is None:
+			for m in self._pending:
+				self._tar.addfile(m.info,m.fh)
+				m.fh.close()
+			self._pending=[]
+
+	def close(self):
+		''' Finishes the archive '''
+		self._tar.close()
+		if self._fh:
+			self._fh.close()
+			_getLogger('ArchiveStorage').info('Archive %s written',self.file_name)
+
+
+class _StreamMemberWriter(object):
+	''' File object for writing a file into a backup stream. Every write becomes a
+		record of the file in the stream and closing the file ends it.
+	'''
+
+	def __init__(self,storage,name):
+		self.storage=storage
+		self.name=name
+		self.size=0
+
+	def write(self,data):
+		if data:
+			self.storage._record(self.name,data)
+			self.size+=len(data)
+
+	def flush(self):
+		self.storage._fh.flush()
+
+	def tell(self):
+		return self.size
+
+	def close(self):
+		self.storage._record(self.name,'')
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self,*args):
+		self.close()
+
+
+class _StreamMemberReader(object):
+	''' File object for reading a file from a backup stream. The records of the
+		file are read from the stream on demand. Records of other files found in
+		between are kept by the storage.
+	'''
+
+	def __init__(self,storage,name):
+		self.storage=storage
+		self.name=name
+		self.buf=''
+
+	def _fill(self,size=None):
+		# helper method that reads records until the buffer holds at least size
+		# bytes or a complete line, if no size is given
+		while (len(self.buf)<size if size is not None else '\n' not in self.buf):
+			data=self.storage._next_data(self.name)
+			if data is None:
+				break
+			self.buf+=data
+
+	def read(self,size=-1):
+		self._fill(size if size>=0 else float('inf'))
+		if size<0:
+			size=len(self.buf)
+		ret=self.buf[:size]
+		self.buf=self.buf[size:]
+		return ret
+
+	def readline(self):
+		self._fill()
+		pos=self.buf.find('\n')
+		size=pos+1 if pos>=0 else len(self.buf)
+		ret=self.buf[:size]
+		self.buf=self.buf[size:]
+		return ret
+
+	def __iter__(self):
+		while True:
+			l=self.readline()
+			if not l:
+				return
+			yield l
+
+	def close(self):
+		# the rest of the file is skipped, so the stream is positioned behind it
+		while self.storage._next_data(self.name) is not None:
+			pass
+		self.buf=''
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self,*args):
+		self.close()
+
+
+class StreamStorage(object):
+	''' Storage of a backup in a single self-describing stream, which can be piped
+		into compression or upload tools and read back from a pipe. The stream is
+		written and read strictly sequential without any seeks:
+
+			ALBACKUP-STREAM 1\n
+			<size> <file name>\n
+			...size bytes of the file...
+			<size> <file name>\n
+			...
+			0 <file name>\n
+			...
+			END\n
+
+		Each file is written in records of arbitrary size, which may be interleaved
+		with records of other files, like the block index of a table. A record of
+		size 0 ends a file. Readers must request the files in the order they
+		appear in the stream, the meta data comes first. Records of files that are
+		not requested yet are kept in memory, so only small files should be written
+		concurrently with others. The block indexes of the tables are dropped when
+		the stream is read, they grow with the tables and a stream is restored
+		without seeks.
+	'''
+
+	supports_resume=False
+	''' A stream can't be truncated or appended to '''
+
+	sequential=True
+	''' Files are read in the order they were written '''
+
+	def __init__(self,fileobj,mode='r'):
+		''' Constructor
+
+			* fileobj - the stream, a file object opened in binary mode
+			* mode - 'r' to read a backup from the stream or 'w' to write one
+		'''
+		self.name=getattr(fileobj,'name','<stream>')
+		self.mode=mode
+		self._fh=fileobj
+		self._written=set()
+		self._pending={}
+		self._complete=set()
+		self._header=None
+		self._end=False
+		if mode=='w':
+			self._fh.write(STREAM_MAGIC)
+			_getLogger('StreamStorage').info('Writing backup into stream %s',self.name)
+		else:
+			if self._fh.readline()!=STREAM_MAGIC:
+				raise Exception('{} is not a backup stream'.format(self.name))
+			_getLogger('StreamStorage').info('Reading backup from stream %s',self.name)
+
+	def _record(self,name,data):
+		# helper method that writes one record of a file into the stream
+		self._fh.write('{} {}\n'.format(len(data),name))
+		self._fh.write(data)
+
+	def _read_header(self):
+		# helper method that reads the header of the next record, which is
+		# kept until the record has been consumed
+		if self._header is None and not self._end:
+			l=self._fh.readline()
+			if l==STREAM_END:
+				self._end=True
+			elif not l.endswith('\n') or ' ' not in l:
+				raise Exception('Backup stream {} is truncated or corrupt'.format(self.name))
+			else:
+				(size,name)=l[:-1].split(' ',1)
+				self._header=(int(size),name)
+		return self._header
+
+	def _next_record(self):
+		# helper method that reads the next record from the stream and returns
+		# the file name and data, or None at the end of the stream
+		header=self._read_header()
+		if header is None:
+			return None
+		self._header=None
+		(size,name)=header
+		data=self._fh.read(size)
+		if len(data)!=size:
+			raise Exception('Backup stream {} is truncated'.format(self.name))
+		return (name,data)
+
+	def _next_data(self,name):
+		# helper method that returns the next data of the given file, or None,
+		# if the file is complete. Records of other files are kept.
+		if name in self._pending and self._pending[name]:
+			return self._pending[name].pop(0)
+		while name not in self._complete:
+			record=self._next_record()
+			if record is None:
+				raise Exception('File {} is incomplete in backup stream {}'.format(name,self.name))
+			(rname,data)=record
+			if rname==name and data!='':
+				return data
+			self._keep(rname,data)
+		return None
+
+	def _keep(self,name,data):
+		# helper method that keeps a record of a file, which is not read yet.
+		# Records of block indexes are dropped.
+		if os.path.splitext(name)[1]=='.idx':
+			return
+		if data=='':
+			self._complete.add(name)
+		else:
+			self._pending.setdefault(name,[]).append(data)
+
+	def exists(self,name):
+		''' Returns True, if the file has been written into or read from the stream
+			already, or if it is the next file in the stream. Files later in the
+			stream are not known.
+		'''
+		if self.mode=='w':
+			return name in self._written
+		header=self._read_header()
+		return name in self._complete or name in self._pending or (header is not None and header[1]==name)
+
+	def open_write(self,name,append=False):
+		''' Opens a new file in the stream for writing '''
+		if append:
+			raise Exception('Files in stream {} can\'t be appended'.format(self.name))
+		self._written.add(name)
+		return _StreamMemberWriter(self,name)
+
+	def open_read(self,name):
+		''' Opens the next file in the stream for reading '''
+		return _StreamMemberReader(self,name)
+
+	def write_file(self,name,data):
+		''' Writes a file with the given content into the stream '''
+		with self.open_write(name) as fh:
+			fh.write(data)
+
+	def table_order(self,table_names):
+		''' Generator that returns the tables in the order their files appear in
+			the stream. Other files in between are kept and files of unknown
+			tables are skipped.
+		'''
+		table_names=set(table_names)
+		missing=set(table_names)
+		while True:
+			header=self._read_header()
+			if header is None:
+				return
+			(size,name)=header
+			table_name=table_of_file(name)
+			if table_name in missing:
+				missing.remove(table_name)
+				yield table_name
+			elif table_name is not None:
+				# the rest of a table file, that wasn't read completely, is skipped
+				if table_name not in table_names:
+					_getLogger('StreamStorage').warn('Skipping file %s of unknown table in stream',name)
+				with self.open_read(name):
+					pass
+			else:
+				self._keep(*self._next_record())
+
+	def close(self):
+		''' Finishes the stream '''
+		if self.mode=='w':
+			self._fh.write(STREAM_END)
+			self._fh.flush()
+			_getLogger('StreamStorage').info('Stream %s written',self.name)
@@ -0,0 +1,137 @@
+import sqlalchemy as sa
+
+from . import loggerFactory,execute_resultset,filter_names
+
+
+_getLogger=loggerFactory('subset')
+
+MAX_PARAMETERS=2000
+''' Maximal number of bind parameters in one statement, SQL Server allows 2100 '''
+
+
+def key_condition(columns,keys):
+	''' Returns the condition selecting the rows with the given keys. Single column
+		keys are selected with IN, composite keys with one AND term per key, because
+		SQL Server doesn't support row values with IN.
+
+		* columns - the key columns
+		* keys - list of key tuples with one value per column
+	'''
+	if len(columns)==1:
+		return columns[0].in_([k[0] for k in keys])
+	return sa.or_(*[sa.and_(*[c==v for (c,v) in zip(columns,k)]) for k in keys])
+
+
+def batches(keys,columns):
+	''' Generator that splits a sorted list of keys into batches, which can be
+		selected with one statement (see key_condition)
+	'''
+	size=max(1,min(500,MAX_PARAMETERS//len(columns)))
+	for i in xrange(0,len(keys),size):
+		yield keys[i:i+size]
+
+
+class Subset(object):
+	''' Collects a referentially closed subset of the rows of a database. It starts
+		with the seed rows selected by a condition per table and follows the foreign
+		keys of the meta data to the rows they reference, and the rows those rows
+		reference in turn. The rows are identified by their primary keys.
+
+		The keys are collected table by table in batches, so the number of queries
+		depends on the number of rows and foreign keys divided by the batch size,
+		not on the number of rows.
+	'''
+
+	def __init__(self,con,meta,seeds):
+		''' Constructor
+
+			* con - the database connection
+			* meta - the meta data of the database
+			* seeds - dict of table name patterns and SQL conditions selecting the
+			          seed rows, for example {"customers": "country='NZ'"}
+		'''
+		self.con=con
+		self.meta=meta
+		self.seeds=seeds
+		self.keys={}
+
+
+	def key_columns(self,table):
+		''' Returns the primary key columns of a table, which identify its rows '''
+		columns=list(table.primary_key.columns)
+		if not columns:
+			raise Exception('Table {} has no primary key and can\'t be part of a subset'.format(table.name))
+		return columns
+
+
+	def collect(self):
+		''' Collects the keys of the subset and returns a dict with a sorted list of
+			keys for every table of the meta data. Tables without rows in the subset
+			have an empty list.
+		'''
+		logger=_getLogger('collect')
+		self.keys={name: set() for name in self.meta.tables.keys()}
+		pending={}
+		for (pattern,condition) in sorted(self.seeds.items()):
+			names=filter_names(self.meta.tables.keys(),[pattern])
+			if not names:
+				raise Exception('No table matches the subset seed {}'.format(pattern))
+			for name in names:
+				table=self.meta.tables[name]
+				columns=self.key_columns(table)
+				with execute_resultset(self.con,sa.select(columns).where(sa.text(condition))) as res:
+					keys=[tuple(r) for r in res.fetchall()]
+				logger.info('%d seed rows in %s',len(keys),name)
+				self._add(name,keys,pending)
+
+		while pending:
+			name=sorted(pending.keys())[0]
+			keys=sorted(pending.pop(name))
+			logger.debug('Following the foreign keys of %d rows in %s',len(keys),name)
+			self._follow(self.meta.tables[name],keys,pending)
+
+		for (name,keys) in sorted(self.keys.items()):
+			if keys:
+				logger.info('Subset has %d rows of %s',len(keys),name)
+		return {name: sorted(keys) for (name,keys) in self.keys.items()}
+
+
+	def _add(self,name,keys,pending):
+		# helper method that records keys of a table and marks the new ones as
+		# pending, so their foreign keys are followed
+		new=set(keys)-self.keys[name]
+		if new:
+			self.keys[name].update(new)
+			pending.setdefault(name,set()).update(new)
+
+
+	def _follow(self,table,keys,pending):
+		''' Helper method that adds the rows referenced by the foreign keys of the
+			given rows of a table to the subset
+		'''
+		columns=self.key_columns(table)
+		for fk in sorted(table.foreign_key_constraints,key=lambda fk: fk.name):
+			referred=fk.referred_table
+			if referred.key not in self.keys:
+				raise Exception('Table {} referenced by {} is not part of the subset'.format(referred.key,table.name))
+			fk_columns=[e.parent for e in fk.elements]
+			values=set()
+			for batch in batches(keys,columns):
+				select=sa.select(fk_columns).distinct().where(key_condition(columns,batch))
+				with execute_resultset(self.con,select) as res:
+					values.update(tuple(r) for r in res.fetchall() if all(v is not None for v in r))
+			if not values:
+				continue
+
+			referred_columns=[e.column for e in fk.elements]
+			referred_keys=self.key_columns(referred)
+			if [c.name for c in referred_columns]==[c.name for c in referred_keys]:
+				self._add(referred.key,values,pending)
+				continue
+
+			# the foreign key references a unique key, whose primary keys are selected
+			values=sorted(values)
+			for batch in batches(values,referred_columns):
+				select=sa.select(referred_keys).where(key_condition(referred_columns,batch))
+				with execute_resultset(self.con,select) as res:
+					self._add(referred.key,[tuple(r) for r in res.fetchall()],pending)
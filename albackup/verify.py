@@ -0,0 +1,228 @@
+from collections import namedtuple
+from multiprocessing import Pool
+from multiprocessing.util import Finalize
+from sqlalchemy.util import pickle
+
+from . import loggerFactory
+from .codec import get_codec
+from .schema import BackupSchema,SCHEMA_FILE
+from .storage import StripedStorage,open_storage,stripe_paths
+from .blocks import MANIFEST_FILE,LargeValue,Manifest,IndexEntry,block_digest,table_checksum,table_file_name,index_file_name,read_index
+
+
+_getLogger=loggerFactory('verify')
+
+TableVerification=namedtuple('TableVerification',('table','ok','rows','blocks','errors'))
+''' Result of the verification of one table file with the list of problems found '''
+
+
+_storage=None
+''' The storage of the backup in a worker process, see open_worker_storage '''
+
+
+def open_worker_storage(location):
+	''' Initializer of the worker processes of Verify, that opens the storage of the
+		backup once per process, so an archive is scanned once by every worker and not
+		once for every table. location is a tuple of the backup location, the object
+		store client and the stripe layout. The storage is closed when the process
+		exits.
+	'''
+	global _storage
+	if _storage is not None:
+		_storage.close()
+	(backup_dir,client,stripes)=location
+	if stripes:
+		_storage=StripedStorage(stripes['paths'],stripes['policy'],stripes['files'])
+	else:
+		_storage=open_storage(backup_dir,client)
+	Finalize(_storage,_storage.close,exitpriority=10)
+
+
+def verify_table(task):
+	''' Verifies one table file of a backup and returns a TableVerification. It runs
+		in the worker processes of Verify with the storage of open_worker_storage,
+		which is why it takes a single tuple:
+
+		* table_name - the name of the table
+		* file_name - the name of the table file
+		* codec_name - the name of the codec of the blocks
+		* has_manifest - True, if the backup has a manifest
+		* expected - the manifest entry of the table, or None
+
+		The table file is read once from start to end. The framing of the blocks, the
+		chunks of large values and the final EOF are checked, each block is compared
+		with its entry in the block index and decoded to count its rows and large
+		values. The totals are compared with the manifest, if the backup has one.
+	'''
+	(table_name,file_name,codec_name,has_manifest,expected)=task
+	storage=_storage
+	codec=get_codec(codec_name)
+	errors=[]
+	entries=[]
+	index=None
+	try:
+		index_name=index_file_name(file_name)
+		if storage.exists(index_name):
+			with storage.open_read(index_name) as ix:
+				index=read_index(ix)
+
+		if not storage.exists(file_name):
+			errors.append('Table file {} is missing'.format(file_name))
+		else:
+			with storage.open_read(file_name) as fh:
+				entries=_verify_blocks(fh,codec,index,errors)
+	except Exception as e:
+		errors.append('Verification failed: {}'.format(e))
+
+	rows=sum([entry.rows for entry in entries])
+	if index is not None and len(index)!=len(entries) and not errors:
+		errors.append('Block index has {} entries for {} blocks'.format(len(index),len(entries)))
+	if has_manifest and expected is None:
+		errors.append('Table is not recorded in the manifest')
+	elif has_manifest and not errors:
+		if expected['rows']!=rows:
+			errors.append('Manifest has {} rows, the table file {}'.format(expected['rows'],rows))
+		if expected['blocks']!=len(entries):
+			errors.append('Manifest has {} blocks, the table file {}'.format(expected['blocks'],len(entries)))
+		if expected['checksum']!=table_checksum(entries):
+			errors.append('Checksum of the table file differs from the manifest')
+	return TableVerification(table_name,not errors,rows,len(entries),errors)
+
+
+def _verify_blocks(fh,codec,index,errors):
+	''' Helper function that walks the blocks of a table file and returns the index
+		entries for them. Problems are appended to errors.
+	'''
+	entries=[]
+	offset=0
+	while True:
+		l=fh.readline()
+		if l=='EOF':
+			if fh.read(1):
+				errors.append('Data after EOF at offset {}'.format(offset+3))
+			return entries
+		if not l:
+			errors.append('Table file ends without EOF at offset {}'.format(offset))
+			return entries
+		try:
+			size=int(l)
+		except ValueError:
+			errors.append('Invalid block header {!r} at offset {}'.format(l[:20],offset))
+			return entries
+		buf=fh.read(size)
+		if len(buf)!=size:
+			errors.append('Block {} at offset {} is truncated'.format(len(entries),offset))
+			return entries
+
+		digest=block_digest(buf)
+		length=len(l)+size
+		values=0
+		while True:
+			pos=fh.tell()
+			l=fh.readline()
+			if not l.startswith('+'):
+				fh.seek(pos)
+				break
+			size=int(l[1:])
+			length+=len(l)+size
+			if size==0:
+				values+=1
+				continue
+			chunk=fh.read(size)
+			if len(chunk)!=size:
+				errors.append('Large value after block {} is truncated'.format(len(entries)))
+				return entries
+			digest.update(chunk)
+
+		n=len(entries)
+		try:
+			rows=codec.decode(buf)
+		except Exception as e:
+			errors.append('Block {} at offset {} can\'t be decoded: {}'.format(n,offset,e))
+			return entries
+		markers=sum([1 for r in rows for v in (r.values() if hasattr(r,'values') else r) if isinstance(v,LargeValue)])
+		if markers!=values:
+			errors.append('Block {} has {} large values, but {} follow it'.format(n,markers,values))
+
+		entry=IndexEntry(offset,length,len(rows),digest.hexdigest())
+		if index is not None:
+			if n>=len(index):
+				errors.append('Block {} is not in the block index'.format(n))
+			elif index[n]!=entry:
+				errors.append('Block {} differs from the block index: {} instead of {}'.format(n,tuple(entry),tuple(index[n])))
+		entries.append(entry)
+		offset+=length
+
+
+class Verify(object):
+	''' Verifies a backup without a database. The table files are checked in a pool
+		of processes (see verify_table), so a large backup is verified with the speed
+		of its storage.
+	'''
+
+	def __init__(self,backup_dir,processes=None,object_store=None,stripe_dirs=None):
+		''' Constructor
+
+			* backup_dir - location of the backup, a directory, a tar archive or
+			               an s3://<bucket>/<prefix> location
+			* processes - number of worker processes, by default one per CPU
+			* object_store - optional client for backups in an object store. The
+			               workers create their own S3 client without it.
+			* stripe_dirs - parent directories of the stripes of a striped backup,
+			               if they moved since the dump
+		'''
+		self.backup_dir=backup_dir
+		self.processes=processes
+		self.object_store=object_store
+		storage=open_storage(backup_dir,object_store)
+		if storage.exists(SCHEMA_FILE):
+			schema=BackupSchema.load(storage)
+			self.info=schema.info()
+			self.table_names=schema.table_names()
+		else:
+			with storage.open_read('_metadata.pickle') as fh:
+				self.info=pickle.load(fh)
+			self.table_names=self.info['meta'].tables.keys()
+		self.stripes=None
+		if 'stripes' in self.info:
+			self.stripes=dict(self.info['stripes'])
+			self.stripes['paths']=[backup_dir]+(stripe_paths(backup_dir,stripe_dirs) if stripe_dirs else self.stripes['paths'][1:])
+			storage.close()
+			storage=StripedStorage(self.stripes['paths'],self.stripes['policy'],self.stripes['files'])
+		self.has_manifest=storage.exists(MANIFEST_FILE)
+		self.manifest=Manifest(storage)
+		storage.close()
+
+
+	def run(self):
+		''' Verifies all tables of the backup and returns the list of TableVerification
+			results ordered by table name
+		'''
+		logger=_getLogger('Verify')
+		location=(self.backup_dir,self.object_store,self.stripes)
+		version=self.info.get('format',1)
+		codec=self.info.get('codec','pickle')
+		tasks=[
+			(name,table_file_name(name,version),codec,self.has_manifest,self.manifest.tables.get(name))
+			for name in sorted(self.table_names)
+		]
+		logger.info('Verifying %d tables of %s',len(tasks),self.backup_dir)
+		if not self.has_manifest:
+			logger.warning('%s has no manifest, only the framing and the checksums of the blocks are verified',self.backup_dir)
+
+		pool=Pool(self.processes,open_worker_storage,(location,))
+		try:
+			results=pool.map(verify_table,tasks,chunksize=1)
+		finally:
+			pool.close()
+			pool.join()
+
+		for r in results:
+			if r.ok:
+				logger.debug('%s: %d rows in %d blocks',r.table,r.rows,r.blocks)
+			else:
+				for e in r.errors:
+					logger.error('%s: %s',r.table,e)
+		failed=[r for r in results if not r.ok]
+		logger.info('%d tables with %d rows verified, %d with errors',len(results),sum([r.rows for r in results]),len(failed))
+		return results
@@ -0,0 +1,88 @@
+''' Benchmarks of albackup. They don't need SQL Server: the databases are SQLite
+	files with a thin shim for the SQL Server specific bits (see sqlite_shim).
+'''
+from collections import namedtuple
+from contextlib import contextmanager
+import sys
+import time
+import json
+import platform
+
+from albackup.profiling import peak_rss
+
+
+Phase=namedtuple('Phase',('name','seconds','rows','bytes','peak_rss'))
+''' Measurement of one phase of a benchmark. peak_rss is the high-water mark of the
+	resident memory of the process at the end of the phase in bytes.
+'''
+
+
+class Measurements(object):
+	''' Collects the phases of a benchmark run
+
+			m=Measurements()
+			with m.phase('dump') as p:
+				...
+				p['rows']=rows
+				p['bytes']=size
+	'''
+
+	def __init__(self):
+		self.phases=[]
+
+
+	@contextmanager
+	def phase(self,name):
+		''' Context manager that measures the wall time of a phase. The rows and bytes
+			processed are set in the dict it yields.
+		'''
+		counts={'rows': 0, 'bytes': 0}
+		start=time.time()
+		yield counts
+		self.phases.append(Phase(name,time.time()-start,counts['rows'],counts['bytes'],peak_rss()))
+
+
+	def results(self):
+		''' Returns the phases as list of dicts with rows/s and MB/s '''
+		return [
+			{
+				'phase': p.name,
+				'seconds': round(p.seconds,4),
+				'rows': p.rows,
+				'bytes': p.bytes,
+				'rows_per_second': round(p.rows/p.seconds,1) if p.seconds else None,
+				'mb_per_second': round(p.bytes/p.seconds/2**20,3) if p.seconds else None,
+				'peak_rss_mb': round(p.peak_rss/2.0**20,1)
+			}
+			for p in self.phases
+		]
+
+
+	def log(self,logger):
+		''' Logs the phases as table '''
+		logger.info('%-16s %10s %10s %12s %10s %10s %12s','phase','seconds','rows','rows/s','MB','MB/s','peak RSS MB')
+		for r in self.results():
+			logger.info('%-16s %10.3f %10d %12s %10.2f %10s %12.1f',
+				r['phase'],r['seconds'],r['rows'],r['rows_per_second'],r['bytes']/2.0**20,r['mb_per_second'],r['peak_rss_mb']
+			)
+
+
+def environment():
+	''' Returns the description of the environment that is recorded with results '''
+	import sqlalchemy
+	return {
+		'python': platform.python_version(),
+		'sqlalchemy': sqlalchemy.__version__,
+		'platform': platform.platform(),
+		'time': time.strftime('%Y-%m-%dT%H:%M:%SZ',time.gmtime())
+	}
+
+
+def write_results(file_name,results):
+	''' Writes the results of a benchmark as JSON into file_name, - for stdout '''
+	if file_name=='-':
+		json.dump(results,sys.stdout,indent=3,sort_keys=True)
+		sys.stdout.write('\n')
+	else:
+		with open(file_name,'w') as fh:
+			json.dump(results,fh,indent=3,sort_keys=True)
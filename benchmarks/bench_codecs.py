@@ -0,0 +1,255 @@
+''' Microbenchmark of the block codecs
+
+	python -m benchmarks.bench_codecs --blocks 20 --json codecs.json
+	python -m benchmarks.bench_codecs --backup-dir ./backups/some_db@some_host-20160427-1533 --json codecs.json
+'''
+import argparse
+import bz2
+import gc
+import logging
+import time
+import zlib
+from sqlalchemy.util import pickle
+
+from albackup import loggerFactory
+from albackup.blocks import table_file_name
+from albackup.codec import CODECS,get_codec
+from albackup.dump import BLOCK_SIZE
+from albackup.schema import BackupSchema,SCHEMA_FILE
+from albackup.storage import open_storage
+
+from . import environment,write_results
+from .dataset import RowFactory,dataset_meta
+
+
+_getLogger=loggerFactory('benchmarks')
+
+
+class PickleProtocolCodec(object):
+	''' Candidate codec that pickles the rows with pickle.dumps and a given protocol,
+		instead of pickle.dump of the default protocol into a byte_buffer like the
+		PickleCodec
+	'''
+
+	def __init__(self,protocol):
+		self.name='pickle-{}'.format(protocol)
+		self.protocol=protocol
+
+	def encode(self,rows):
+		return pickle.dumps(rows,self.protocol)
+
+	def decode(self,buf):
+		return pickle.loads(buf)
+
+
+class CompressedCodec(object):
+	''' Candidate codec that compresses the blocks of another codec with zlib or bz2 '''
+
+	def __init__(self,codec,compressor,level):
+		self.name='{}+{}-{}'.format(codec.name,compressor.__name__,level)
+		self.codec=codec
+		self.compressor=compressor
+		self.level=level
+
+	def encode(self,rows):
+		return self.compressor.compress(self.codec.encode(rows),self.level)
+
+	def decode(self,buf):
+		return self.codec.decode(self.compressor.decompress(buf))
+
+
+def candidates():
+	''' Returns the codecs that are measured: the codecs of the registry, pickle with
+		all protocols and the registry codecs compressed with zlib and bz2
+	'''
+	codecs=[CODECS[name] for name in sorted(CODECS)]
+	codecs+=[PickleProtocolCodec(p) for p in xrange(0,pickle.HIGHEST_PROTOCOL+1)]
+	for name in sorted(CODECS):
+		codecs+=[CompressedCodec(CODECS[name],zlib,1),CompressedCodec(CODECS[name],zlib,6),CompressedCodec(CODECS[name],bz2,9)]
+	return codecs
+
+
+def synthetic_blocks(blocks=10,width=8,blob_size=0,seed=42):
+	''' Returns blocks of BLOCK_SIZE synthetic rows of the benchmark dataset '''
+	table=dataset_meta(tables=2,width=width,blob_size=blob_size).tables['t1']
+	factory=RowFactory(blocks*BLOCK_SIZE,seed,blob_size)
+	return [factory.block(table,b*BLOCK_SIZE,(b+1)*BLOCK_SIZE) for b in xrange(0,blocks)]
+
+
+def sample_blocks(backup_dir,blocks=10,object_store=None):
+	''' Returns up to blocks blocks of rows read from the table files of a backup,
+		the first blocks of each table in turn. Values of large columns that were
+		dumped in chunks stay LargeValue markers.
+	'''
+	storage=open_storage(backup_dir,object_store)
+	try:
+		if storage.exists(SCHEMA_FILE):
+			schema=BackupSchema.load(storage)
+			info=schema.info()
+			names=schema.table_names()
+		else:
+			with storage.open_read('_metadata.pickle') as fh:
+				info=pickle.load(fh)
+			names=info['meta'].tables.keys()
+		codec=get_codec(info.get('codec','pickle'))
+		version=info.get('format',1)
+
+		readers=[_read_blocks(storage,table_file_name(n,version),codec) for n in sorted(names)]
+		result=[]
+		while readers and len(result)<blocks:
+			for r in list(readers):
+				rows=next(r,None)
+				if rows is None:
+					readers.remove(r)
+				elif rows:
+					result.append(rows)
+				if len(result)>=blocks:
+					break
+		return result
+	finally:
+		storage.close()
+
+
+def _read_blocks(storage,file_name,codec):
+	# generator that returns the decoded blocks of a table file
+	if not storage.exists(file_name):
+		return
+	with storage.open_read(file_name) as fh:
+		while True:
+			l=fh.readline()
+			if not l or l=='EOF':
+				return
+			rows=codec.decode(fh.read(int(l)))
+			while True:
+				pos=fh.tell()
+				l=fh.readline()
+				if not l.startswith('+'):
+					fh.seek(pos)
+					break
+				fh.seek(int(l[1:]),1)
+			yield rows
+
+
+def _gc_objects(fn,*args):
+	''' Helper function that returns the result of fn and the net number of objects
+		tracked by the garbage collector it created. Python 2 has no tracemalloc, so
+		this stands in for the allocation count: it counts dicts, lists, tuples and
+		other containers, but not strings or numbers.
+	'''
+	gc.collect()
+	enabled=gc.isenabled()
+	gc.disable()
+	try:
+		before=gc.get_count()[0]
+		result=fn(*args)
+		return (result,gc.get_count()[0]-before)
+	finally:
+		if enabled:
+			gc.enable()
+
+
+def measure(codec,blocks,repeat=3):
+	''' Measures encode and decode of the blocks with a codec. The times are the best
+		of repeat runs. Returns a dict with the results.
+	'''
+	rows=sum([len(b) for b in blocks])
+	encoded=[codec.encode(b) for b in blocks]
+	size=sum([len(b) for b in encoded])
+
+	def encode_all():
+		return [codec.encode(b) for b in blocks]
+
+	def decode_all():
+		return [codec.decode(b) for b in encoded]
+
+	encode_seconds=min([_timed(encode_all) for _ in xrange(0,repeat)])
+	decode_seconds=min([_timed(decode_all) for _ in xrange(0,repeat)])
+	(_,encode_objects)=_gc_objects(encode_all)
+	(_,decode_objects)=_gc_objects(decode_all)
+	return {
+		'codec': codec.name,
+		'bytes': size,
+		'bytes_per_row': round(float(size)/rows,1) if rows else None,
+		'encode_seconds': round(encode_seconds,5),
+		'decode_seconds': round(decode_seconds,5),
+		'encode_rows_per_second': round(rows/encode_seconds,1) if encode_seconds else None,
+		'decode_rows_per_second': round(rows/decode_seconds,1) if decode_seconds else None,
+		'encode_mb_per_second': round(size/encode_seconds/2**20,3) if encode_seconds else None,
+		'decode_mb_per_second': round(size/decode_seconds/2**20,3) if decode_seconds else None,
+		'encode_gc_objects': encode_objects,
+		'decode_gc_objects': decode_objects
+	}
+
+
+def _timed(fn):
+	# helper function that returns the seconds fn takes
+	start=time.time()
+	fn()
+	return time.time()-start
+
+
+def run_benchmark(blocks,codecs=None,repeat=3,source='synthetic'):
+	''' Measures all codecs on the blocks and returns the results. The sizes are
+		compared with the default pickle codec of format v1.
+	'''
+	logger=_getLogger('run_benchmark')
+	codecs=candidates() if codecs is None else codecs
+	results=[]
+	for codec in codecs:
+		try:
+			results.append(measure(codec,blocks,repeat))
+		except Exception as e:
+			logger.warn('Codec %s failed: %s',codec.name,e)
+			results.append({'codec': codec.name, 'error': str(e)})
+	reference=[r for r in results if r['codec']=='pickle' and 'bytes' in r]
+	for r in results:
+		if reference and 'bytes' in r:
+			r['size_ratio']=round(float(r['bytes'])/reference[0]['bytes'],3)
+
+	logger.info('%-22s %10s %9s %12s %12s %10s %10s','codec','bytes','ratio','enc rows/s','dec rows/s','enc objs','dec objs')
+	for r in results:
+		if 'error' in r:
+			logger.info('%-22s %s',r['codec'],r['error'])
+		else:
+			logger.info('%-22s %10d %9s %12.0f %12.0f %10d %10d',r['codec'],r['bytes'],r.get('size_ratio'),
+				r['encode_rows_per_second'] or 0,r['decode_rows_per_second'] or 0,r['encode_gc_objects'],r['decode_gc_objects'])
+	return {
+		'benchmark': 'codecs',
+		'environment': environment(),
+		'input': {
+			'source': source,
+			'blocks': len(blocks),
+			'rows': sum([len(b) for b in blocks])
+		},
+		'repeat': repeat,
+		'codecs': results
+	}
+
+
+if __name__=='__main__': # pragma: nocover
+	parser=argparse.ArgumentParser('python -m benchmarks.bench_codecs')
+	parser.add_argument('--backup-dir',default=None,help="Sample the blocks from the table files of this backup instead of generating them")
+	parser.add_argument('--blocks',type=int,default=10,help="Number of blocks")
+	parser.add_argument('--width',type=int,default=8,help="Number of varchar(40) columns of the synthetic rows")
+	parser.add_argument('--blob-size',type=int,default=0,help="Maximum length of the text column of the synthetic rows, 0 for none")
+	parser.add_argument('--seed',type=int,default=42,help="Seed of the synthetic rows")
+	parser.add_argument('--repeat',type=int,default=3,help="Number of runs, the best is reported")
+	parser.add_argument('--codec',action='append',default=None,help="Measure only the codecs with the given names, may be repeated")
+	parser.add_argument('--json',metavar='FILE',default=None,help="Write the results as JSON into FILE, - for stdout")
+	parser.add_argument('--debug','-d',action="store_true",default=False,help="Run in debug mode")
+	args=parser.parse_args()
+
+	logging.basicConfig(
+		level=logging.DEBUG if args.debug else logging.INFO,
+		format="%(asctime)s: %(message)s"
+	)
+	if args.backup_dir:
+		blocks=sample_blocks(args.backup_dir,args.blocks)
+	else:
+		blocks=synthetic_blocks(args.blocks,args.width,args.blob_size,args.seed)
+	codecs=candidates()
+	if args.codec:
+		codecs=[c for c in codecs if c.name in args.codec]
+	results=run_benchmark(blocks,codecs,args.repeat,args.backup_dir or 'synthetic')
+	if args.json:
+		write_results(args.json,results)
@@ -0,0 +1,134 @@
+''' End to end benchmark of Dump and Restore on a synthetic dataset
+
+	python -m benchmarks.bench_dump_restore --tables 8 --rows 20000 --blob-size 100000 --json result.json
+'''
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import warnings
+
+from albackup import loggerFactory
+from albackup.dump import Dump
+from albackup.restore import Restore
+
+from . import Measurements,environment,peak_rss,write_results
+from .dataset import generate
+from .sqlite_shim import create_engine
+
+
+_getLogger=loggerFactory('benchmarks')
+
+
+def _size(path):
+	# total size of the files of a backup directory or archive
+	if os.path.isfile(path):
+		return os.path.getsize(path)
+	return sum([os.path.getsize(os.path.join(d,f)) for (d,_,files) in os.walk(path) for f in files])
+
+
+def run_benchmark(work_dir,rows=10000,tables=4,width=8,blob_size=0,fk_depth=1,format=1,stream_results=False,archive=False,seed=42):
+	''' Generates the dataset in a SQLite database in work_dir, dumps it into work_dir
+		and restores the dump into a second SQLite database. Returns the results with
+		the measurements of the phases of the dump and the restore.
+
+		The phases that read SQL Server catalogs, like the primary key order fix and
+		the object definitions, are left out. The data of the restored database is
+		compared with the source, so a benchmark doesn't report a broken run.
+	'''
+	logger=_getLogger('run_benchmark')
+	params={
+		'rows': rows, 'tables': tables, 'width': width, 'blob_size': blob_size,
+		'fk_depth': fk_depth, 'format': format, 'stream_results': stream_results,
+		'archive': archive, 'seed': seed
+	}
+	source=create_engine(os.path.join(work_dir,'source.db'))
+	target=create_engine(os.path.join(work_dir,'target.db'))
+	meta=generate(source,rows,seed,tables,width,blob_size,fk_depth)
+	total_rows=rows*tables
+	baseline=peak_rss()
+	m=Measurements()
+
+	dump=Dump(os.path.join(work_dir,'backup'),None,source,'bench','sqlite',stream_results=stream_results,archive=archive,format=format)
+	with m.phase('dump.reflect'):
+		dump.get_meta_data()
+	with m.phase('dump.tables') as p:
+		dump.backup_tables()
+		p['rows']=total_rows
+		p['bytes']=_size(dump.backup_dir)
+	with m.phase('dump.finish'):
+		for key in ('procedures','functions','triggers','views'):
+			dump.info[key]=[]
+		dump.finsih_backup()
+	dump.con.close()
+	backup_size=_size(dump.backup_dir)
+
+	restore=Restore(dump.backup_dir,target)
+	with m.phase('restore.schema'):
+		restore.getTablesWithLargeColumnTypes()
+		restore.fixTextColumns()
+		restore.createSchema()
+	with m.phase('restore.tables') as p:
+		restore.changeRIChecks(off=True)
+		restore.import_tables()
+		p['rows']=total_rows
+		p['bytes']=backup_size
+	with m.phase('restore.finish'):
+		restore.import_objects()
+		restore.changeRIChecks(off=False)
+		restore.dropCheckpoints()
+	restore.con.close()
+
+	for table in meta.sorted_tables:
+		select=table.select().order_by(table.c.id)
+		if source.execute(select).fetchall()!=target.execute(select).fetchall():
+			raise Exception('Restored data of {} differs from the source'.format(table.name))
+	source.dispose()
+	target.dispose()
+
+	m.log(logger)
+	return {
+		'benchmark': 'dump_restore',
+		'params': params,
+		'environment': environment(),
+		'backup_bytes': backup_size,
+		'baseline_rss_mb': round(baseline/2.0**20,1),
+		'phases': m.results(),
+		'reports': {'dump': dump.report.as_dict(), 'restore': restore.report.as_dict()}
+	}
+
+
+if __name__=='__main__': # pragma: nocover
+	parser=argparse.ArgumentParser('python -m benchmarks.bench_dump_restore')
+	parser.add_argument('--tables',type=int,default=4,help="Number of tables")
+	parser.add_argument('--rows',type=int,default=10000,help="Number of rows per table")
+	parser.add_argument('--width',type=int,default=8,help="Number of varchar(40) columns per table")
+	parser.add_argument('--blob-size',type=int,default=0,help="Maximum length of the values of a text column, 0 for none")
+	parser.add_argument('--fk-depth',type=int,default=1,help="Length of the chains of tables referencing each other")
+	parser.add_argument('--format',type=int,choices=(1,2),default=1,help="Backup format")
+	parser.add_argument('--stream-results',action="store_true",default=False,help="Dump with streaming cursors")
+	parser.add_argument('--archive',action="store_true",default=False,help="Dump into a tar archive")
+	parser.add_argument('--seed',type=int,default=42,help="Seed of the generated data")
+	parser.add_argument('--work-dir',default=None,help="Directory for the databases and the backup, a temporary one by default")
+	parser.add_argument('--json',metavar='FILE',default=None,help="Write the results as JSON into FILE, - for stdout")
+	parser.add_argument('--debug','-d',action="store_true",default=False,help="Run in debug mode")
+	args=parser.parse_args()
+
+	logging.basicConfig(
+		level=logging.DEBUG if args.debug else logging.INFO,
+		format="%(asctime)s: %(message)s"
+	)
+	logging.getLogger('albackup').setLevel(logging.DEBUG if args.debug else logging.WARN)
+	logging.getLogger('albackup.benchmarks').setLevel(logging.INFO)
+	# SQLite returns the amounts as floats, which are rounded to the scale of the column
+	warnings.filterwarnings('ignore',r'Dialect sqlite\+pysqlite does \*not\* support Decimal')
+
+	work_dir=args.work_dir or tempfile.mkdtemp(prefix='albackup-bench')
+	try:
+		results=run_benchmark(work_dir,args.rows,args.tables,args.width,args.blob_size,args.fk_depth,args.format,args.stream_results,args.archive,args.seed)
+	finally:
+		if not args.work_dir:
+			shutil.rmtree(work_dir)
+	if args.json:
+		write_results(args.json,results)
@@ -0,0 +1,105 @@
+from datetime import datetime,timedelta
+from decimal import Decimal
+import random
+import sqlalchemy as sa
+
+from albackup import loggerFactory
+
+
+_getLogger=loggerFactory('benchmarks')
+
+INSERT_BATCH=1000
+''' Number of rows inserted with one statement while generating a table '''
+
+
+def dataset_meta(tables=4,width=8,blob_size=0,fk_depth=1):
+	''' Returns the meta data of a synthetic dataset:
+
+		* tables - number of tables
+		* width - number of varchar(40) columns of each table
+		* blob_size - tables get a text column with values of blob_size characters,
+		               if it isn't 0
+		* fk_depth - length of the chains of tables referencing each other, t1
+		               references t0, t2 references t1 and so on. Every fk_depth+1-th
+		               table starts a new chain.
+	'''
+	meta=sa.MetaData()
+	for i in xrange(0,tables):
+		columns=[sa.Column('id',sa.Integer,primary_key=True,autoincrement=False)]
+		if i%(fk_depth+1)!=0:
+			columns.append(sa.Column('parent_id',sa.Integer,sa.ForeignKey('t{}.id'.format(i-1))))
+		columns+=[sa.Column('c{}'.format(c),sa.String(40)) for c in xrange(0,width)]
+		columns.append(sa.Column('amount',sa.Numeric(12,2)))
+		columns.append(sa.Column('created',sa.DateTime))
+		if blob_size:
+			columns.append(sa.Column('body',sa.TEXT))
+		sa.Table('t{}'.format(i),meta,*columns)
+	return meta
+
+
+class RowFactory(object):
+	''' Creates the synthetic rows of the tables of dataset_meta. The values only
+		depend on the seed, so runs with the same arguments work on the same data.
+
+		Every tenth value of the text column is NULL, the others have a random
+		length of up to blob_size characters.
+	'''
+
+	def __init__(self,rows,seed=42,blob_size=0):
+		''' Constructor
+
+			* rows - number of rows of each table, the range of the parent keys
+			* seed - seed of the random values
+			* blob_size - maximum length of the values of the text column
+		'''
+		self.rows=rows
+		self.blob_size=blob_size
+		self.rnd=random.Random(seed)
+		letters='abcdefghijklmnopqrstuvwxyz0123456789 '
+		self.pool=''.join([self.rnd.choice(letters) for _ in xrange(0,4096)])
+
+
+	def text(self,n):
+		''' Returns a random text of n characters '''
+		# slices of a random pool, so long values are cheap to generate
+		start=self.rnd.randrange(0,len(self.pool))
+		value=(self.pool[start:]+self.pool[:start])*(n//len(self.pool)+1)
+		return value[:n]
+
+
+	def block(self,table,start,stop):
+		''' Returns the rows of a table with the primary keys start to stop-1 as dicts '''
+		rnd=self.rnd
+		rows=[]
+		for pk in xrange(start,stop):
+			row={'id': pk}
+			for c in table.columns:
+				if c.name=='parent_id':
+					row[c.name]=rnd.randrange(0,self.rows)
+				elif c.name=='amount':
+					row[c.name]=Decimal(rnd.randrange(0,10**8))/100
+				elif c.name=='created':
+					row[c.name]=datetime(2016,1,1)+timedelta(seconds=rnd.randrange(0,10**8))
+				elif c.name=='body':
+					row[c.name]=None if pk%10==0 else self.text(rnd.randint(1,self.blob_size))
+				elif c.name!='id':
+					row[c.name]=self.text(rnd.randint(0,40))
+			rows.append(row)
+		return rows
+
+
+def generate(engine,rows=10000,seed=42,tables=4,width=8,blob_size=0,fk_depth=1):
+	''' Creates the tables of dataset_meta in the database of engine and fills each
+		with rows synthetic rows of the RowFactory. Returns the meta data.
+	'''
+	logger=_getLogger('generate')
+	meta=dataset_meta(tables,width,blob_size,fk_depth)
+	meta.create_all(engine)
+	factory=RowFactory(rows,seed,blob_size)
+
+	with engine.begin() as con:
+		for table in meta.sorted_tables:
+			logger.info('Generating %d rows of %s',rows,table.name)
+			for start in xrange(0,rows,INSERT_BATCH):
+				con.execute(table.insert(),factory.block(table,start,min(start+INSERT_BATCH,rows)))
+	return meta
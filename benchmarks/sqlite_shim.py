@@ -0,0 +1,60 @@
+import re
+import sqlalchemy as sa
+
+from albackup import loggerFactory
+
+
+_getLogger=loggerFactory('benchmarks')
+
+COLLATION='SQL_Latin1_General_CP1_CI_AS'
+''' Collation of the text columns re-created by Restore.fixTextColumns '''
+
+_NOOP=re.compile(r'^\s*EXEC\s+sp_msforeachtable\b',re.IGNORECASE)
+''' SQL Server statements without a SQLite equivalent, which are skipped '''
+
+
+def _substring(value,start,length):
+	# SUBSTRING of SQL Server with a 1 based start
+	if value is None:
+		return None
+	return value[start-1:start-1+length]
+
+
+def _datalength(value):
+	# DATALENGTH of SQL Server. The text columns of SQLite are reflected as TEXT,
+	# whose length Dump counts in characters, so characters are returned
+	if value is None:
+		return None
+	return len(value)
+
+
+def _collate(a,b):
+	return cmp(a.lower(),b.lower())
+
+
+def _connect(dbapi_con,record):
+	dbapi_con.create_function('substring',3,_substring)
+	dbapi_con.create_function('datalength',1,_datalength)
+	dbapi_con.create_collation(COLLATION,_collate)
+
+
+def _before_cursor_execute(con,cursor,statement,parameters,context,executemany):
+	if _NOOP.match(statement):
+		_getLogger('sqlite_shim').debug('Skipped %s',statement)
+		return ('SELECT 1',())
+	return (statement,parameters)
+
+
+def create_engine(file_name):
+	''' Returns an engine of a SQLite database in file_name that stands in for SQL
+		Server in the benchmarks. The SQL Server functions Dump uses for large values,
+		SUBSTRING and DATALENGTH, and the collation of Restore are registered with
+		every connection. sp_msforeachtable statements, which Restore uses to turn
+		referential integrity checks and triggers off and on, are skipped.
+
+		The database has to be a file, because Restore recycles its connections.
+	'''
+	engine=sa.create_engine('sqlite:///'+file_name)
+	sa.event.listen(engine,'connect',_connect)
+	sa.event.listen(engine,'before_cursor_execute',_before_cursor_execute,retval=True)
+	return engine
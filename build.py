@@ -80,6 +80,17 @@ def pdoc():
         execute("Generating documentation:", cmd+(m,))
 
 
+@task()
+def bench():
+    ''' Runs the dump, restore and codec benchmarks and writes the results into bench-results
+    '''
+    if not os.path.exists('bench-results'):
+        os.mkdir('bench-results')
+    result=os.path.join('bench-results','dump_restore-{}.json'.format(time.strftime('%Y%m%d-%H%M%S')))
+    execute("Running benchmark:", (sys.executable,"-m","benchmarks.bench_dump_restore","--blob-size","100000","--json",result))
+    execute("Running benchmark:", (sys.executable,"-m","benchmarks.bench_codecs","--json",result.replace('dump_restore','codecs')))
+
+
 class ImportCheckFailed(Exception):
     pass
 
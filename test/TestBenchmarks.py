@@ -0,0 +1,123 @@
+import unittest
+import os
+import sys
+import tempfile
+import shutil
+import sqlalchemy as sa
+
+_baseDir=os.path.abspath(os.path.join(os.path.dirname(__file__),'..'))
+if _baseDir not in sys.path:
+    sys.path.insert(0,_baseDir)
+
+from benchmarks import Measurements
+from benchmarks.dataset import dataset_meta,generate
+from benchmarks.sqlite_shim import create_engine
+from benchmarks.bench_dump_restore import run_benchmark
+from benchmarks import bench_codecs
+from albackup.blocks import LargeValue,write_block,write_large_value
+from albackup.codec import BinaryCodec
+from albackup.schema import write_schema
+from albackup.storage import DirectoryStorage
+
+
+class TestBenchmarks(unittest.TestCase):
+
+	def setUp(self):
+		super(TestBenchmarks,self).setUp()
+		self.work_dir=tempfile.mkdtemp(prefix='testbenchmarks')
+
+	def tearDown(self):
+		shutil.rmtree(self.work_dir)
+		super(TestBenchmarks,self).tearDown()
+
+	def test_dataset_meta(self):
+		meta=dataset_meta(tables=5,width=3,blob_size=10,fk_depth=2)
+		self.assertEqual(['t0','t1','t2','t3','t4'],sorted(meta.tables.keys()))
+		self.assertEqual(['id','parent_id','c0','c1','c2','amount','created','body'],[c.name for c in meta.tables['t1'].columns])
+		self.assertEqual([[],['t0'],['t1'],[],['t3']],[
+			[fk.column.table.name for fk in meta.tables['t{}'.format(i)].foreign_keys] for i in xrange(0,5)
+		])
+
+	def test_generate(self):
+		engine=create_engine(os.path.join(self.work_dir,'a.db'))
+		generate(engine,rows=20,tables=2,blob_size=100)
+		self.assertEqual(20,engine.execute('select count(*) from t1').scalar())
+		engine=create_engine(os.path.join(self.work_dir,'b.db'))
+		generate(engine,rows=20,tables=2,blob_size=100)
+		self.assertEqual(
+			create_engine(os.path.join(self.work_dir,'a.db')).execute('select * from t1').fetchall(),
+			engine.execute('select * from t1').fetchall()
+		)
+
+	def test_sqlite_shim(self):
+		engine=create_engine(os.path.join(self.work_dir,'a.db'))
+		self.assertEqual(('bcd',5),tuple(engine.execute("select substring('abcde',2,3), datalength('abcde')").fetchone()))
+		engine.execute('EXEC sp_msforeachtable "ALTER TABLE ? NOCHECK CONSTRAINT all"')
+
+	def test_measurements(self):
+		m=Measurements()
+		with m.phase('a') as p:
+			p['rows']=10
+			p['bytes']=2**20
+		(r,)=m.results()
+		self.assertEqual(('a',10,2**20),(r['phase'],r['rows'],r['bytes']))
+		self.assertTrue(r['peak_rss_mb']>0)
+
+	def test_run_benchmark(self):
+		for format in (1,2):
+			work_dir=os.path.join(self.work_dir,str(format))
+			os.mkdir(work_dir)
+			results=run_benchmark(work_dir,rows=30,tables=3,width=2,blob_size=70000,format=format)
+			self.assertEqual(
+				['dump.reflect','dump.tables','dump.finish','restore.schema','restore.tables','restore.finish'],
+				[p['phase'] for p in results['phases']]
+			)
+			self.assertEqual(90,results['phases'][1]['rows'])
+			self.assertEqual(format,results['params']['format'])
+
+
+	def test_codec_candidates(self):
+		names=[c.name for c in bench_codecs.candidates()]
+		self.assertEqual(['binary','pickle','pickle-0','pickle-1','pickle-2'],names[:5])
+		self.assertIn('binary+zlib-6',names)
+
+		blocks=bench_codecs.synthetic_blocks(2,width=2,blob_size=100)
+		self.assertEqual([500,500],[len(b) for b in blocks])
+		for codec in bench_codecs.candidates():
+			self.assertEqual(blocks[0],codec.decode(codec.encode(blocks[0])),codec.name)
+
+	def test_codec_benchmark(self):
+		blocks=bench_codecs.synthetic_blocks(2,width=2)
+		results=bench_codecs.run_benchmark(blocks,[c for c in bench_codecs.candidates() if c.name in ('pickle','binary+zlib-1')],repeat=1)
+		self.assertEqual({'source': 'synthetic', 'blocks': 2, 'rows': 1000},results['input'])
+		(pickle,binary)=results['codecs']
+		self.assertEqual(('pickle','binary+zlib-1'),(pickle['codec'],binary['codec']))
+		self.assertEqual(1.0,pickle['size_ratio'])
+		self.assertTrue(binary['size_ratio']<1)
+		self.assertTrue(pickle['decode_gc_objects']>=1000)
+
+	def test_sample_blocks(self):
+		meta=sa.MetaData()
+		sa.Table('t1',meta,sa.Column('id',sa.Integer,primary_key=True),sa.Column('body',sa.TEXT))
+		sa.Table('t2',meta,sa.Column('id',sa.Integer,primary_key=True))
+		storage=DirectoryStorage(self.work_dir)
+		write_schema(storage,{'format': 2, 'codec': 'binary', 'meta': meta})
+		codec=BinaryCodec()
+		with open(os.path.join(self.work_dir,'t1.blocks'),'wb') as fh:
+			write_block(fh,codec.encode([{'id': 1, 'body': LargeValue('body',6,False)}]))
+			write_large_value(fh,['abc','def'])
+			write_block(fh,codec.encode([{'id': 2, 'body': 'x'}]))
+			fh.write('EOF')
+		with open(os.path.join(self.work_dir,'t2.blocks'),'wb') as fh:
+			write_block(fh,codec.encode([{'id': 1}]))
+			fh.write('EOF')
+
+		self.assertEqual(
+			[[{'id': 1, 'body': LargeValue('body',6,False)}],[{'id': 1}],[{'id': 2, 'body': 'x'}]],
+			bench_codecs.sample_blocks(self.work_dir,5)
+		)
+		self.assertEqual(2,len(bench_codecs.sample_blocks(self.work_dir,2)))
+
+
+if __name__=="__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+import unittest
+import os
+import sys
+import tempfile
+import shutil
+import json
+from StringIO import StringIO
+from mock import MagicMock
+
+_baseDir=os.path.abspath(os.path.join(os.path.dirname(__file__),'..'))
+if _baseDir not in sys.path:
+    sys.path.insert(0,_baseDir)
+
+from albackup.storage import DirectoryStorage
+from albackup.blocks import Manifest,IndexEntry,LargeValue,block_digest,checksum,table_checksum,write_block,write_large_value,read_large_value,skip_block,index_file_name,write_index_entry,read_index
+
+class TestBlocks(unittest.TestCase):
+
+	def setUp(self):
+		super(TestBlocks,self).setUp()
+		self.backup_dir=tempfile.mkdtemp(prefix='testblocks_backup_dir')
+
+	def tearDown(self):
+		shutil.rmtree(self.backup_dir)
+		super(TestBlocks,self).tearDown()
+
+	def test_write_block(self):
+		file_name=os.path.join(self.backup_dir,'t1.pickle')
+		with open(file_name,'wb') as fh:
+			self.assertEqual(7,write_block(fh,'block'))
+
+		with open(file_name,'rb') as fh:
+			self.assertEqual('5\nblock',fh.read())
+
+	def test_write_large_value(self):
+		fh=StringIO()
+		digest=block_digest('block')
+
+		self.assertEqual(15,write_large_value(fh,[u'abc',u'd\xe9'],digest))
+
+		self.assertEqual('+3\nabc+3\nd\xc3\xa9+0\n',fh.getvalue())
+		self.assertEqual(checksum('blockabcd\xc3\xa9'),digest.hexdigest())
+
+	def test_read_large_value(self):
+		fh=StringIO('+3\nabc+3\nd\xc3\xa9+0\nEOF')
+
+		self.assertEqual(
+			[u'abc',u'd\xe9'],
+			list(read_large_value(fh,LargeValue('c1',4,True)))
+		)
+		self.assertEqual('EOF',fh.read())
+
+	def test_read_large_value_invalid(self):
+		fh=StringIO('+3\nabcEOF')
+		with self.assertRaises(Exception):
+			list(read_large_value(fh,LargeValue('c1',4,False)))
+
+	def test_skip_block(self):
+		fh=StringIO()
+		write_block(fh,'block1')
+		write_large_value(fh,['abc','def'])
+		write_large_value(fh,['ghi'])
+		write_block(fh,'block2')
+		fh.write('EOF')
+		fh.seek(0)
+
+		self.assertTrue(skip_block(fh))
+		self.assertEqual('6\n',fh.readline())
+		fh.seek(0)
+		self.assertTrue(skip_block(fh))
+		self.assertTrue(skip_block(fh))
+		self.assertFalse(skip_block(fh))
+
+	def test_index_file_name(self):
+		self.assertEqual('t1.idx',index_file_name('t1.pickle'))
+
+	def test_read_index(self):
+		index_name=os.path.join(self.backup_dir,'t1.idx')
+		with open(index_name,'wb') as fh:
+			write_index_entry(fh,IndexEntry(0,10,2,'abc'))
+			write_index_entry(fh,IndexEntry(10,20,4,'def'))
+			fh.write('30\t12\t')
+
+		with open(index_name,'rb') as fh:
+			self.assertEqual(
+				[IndexEntry(0,10,2,'abc'), IndexEntry(10,20,4,'def')],
+				read_index(fh)
+			)
+
+	def test_table_checksum(self):
+		entries=[IndexEntry(0,10,2,checksum('b1')), IndexEntry(10,20,4,checksum('b2'))]
+		self.assertEqual(checksum(checksum('b1')+checksum('b2')),table_checksum(entries))
+
+
+class TestManifest(unittest.TestCase):
+
+	def setUp(self):
+		super(TestManifest,self).setUp()
+		self.backup_dir=tempfile.mkdtemp(prefix='testmanifest_backup_dir')
+
+	def tearDown(self):
+		shutil.rmtree(self.backup_dir)
+		super(TestManifest,self).tearDown()
+
+	def test_mark_complete(self):
+		manifest=Manifest(DirectoryStorage(self.backup_dir))
+		self.assertFalse(manifest.is_complete('t1'))
+
+		manifest.mark_complete('t1',1000,2,'abc')
+		self.assertTrue(manifest.is_complete('t1'))
+
+		with open(os.path.join(self.backup_dir,'_manifest.json')) as fh:
+			self.assertEqual(
+				{'tables': {'t1': {'complete': True, 'rows': 1000, 'blocks': 2, 'checksum': 'abc'}}},
+				json.load(fh)
+			)
+
+	def test_mark_complete_without_resume(self):
+		storage=MagicMock(supports_resume=False,**{'exists.return_value': False})
+		manifest=Manifest(storage)
+
+		manifest.mark_complete('t1',1000,2,'abc')
+		self.assertFalse(storage.write_file.called)
+
+		manifest.save()
+		storage.write_file.assert_called_once_with('_manifest.json',json.dumps(
+			{'tables': {'t1': {'complete': True, 'rows': 1000, 'blocks': 2, 'checksum': 'abc'}}},
+			indent=1,sort_keys=True
+		))
+
+	def test_load(self):
+		Manifest(DirectoryStorage(self.backup_dir)).mark_complete('t1',1000,2,'abc')
+
+		manifest=Manifest(DirectoryStorage(self.backup_dir))
+		self.assertTrue(manifest.is_complete('t1'))
+		self.assertFalse(manifest.is_complete('t2'))
+
+
+if __name__=="__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+import os
+import sys
+import uuid
+from datetime import datetime,date,time
+from decimal import Decimal
+from collections import OrderedDict
+
+_baseDir=os.path.abspath(os.path.join(os.path.dirname(__file__),'..'))
+if _baseDir not in sys.path:
+    sys.path.insert(0,_baseDir)
+
+from albackup.codec import PickleCodec,BinaryCodec,get_codec
+from albackup.blocks import LargeValue
+
+
+class TestCodec(unittest.TestCase):
+
+	def _rows(self):
+		return [
+			OrderedDict([
+				('id', 1),
+				('big', 2**70),
+				('neg', -17),
+				('flag', True),
+				('f', 1.5),
+				('d', Decimal('12.3400')),
+				('s', 'bytes\x00\xff'),
+				('u', u'\xe4\xf6\xfc'),
+				('y', bytearray('\x01\x02')),
+				('dt', datetime(2016,4,27,15,33,12,123456)),
+				('da', date(2016,4,27)),
+				('t', time(15,33,12,5)),
+				('g', uuid.UUID('12345678-1234-5678-1234-567812345678')),
+				('n', None)
+			]),
+			OrderedDict([
+				('id', 2),
+				('big', 0),
+				('neg', 0),
+				('flag', False),
+				('f', 0.0),
+				('d', Decimal('0')),
+				('s', ''),
+				('u', LargeValue(u'u',70000,True)),
+				('y', None),
+				('dt', None),
+				('da', None),
+				('t', None),
+				('g', None),
+				('n', None)
+			])
+		]
+
+	def test_binary(self):
+		codec=get_codec('binary')
+		self.assertIsInstance(codec,BinaryCodec)
+		rows=self._rows()
+		decoded=codec.decode(codec.encode(rows))
+		self.assertEqual([dict(r) for r in rows],decoded)
+		self.assertIsInstance(decoded[0]['y'],bytearray)
+		self.assertIsInstance(decoded[1]['u'],LargeValue)
+
+	def test_binary_empty_block(self):
+		codec=BinaryCodec()
+		self.assertEqual([],codec.decode(codec.encode([])))
+
+	def test_binary_unsupported(self):
+		codec=BinaryCodec()
+		with self.assertRaises(Exception):
+			codec.encode([{'c': object()}])
+		with self.assertRaises(Exception):
+			codec.decode('\x00\x01\x00\x00\x00\x01\x00\x01cX')
+
+	def test_pickle(self):
+		codec=get_codec('pickle')
+		self.assertIsInstance(codec,PickleCodec)
+		rows=self._rows()
+		self.assertEqual(rows,codec.decode(codec.encode(rows)))
+
+	def test_unknown_codec(self):
+		with self.assertRaises(Exception):
+			get_codec('xml')
+
+
+if __name__=="__main__":
+    unittest.main()
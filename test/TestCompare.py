@@ -1,7 +1,10 @@
 import unittest
 import os
+import shutil
+import tempfile
+from xml.etree import ElementTree
 from mock import patch,MagicMock
-from albackup.compare import DbCompare
+from albackup.compare import DbCompare,SchemaCompare,diff_dicts
 
 _baseDir=os.path.abspath(os.path.join(os.path.dirname(__file__),'..'))
 
@@ -68,4 +71,112 @@ class TestDbCompare(unittest.TestCase):
 
 		self.cmp._compare()
 		sh.Command.assert_called_once_with('{}/sqlworkbench/sqlwbconsole.sh'.format(_baseDir))
-		wb_console.assert_called_once_with('-script=my-sql-script.sql', _in=[])
\ No newline at end of file
+		wb_console.assert_called_once_with('-script=my-sql-script.sql', _in=[])
+
+
+class TestSchemaCompare(unittest.TestCase):
+
+	def setUp(self):
+		super(TestSchemaCompare,self).setUp()
+		self.diff_dir=tempfile.mkdtemp(prefix='testcompare_diffs')
+
+	def tearDown(self):
+		shutil.rmtree(self.diff_dir)
+		super(TestSchemaCompare,self).tearDown()
+
+	def _engine(self,columns,indexes,foreign_keys,modules):
+		results=[MagicMock(**{'fetchall.return_value': rows}) for rows in (columns,indexes,foreign_keys,modules)]
+		con=MagicMock(**{'execute.side_effect': results})
+		return MagicMock(**{'connect.return_value': con})
+
+	def _ref_engine(self):
+		return self._engine(
+			[
+				(u't1',u'id',u'int',None,10,0,u'NO',None,None),
+				(u't1',u'name',u'nvarchar',50,None,None,u'YES',None,u'Latin1_General_CI_AS'),
+				(u't1',u'amount',u'decimal',None,10,2,u'YES',u'((0))',None),
+				(u't2',u'id',u'int',None,10,0,u'NO',None,None)
+			],
+			[
+				(u't1',u'PK__t1__1234',u'CLUSTERED',True,True,False,u'id',False),
+				(u't1',u'ix_t1_name',u'NONCLUSTERED',False,False,False,u'name',False),
+				(u't1',u'ix_t1_name',u'NONCLUSTERED',False,False,False,u'amount',True)
+			],
+			[(u't1',u'fk_t1_t2',u'id',u't2',u'id',u'NO_ACTION',u'NO_ACTION')],
+			[(u'v1',u'V ',u'CREATE VIEW v1\nAS select 1'),(u'p1',u'P ',u'create procedure p1 as select 1')]
+		)
+
+	def test_diff_dicts(self):
+		self.assertEqual(
+			{'add': ['a'], 'drop': ['c'], 'modify': [('b',2,3)]},
+			diff_dicts({'a': 1, 'b': 2},{'b': 3, 'c': 4})
+		)
+
+	def test_snapshot(self):
+		cmp=SchemaCompare(None,None,'ref')
+		snapshot=cmp.snapshot(self._ref_engine())
+
+		t1=snapshot['tables']['t1']
+		self.assertEqual(['amount','id','name'],sorted(t1['columns'].keys()))
+		self.assertEqual('nvarchar(50)',t1['columns']['name']['type'])
+		self.assertEqual('decimal(10,2)',t1['columns']['amount']['type'])
+		self.assertFalse(t1['columns']['id']['nullable'])
+		self.assertEqual({'type': 'PRIMARY KEY', 'clustered': True, 'columns': ['id']},t1['keys']['PRIMARY KEY'])
+		self.assertEqual(['t2'],[k['references'] for k in t1['keys'].values() if k['type']=='FOREIGN KEY'])
+		self.assertEqual(
+			{'type': 'NONCLUSTERED', 'unique': False, 'constraint': False, 'columns': ['name'], 'include': ['amount']},
+			t1['indexes']['ix_t1_name']
+		)
+		self.assertEqual({'columns': {'id': t1['columns']['id']}, 'keys': {}, 'indexes': {}},snapshot['tables']['t2'])
+		self.assertEqual({'v1': 'create view v1 as select 1'},snapshot['views'])
+		self.assertEqual({'p1': 'create procedure p1 as select 1'},snapshot['procedures'])
+		self.assertEqual({},snapshot['triggers'])
+
+	def test_run(self):
+		target=self._engine(
+			[
+				(u't1',u'id',u'int',None,10,0,u'NO',None,None),
+				(u't1',u'name',u'nvarchar',100,None,None,u'YES',None,u'Latin1_General_CI_AS'),
+				(u't1',u'amount',u'decimal',None,10,2,u'YES',u'((0))',None),
+				(u't3',u'id',u'int',None,10,0,u'NO',None,None)
+			],
+			[
+				(u't1',u'PK__t1__9876',u'CLUSTERED',True,True,False,u'id',False),
+			],
+			[],
+			[(u'v1',u'V ',u'create view v1 as select 1'),(u'tr1',u'TR',u'create trigger tr1 on t1 ...')]
+		)
+		cmp=SchemaCompare(self._ref_engine(),target,'ref','restore',diff_dir=os.path.join(self.diff_dir,'diffs'))
+		diff=cmp.run()
+
+		self.assertTrue(SchemaCompare.has_differences(diff))
+		self.assertEqual(['t2'],diff['tables']['add'])
+		self.assertEqual(['t3'],diff['tables']['drop'])
+		t1=diff['tables']['modify']['t1']
+		self.assertEqual(['name'],[m[0] for m in t1['columns']['modify']])
+		self.assertEqual(['fk_t1_t2'],t1['keys']['add'])
+		self.assertEqual(['ix_t1_name'],t1['indexes']['add'])
+		self.assertEqual({'add': [], 'drop': [], 'modify': []},diff['views'])
+		self.assertEqual(['p1'],diff['procedures']['add'])
+		self.assertEqual(['tr1'],diff['triggers']['drop'])
+
+		root=ElementTree.parse(os.path.join(self.diff_dir,'diffs','diff-ref.xml')).getroot()
+		self.assertEqual('schema-diff',root.tag)
+		self.assertEqual(
+			['reference-connection','target-connection','add-table','drop-table','modify-table','add-procedure','drop-trigger'],
+			[e.tag for e in root]
+		)
+		self.assertEqual(
+			['modify-column','add-key','add-index'],
+			[e.tag for e in root.find('modify-table')]
+		)
+		with open(os.path.join(self.diff_dir,'diffs','diff-ref.html')) as fh:
+			html=fh.read()
+		self.assertIn('Schema differences between ref and restore',html)
+		self.assertIn('ix_t1_name',html)
+
+	def test_no_differences(self):
+		cmp=SchemaCompare(self._ref_engine(),self._ref_engine(),'ref',diff_dir=self.diff_dir)
+		self.assertFalse(SchemaCompare.has_differences(cmp.run()))
+		with open(os.path.join(self.diff_dir,'diff-ref.html')) as fh:
+			self.assertIn('The schemas are the same',fh.read())
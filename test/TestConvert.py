@@ -0,0 +1,112 @@
+import unittest
+import os
+import sys
+import tempfile
+import shutil
+import json
+import tarfile
+import sqlalchemy as sa
+from sqlalchemy.util import pickle
+
+_baseDir=os.path.abspath(os.path.join(os.path.dirname(__file__),'..'))
+if _baseDir not in sys.path:
+    sys.path.insert(0,_baseDir)
+
+from albackup import ObjectDef
+from albackup.convert import Convert
+from albackup.codec import BinaryCodec
+from albackup.schema import BackupSchema
+from albackup.storage import DirectoryStorage
+from albackup.blocks import LargeValue,checksum,write_block,write_large_value,read_large_value,read_index
+
+
+class TestConvert(unittest.TestCase):
+
+	def setUp(self):
+		super(TestConvert,self).setUp()
+		self.backup_dir=tempfile.mkdtemp(prefix='testconvert_backup_dir')
+		self.source=os.path.join(self.backup_dir,'v1')
+		os.makedirs(self.source)
+
+		meta=sa.MetaData()
+		sa.Table('t1',meta,sa.Column('id',sa.Integer,primary_key=True),sa.Column('c',sa.TEXT))
+		sa.Table('t2',meta,sa.Column('id',sa.Integer,primary_key=True))
+		with open(os.path.join(self.source,'_metadata.pickle'),'wb') as fh:
+			pickle.dump({
+				'started': 'now',
+				'finished': 'later',
+				'meta': meta,
+				'views': [ObjectDef('v1','create view v1 as select 1 as c',[])],
+				'procedures': [],
+				'functions': [],
+				'triggers': []
+			},fh)
+
+		with open(os.path.join(self.source,'t1.pickle'),'wb') as fh:
+			write_block(fh,pickle.dumps([{'id': 1, 'c': u'small'},{'id': 2, 'c': LargeValue('c',10,True)}]))
+			write_large_value(fh,[u'\xe4bcde',u'fghij'])
+			write_block(fh,pickle.dumps([{'id': 3, 'c': None}]))
+			fh.write('EOF')
+		with open(os.path.join(self.source,'t2.pickle'),'wb') as fh:
+			fh.write('EOF')
+
+	def tearDown(self):
+		shutil.rmtree(self.backup_dir)
+		super(TestConvert,self).tearDown()
+
+	def _check_t1(self,fh):
+		codec=BinaryCodec()
+		l=fh.readline()
+		rows=codec.decode(fh.read(int(l)))
+		self.assertEqual([{'id': 1, 'c': u'small'},{'id': 2, 'c': LargeValue('c',10,True)}],rows)
+		self.assertEqual([u'\xe4bcde',u'fghij'],list(read_large_value(fh,rows[1]['c'])))
+		l=fh.readline()
+		self.assertEqual([{'id': 3, 'c': None}],codec.decode(fh.read(int(l))))
+		self.assertEqual('EOF',fh.read())
+
+	def test_convert_directory(self):
+		target=os.path.join(self.backup_dir,'v2')
+		Convert(self.source,target).run()
+
+		self.assertEqual(
+			['_manifest.json','_schema.json','_schema.jsonl','t1.blocks','t1.idx','t2.blocks','t2.idx'],
+			sorted(os.listdir(target))
+		)
+		with open(os.path.join(target,'t1.blocks'),'rb') as fh:
+			self._check_t1(fh)
+		with open(os.path.join(target,'t1.idx'),'rb') as fh:
+			entries=read_index(fh)
+		self.assertEqual([2,1],[e.rows for e in entries])
+		with open(os.path.join(target,'t1.blocks'),'rb') as fh:
+			fh.seek(entries[0].offset)
+			l=fh.readline()
+			self.assertEqual(checksum(fh.read(int(l))+u'\xe4bcde'.encode('utf-8')+'fghij'),entries[0].checksum)
+		with open(os.path.join(target,'_manifest.json'),'rb') as fh:
+			manifest=json.load(fh)['tables']
+		self.assertEqual(3,manifest['t1']['rows'])
+		self.assertEqual(0,manifest['t2']['rows'])
+
+		schema=BackupSchema.load(DirectoryStorage(target))
+		info=schema.info()
+		self.assertEqual(2,info['format'])
+		self.assertEqual('binary',info['codec'])
+		self.assertEqual('v1',schema.objects('views')[0].name)
+		self.assertEqual(['t1','t2'],sorted(schema.metadata().tables.keys()))
+
+	def test_convert_archive(self):
+		target=os.path.join(self.backup_dir,'v2.tar')
+		Convert(self.source,target).run()
+
+		tar=tarfile.open(target)
+		self.assertIn('_schema.json',tar.getnames())
+		self._check_t1(tar.extractfile('t1.blocks'))
+
+	def test_convert_v2(self):
+		target=os.path.join(self.backup_dir,'v2')
+		Convert(self.source,target).run()
+		with self.assertRaises(Exception):
+			Convert(target,os.path.join(self.backup_dir,'v3')).run()
+
+
+if __name__=="__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+import os
+import sys
+import tempfile
+import shutil
+import sqlalchemy as sa
+
+_baseDir=os.path.abspath(os.path.join(os.path.dirname(__file__),'..'))
+if _baseDir not in sys.path:
+    sys.path.insert(0,_baseDir)
+
+from albackup.datacompare import DataCompare,TableCheck
+
+
+class ChecksumAgg(object):
+	''' CHECKSUM_AGG of SQL Server for sqlite '''
+
+	def __init__(self):
+		self.value=0
+
+	def step(self,value):
+		self.value^=value or 0
+
+	def finalize(self):
+		return self.value
+
+
+def _sqlite_functions(dbapi_con,record):
+	dbapi_con.create_function('binary_checksum',-1,lambda *values: hash(values) & 0x7fffffff)
+	dbapi_con.create_function('datalength',1,lambda value: len(value) if value is not None else None)
+	dbapi_con.create_aggregate('checksum_agg',1,ChecksumAgg)
+
+
+class TestDataCompare(unittest.TestCase):
+
+	def setUp(self):
+		super(TestDataCompare,self).setUp()
+		self.db_dir=tempfile.mkdtemp(prefix='testdatacompare')
+		self.meta=sa.MetaData()
+		sa.Table('t1',self.meta,sa.Column('id',sa.Integer,primary_key=True),sa.Column('name',sa.String(20)),sa.Column('body',sa.TEXT))
+		sa.Table('t2',self.meta,sa.Column('a',sa.Integer,primary_key=True),sa.Column('b',sa.Integer,primary_key=True))
+		self.ref=self._engine('ref')
+		self.target=self._engine('target')
+		for engine in (self.ref,self.target):
+			engine.execute(self.meta.tables['t1'].insert(),[{'id': i, 'name': 'row {}'.format(i), 'body': 'x'*i} for i in xrange(0,1000)])
+			engine.execute(self.meta.tables['t2'].insert(),[{'a': 1, 'b': 1},{'a': 1, 'b': 2}])
+
+	def tearDown(self):
+		shutil.rmtree(self.db_dir)
+		super(TestDataCompare,self).tearDown()
+
+	def _engine(self,name):
+		engine=sa.create_engine('sqlite:///'+os.path.join(self.db_dir,name+'.db'))
+		sa.event.listen(engine,'connect',_sqlite_functions)
+		self.meta.create_all(engine)
+		return engine
+
+	def test_same_data(self):
+		self.assertEqual(
+			[TableCheck('t1',1000,1000,True,[]),TableCheck('t2',2,2,True,[])],
+			DataCompare(self.ref,self.target,self.meta,workers=2).run()
+		)
+
+	def test_differences(self):
+		t1=self.meta.tables['t1']
+		self.target.execute(t1.delete().where(t1.c.id==17))
+		self.target.execute(t1.update().where(t1.c.id==500).values(name='changed'))
+		self.target.execute(t1.update().where(t1.c.id==501).values(body='y'))
+		self.target.execute(t1.insert(),{'id': 5000, 'name': 'extra', 'body': None})
+		self.target.execute(self.meta.tables['t2'].delete().where(self.meta.tables['t2'].c.b==2))
+
+		cmp=DataCompare(self.ref,self.target,self.meta)
+		queries=[]
+		sa.event.listen(self.ref,'before_cursor_execute',lambda *args: queries.append(args[2]))
+		results=cmp.run()
+
+		self.assertEqual(
+			TableCheck('t1',1000,1000,False,[(17,'missing'),(500,'changed'),(501,'changed'),(5000,'extra')]),
+			results[0]
+		)
+		self.assertEqual(TableCheck('t2',2,1,False,[]),results[1])
+		# the differing rows are located with a few queries, not row by row
+		self.assertTrue(len(queries)<100,len(queries))
+
+	def test_empty_target(self):
+		self.target.execute(self.meta.tables['t1'].delete())
+		result=DataCompare(self.ref,self.target,self.meta,min_range=8).compare_table('t1')
+		self.assertFalse(result.ok)
+		self.assertEqual(0,result.target_rows)
+		self.assertEqual([(i,'missing') for i in xrange(0,1000)],result.keys)
+
+
+if __name__=="__main__":
+    unittest.main()
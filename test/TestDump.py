@@ -5,6 +5,10 @@ import tempfile
 import shutil
 import json
 import copy
+import weakref
+import tarfile
+from StringIO import StringIO
+from datetime import datetime
 from sqlalchemy.util import pickle
 from mock import patch,MagicMock
 
@@ -13,7 +17,14 @@ if _baseDir not in sys.path:
     sys.path.insert(0,_baseDir)
 
 from albackup.dump import Dump
+from albackup.storage import StreamStorage
+from albackup.objectstore import LocalObjectStore
+from albackup.codec import BinaryCodec
+from albackup.schema import BackupSchema
+from albackup.storage import DirectoryStorage
 from albackup import ObjectDef
+from albackup.blocks import Manifest,IndexEntry,LargeValue,checksum,read_index,write_block,write_index_entry,read_large_value
+import sqlalchemy as sa
 
 class ListWithCopy(list):
 
@@ -23,6 +34,71 @@ class ListWithCopy(list):
 	def add(self,obj):
 		self.append(obj)
 
+class Block(list):
+	''' list that can be referenced weakly to track the blocks that are alive '''
+	pass
+
+class StreamingResult(object):
+	''' Result set that creates its blocks on demand and keeps track of the
+		number of blocks that are alive at the same time
+	'''
+
+	def __init__(self,blocks):
+		self.blocks=blocks
+		self.alive=[]
+		self.max_alive=0
+
+	def fetchmany(self,size):
+		self.alive=[r for r in self.alive if r() is not None]
+		self.max_alive=max(self.max_alive,len(self.alive))
+		if self.blocks==0:
+			return []
+		self.blocks-=1
+		block=Block(['x'*100]*size)
+		self.alive.append(weakref.ref(block))
+		return block
+
+	def close(self):
+		pass
+
+class RecordingCursor(object):
+	''' DBAPI cursor, that records its arraysize at execute and the fetches '''
+
+	def __init__(self,cursor,calls):
+		self._cursor=cursor
+		self._calls=calls
+		self.arraysize=cursor.arraysize
+
+	def __getattr__(self,name):
+		return getattr(self._cursor,name)
+
+	def execute(self,*args):
+		self._calls.append(('execute',self.arraysize))
+		return self._cursor.execute(*args)
+
+	def fetchmany(self,size=None):
+		rows=self._cursor.fetchmany(self.arraysize if size is None else size)
+		self._calls.append(('fetchmany',size,len(rows)))
+		return rows
+
+	def fetchall(self):
+		rows=self._cursor.fetchall()
+		self._calls.append(('fetchall',len(rows)))
+		return rows
+
+class RecordingConnection(object):
+	''' DBAPI connection, whose cursors are RecordingCursors '''
+
+	def __init__(self,con,calls):
+		self._con=con
+		self._calls=calls
+
+	def __getattr__(self,name):
+		return getattr(self._con,name)
+
+	def cursor(self):
+		return RecordingCursor(self._con.cursor(),self._calls)
+
 class TestDump(unittest.TestCase):
 
 	def setUp(self):
@@ -38,6 +114,10 @@ class TestDump(unittest.TestCase):
 		shutil.rmtree(self.cache_dir)
 		super(TestDump,self).tearDown()
 
+	def _read_index(self,table_name):
+		with open(os.path.join(self.dmp.backup_dir,'{}.idx'.format(table_name)),'rb') as fh:
+			return read_index(fh)
+
 	@patch('albackup.dump.os.makedirs')
 	@patch('albackup.dump.os.path.exists')
 	def testConstractor(self,exists,makedirs):
@@ -73,6 +153,88 @@ class TestDump(unittest.TestCase):
 		self.assertEqual(pickle.dump.call_args[0][0],meta)
 
 
+	def _filtered_dump(self,meta_data_dir=None,**kwargs):
+		engine=sa.create_engine('sqlite://')
+		engine.execute('create table customers (id integer primary key)')
+		engine.execute('create table orders (id integer primary key, customer_id integer references customers(id))')
+		engine.execute('create table order_lines (id integer primary key, order_id integer references orders(id))')
+		engine.execute('create table audit_log (id integer primary key, created datetime)')
+		return Dump(self.backup_dir,meta_data_dir,engine,'the_database','my_server',**kwargs)
+
+	def test_get_meta_data_filtered(self):
+		dmp=self._filtered_dump(tables=['order*'],exclude_tables=['*_lines'])
+		self.assertEqual(['customers','orders'],sorted(dmp.get_meta_data().tables.keys()))
+		self.assertEqual({'tables': ['order*'], 'exclude_tables': ['*_lines'], 'where': {}},dmp.info['filter'])
+
+	def test_get_meta_data_filtered_cached(self):
+		dmp=self._filtered_dump(self.cache_dir,exclude_tables=['audit_*'])
+		self.assertEqual(['customers','order_lines','orders'],sorted(dmp.get_meta_data().tables.keys()))
+		# the cache has all tables
+		dmp=self._filtered_dump(self.cache_dir)
+		self.assertEqual(4,len(dmp.get_meta_data().tables))
+
+		with self.assertRaises(Exception):
+			self._filtered_dump(tables=['missing']).get_meta_data()
+
+	def test_select_table_where(self):
+		dmp=self._filtered_dump(where={'audit_*': "created>='2016-01-01'"})
+		self.assertNotIn('filter',Dump(self.backup_dir,None,self.engine,'the_database','my_server').info)
+		meta=dmp.get_meta_data()
+
+		self.assertEqual(
+			"SELECT audit_log.id, audit_log.created \nFROM audit_log \nWHERE created>='2016-01-01' ORDER BY audit_log.id",
+			str(dmp._select_table(meta.tables['audit_log']))
+		)
+		self.assertEqual(
+			"SELECT orders.id, orders.customer_id \nFROM orders ORDER BY orders.id",
+			str(dmp._select_table(meta.tables['orders']))
+		)
+
+		dmp.con.execute("insert into audit_log values (1,'2015-12-31 00:00:00')")
+		dmp.con.execute("insert into audit_log values (2,'2016-02-01 00:00:00')")
+		dmp.backup_tables()
+		with open(os.path.join(dmp.backup_dir,'audit_log.pickle'),'rb') as fh:
+			fh.readline()
+			self.assertEqual([2],[r['id'] for r in pickle.load(fh)])
+
+	def test_backup_tables_subset(self):
+		dmp=self._filtered_dump(subset={'order_lines': 'id=2'})
+		for sql in (
+			'insert into customers values (1),(2)',
+			'insert into orders values (10,1),(11,2)',
+			'insert into order_lines values (1,10),(2,11),(3,11)',
+			"insert into audit_log values (1,'2016-01-01 00:00:00')"
+		):
+			dmp.con.execute(sql)
+		dmp.get_meta_data()
+		dmp.backup_tables()
+
+		def ids(table_name):
+			with open(os.path.join(dmp.backup_dir,'{}.pickle'.format(table_name)),'rb') as fh:
+				l=fh.readline()
+				return [r['id'] for r in pickle.loads(fh.read(int(l)))] if l!='EOF' else []
+		self.assertEqual([2],ids('order_lines'))
+		self.assertEqual([11],ids('orders'))
+		self.assertEqual([2],ids('customers'))
+		self.assertEqual([],ids('audit_log'))
+		self.assertEqual(
+			{'customers': 1, 'orders': 1, 'order_lines': 1, 'audit_log': 0},
+			dmp.info['subset']['rows']
+		)
+
+	def test_backup_tables_subset_without_primary_key(self):
+		dmp=self._filtered_dump(subset={'customers': 'id=1'})
+		dmp.con.execute('create table log (msg varchar(100))')
+		dmp.con.execute('insert into customers values (1),(2)')
+		dmp.con.execute("insert into log values ('a message')")
+		dmp.get_meta_data()
+		dmp.backup_tables()
+
+		with open(os.path.join(dmp.backup_dir,'log.pickle'),'rb') as fh:
+			self.assertEqual('EOF',fh.read())
+		self.assertEqual(0,dmp.info['subset']['rows']['log'])
+		self.assertEqual(1,dmp.info['subset']['rows']['customers'])
+
 	def test_backup_tables_multiple_tables(self):
 		tables={
 			'table1': MagicMock(**{'select.return_value': 'select from table1'}),
@@ -118,6 +280,403 @@ class TestDump(unittest.TestCase):
 			l=fh.readline()
 			self.assertEqual('EOF',l)
 
+	def test_backup_tables_index_and_manifest(self):
+		tables={
+			'table1': MagicMock(**{'select.return_value': 'select from table1'})
+		}
+		self.dmp.info['meta']=MagicMock(tables=tables)
+
+		res1=MagicMock(**{'fetchmany.side_effect': [['r1','r2'],['r3'],[]]})
+		self.dmp.con.execute=MagicMock(return_value=res1)
+
+		self.dmp.backup_tables()
+
+		entries=self._read_index('table1')
+		self.assertEqual([2,1],[e.rows for e in entries])
+		self.assertEqual(0,entries[0].offset)
+		self.assertEqual(entries[0].length,entries[1].offset)
+
+		with open(os.path.join(self.dmp.backup_dir,'table1.pickle'),'rb') as fh:
+			fh.seek(entries[1].offset)
+			l=fh.readline()
+			buf=fh.read(int(l))
+			self.assertEqual(['r3'],pickle.loads(buf))
+			self.assertEqual(checksum(buf),entries[1].checksum)
+
+		manifest=Manifest(self.dmp.storage)
+		self.assertTrue(manifest.is_complete('table1'))
+		self.assertEqual(3,manifest.tables['table1']['rows'])
+		self.assertEqual(2,manifest.tables['table1']['blocks'])
+
+	def testConstructor_resume(self):
+		Manifest(self.dmp.storage).mark_complete('table1',3,1,'abc')
+
+		dmp=Dump(self.backup_dir, self.cache_dir, self.engine,'the_database','my_server',resume_dir=self.dmp.backup_dir)
+
+		self.assertEqual(self.dmp.backup_dir,dmp.backup_dir)
+		self.assertTrue(dmp.manifest.is_complete('table1'))
+
+	def testConstructor_resume_missing_dir(self):
+		with self.assertRaises(Exception):
+			Dump(self.backup_dir, self.cache_dir, self.engine,'the_database','my_server',resume_dir='/does/not/exist')
+
+	def test_backup_tables_resume_skips_complete_tables(self):
+		tables={
+			'table1': MagicMock(**{'select.return_value': 'select from table1'}),
+			'table2': MagicMock(**{'select.return_value': 'select from table2'})
+		}
+		self.dmp.info['meta']=MagicMock(tables=tables)
+		self.dmp.manifest.mark_complete('table1',3,1,'abc')
+
+		res2=MagicMock(**{'fetchmany.side_effect': [['r1'],[]]})
+		self.dmp.con.execute=MagicMock(return_value=res2)
+
+		self.dmp.backup_tables()
+
+		self.dmp.con.execute.assert_called_once_with('select from table2')
+		self.assertFalse(os.path.exists(os.path.join(self.dmp.backup_dir,'table1.pickle')))
+
+	def _create_partial_table(self,table_name):
+		file_name=os.path.join(self.dmp.backup_dir,'{}.pickle'.format(table_name))
+		with open(file_name,'wb') as fh, open(os.path.join(self.dmp.backup_dir,'{}.idx'.format(table_name)),'wb') as ix:
+			offset=0
+			for block in (['r1','r2'],['r3','r4']):
+				buf=pickle.dumps(block)
+				length=write_block(fh,buf)
+				write_index_entry(ix,IndexEntry(offset,length,len(block),checksum(buf)))
+				offset+=length
+			fh.write('1234\npartial block')
+		return (file_name,offset)
+
+	def test_backup_tables_resume_partial_table(self):
+		pk=MagicMock()
+		table=MagicMock()
+		table.primary_key.columns=[pk]
+		table.select.return_value.order_by.return_value.offset.return_value='select from table1 offset 4'
+		self.dmp.info['meta']=MagicMock(tables={'table1': table})
+		(file_name,offset)=self._create_partial_table('table1')
+
+		res=MagicMock(**{'fetchmany.side_effect': [['r5'],[]]})
+		self.dmp.con.execute=MagicMock(return_value=res)
+
+		self.dmp.backup_tables()
+
+		table.select.return_value.order_by.assert_called_once_with(pk)
+		table.select.return_value.order_by.return_value.offset.assert_called_once_with(4)
+		self.dmp.con.execute.assert_called_once_with('select from table1 offset 4')
+
+		with open(file_name,'rb') as fh:
+			blocks=[]
+			l=fh.readline()
+			while l!='EOF':
+				blocks.append(pickle.loads(fh.read(int(l))))
+				l=fh.readline()
+		self.assertEqual([['r1','r2'],['r3','r4'],['r5']],blocks)
+
+		entries=self._read_index('table1')
+		self.assertEqual(3,len(entries))
+		self.assertEqual(offset,entries[2].offset)
+		self.assertEqual(5,self.dmp.manifest.tables['table1']['rows'])
+
+	def test_backup_tables_resume_partial_table_without_pk(self):
+		self.dmp.info['meta']=MagicMock(tables={
+			'table1': MagicMock(**{'select.return_value': 'select from table1'})
+		})
+		(file_name,offset)=self._create_partial_table('table1')
+
+		res=MagicMock(**{'fetchmany.side_effect': [['r1'],[]]})
+		self.dmp.con.execute=MagicMock(return_value=res)
+
+		self.dmp.backup_tables()
+
+		self.dmp.con.execute.assert_called_once_with('select from table1')
+		self.assertEqual(1,len(self._read_index('table1')))
+		self.assertEqual(1,self.dmp.manifest.tables['table1']['rows'])
+
+	def test_backup_tables_consistent(self):
+		tables={
+			'table1': MagicMock(**{'select.return_value': 'select from table1'}),
+			'table2': MagicMock(**{'select.return_value': 'select from table2'})
+		}
+		self.dmp.info['meta']=MagicMock(tables=tables)
+		self.dmp.consistent=True
+
+		res_state=MagicMock(**{'fetchone.return_value': (1,)})
+		res_started=MagicMock(**{'fetchone.return_value': (datetime(2016,5,1,12,30,15),)})
+		res1=MagicMock(**{'fetchmany.side_effect': [['r1'],[]]})
+		res2=MagicMock(**{'fetchmany.side_effect': [['r2'],[]]})
+		self.dmp.con.execute=MagicMock(side_effect=[res_state,None,res_started,res1,res2,None])
+
+		self.dmp.backup_tables()
+
+		self.assertEqual('SET TRANSACTION ISOLATION LEVEL SNAPSHOT',self.dmp.con.execute.mock_calls[1][1][0])
+		self.assertEqual('SET TRANSACTION ISOLATION LEVEL READ COMMITTED',self.dmp.con.execute.mock_calls[5][1][0])
+		self.assertEqual(
+			{'isolation': 'SNAPSHOT', 'started': '2016-05-01T12:30:15.000000'},
+			self.dmp.info['snapshot']
+		)
+		# one outer snapshot transaction and a nested one per table
+		self.assertEqual(3,self.dmp.con.begin.call_count)
+
+	def test_backup_tables_consistent_not_allowed(self):
+		self.dmp.info['meta']=MagicMock(tables={})
+		self.dmp.consistent=True
+
+		res_state=MagicMock(**{'fetchone.return_value': (0,)})
+		self.dmp.con.execute=MagicMock(return_value=res_state)
+
+		with self.assertRaises(Exception):
+			self.dmp.backup_tables()
+		self.assertNotIn('snapshot',self.dmp.info)
+
+	def _backup_streaming(self,blocks):
+		self.dmp.info['meta']=MagicMock(tables={
+			'table1': MagicMock(**{'select.return_value': 'select from table1'})
+		})
+		self.dmp.stream_results=True
+		self.dmp.manifest.tables.clear()
+
+		res=StreamingResult(blocks)
+		self.dmp._execute_table_select=MagicMock(return_value=res)
+
+		self.dmp.backup_tables()
+
+		self.dmp._execute_table_select.assert_called_once_with('select from table1')
+		self.assertEqual(blocks,self.dmp.manifest.tables['table1']['blocks'])
+		return res
+
+	def test_backup_tables_streaming_memory_is_bounded(self):
+		small=self._backup_streaming(5)
+		large=self._backup_streaming(200)
+
+		# no block survives the fetch of the next block, regardless of the table size
+		self.assertEqual(0,small.max_alive)
+		self.assertEqual(0,large.max_alive)
+
+	def test_backup_tables_streaming_fetches_blocks(self):
+		import sqlite3
+		calls=[]
+		db_file=os.path.join(self.cache_dir,'source.db')
+		engine=sa.create_engine('sqlite://',creator=lambda: RecordingConnection(sqlite3.connect(db_file),calls))
+		meta=sa.MetaData()
+		table=sa.Table('t1',meta,sa.Column('id',sa.Integer,primary_key=True),sa.Column('name',sa.String(20)))
+		meta.create_all(engine)
+		engine.execute(table.insert(),[{'id': i, 'name': 'row {}'.format(i)} for i in xrange(0,1201)])
+
+		dmp=Dump(self.backup_dir,None,engine,'the_database','my_server',stream_results=True)
+		dmp.info['meta']=meta
+		del calls[:]
+		dmp.backup_tables()
+		dmp.con.close()
+
+		# the arraysize is set before the select and the rows are fetched block by block
+		self.assertEqual(
+			[('execute',500),('fetchmany',500,500),('fetchmany',500,500),('fetchmany',500,201),('fetchmany',500,0)],
+			calls
+		)
+		self.assertEqual(3,dmp.manifest.tables['t1']['blocks'])
+
+	@patch('albackup.dump.LARGE_VALUE_CHUNK',5)
+	def test_backup_tables_large_columns(self):
+		meta=sa.MetaData()
+		sa.Table(
+			't1',
+			meta,
+			sa.Column('id',sa.Integer,primary_key=True),
+			sa.Column('c1',sa.Integer),
+			sa.Column('big',sa.sql.sqltypes.NVARCHAR('max'))
+		)
+		self.dmp.info['meta']=meta
+
+		page1=MagicMock(**{'fetchall.return_value': [
+			{'id': 1, 'c1': 10, 'big': u'abc', 'datalength_big': 6},
+			{'id': 2, 'c1': 20, 'big': u'xxxxx', 'datalength_big': 30},
+			{'id': 3, 'c1': 30, 'big': None, 'datalength_big': None}
+		]})
+		chunk2=MagicMock(**{'fetchone.return_value': (u'yyyyy',)})
+		chunk3=MagicMock(**{'fetchone.return_value': (u'zzzzz',)})
+		page2=MagicMock(**{'fetchall.return_value': []})
+		self.dmp.con.execute=MagicMock(side_effect=[page1,chunk2,chunk3,page2])
+
+		self.dmp.backup_tables()
+
+		calls=self.dmp.con.execute.mock_calls
+		self.assertIn('substring(t1.big, :substring_1, :substring_2) AS big',str(calls[0][1][0]))
+		self.assertIn('datalength(t1.big) AS datalength_big',str(calls[0][1][0]))
+		self.assertEqual({'pos': 6},calls[1][2])
+		self.assertEqual({'pos': 11},calls[2][2])
+		self.assertIn('t1.id > :id_1',str(calls[3][1][0]))
+
+		with open(os.path.join(self.dmp.backup_dir,'t1.pickle'),'rb') as fh:
+			l=fh.readline()
+			buf=fh.read(int(l))
+			rows=pickle.loads(buf)
+			self.assertEqual(
+				[	{'id': 1, 'c1': 10, 'big': u'abc'},
+					{'id': 2, 'c1': 20, 'big': LargeValue('big',15,True)},
+					{'id': 3, 'c1': 30, 'big': None}
+				],
+				rows
+			)
+			self.assertEqual([u'xxxxx',u'yyyyy',u'zzzzz'],list(read_large_value(fh,rows[1]['big'])))
+			self.assertEqual('EOF',fh.read())
+
+		entries=self._read_index('t1')
+		self.assertEqual(1,len(entries))
+		self.assertEqual(checksum(buf+'xxxxxyyyyyzzzzz'),entries[0].checksum)
+
+	def test_backup_tables_archive(self):
+		dmp=Dump(self.backup_dir, self.cache_dir, self.engine,'the_database','my_server',archive=True)
+		dmp.con=MagicMock()
+		self.assertTrue(dmp.backup_dir.endswith('.tar'))
+
+		dmp.info['meta']=MagicMock(tables={
+			'table1': MagicMock(**{'select.return_value': 'select from table1'})
+		})
+		res1=MagicMock(**{'fetchmany.side_effect': [['r1','r2'],['r3'],[]]})
+		dmp.con.execute=MagicMock(return_value=res1)
+
+		dmp.backup_tables()
+		dmp.info['meta']=None
+		dmp.finsih_backup()
+
+		tar=tarfile.open(dmp.backup_dir)
+		self.assertEqual(
+			['table1.pickle','table1.idx','_manifest.json','_metadata.pickle','_report.json'],
+			tar.getnames()
+		)
+		fh=tar.extractfile('table1.pickle')
+		l=fh.readline()
+		self.assertEqual(['r1','r2'],pickle.loads(fh.read(int(l))))
+		l=fh.readline()
+		self.assertEqual(['r3'],pickle.loads(fh.read(int(l))))
+		self.assertEqual('EOF',fh.read())
+		self.assertEqual(3,json.load(tar.extractfile('_manifest.json'))['tables']['table1']['rows'])
+
+	def test_backup_format_v2(self):
+		dmp=Dump(self.backup_dir, self.cache_dir, self.engine,'the_database','my_server',format=2)
+		dmp.con=MagicMock()
+		self.assertEqual({'format': 2, 'codec': 'binary', 'pk_ordered': True},{k: dmp.info[k] for k in ('format','codec','pk_ordered')})
+
+		meta=sa.MetaData()
+		sa.Table('table1',meta,sa.Column('id',sa.Integer,primary_key=True),sa.Column('c',sa.Unicode(20)))
+		dmp.info['meta']=meta
+		dmp.info['views']=[ObjectDef('v1','create view v1 as select 1 as c',[])]
+		res1=MagicMock(**{'fetchmany.side_effect': [[{'id': 1, 'c': u'a'},{'id': 2, 'c': None}],[]]})
+		dmp.con.execute=MagicMock(return_value=res1)
+
+		dmp.backup_tables()
+		dmp.finsih_backup()
+
+		self.assertEqual(
+			['_manifest.json','_report.json','_schema.json','_schema.jsonl','table1.blocks','table1.idx'],
+			sorted(os.listdir(dmp.backup_dir))
+		)
+		with open(os.path.join(dmp.backup_dir,'table1.blocks'),'rb') as fh:
+			l=fh.readline()
+			self.assertEqual([{'id': 1, 'c': u'a'},{'id': 2, 'c': None}],BinaryCodec().decode(fh.read(int(l))))
+		schema=BackupSchema.load(DirectoryStorage(dmp.backup_dir))
+		self.assertEqual(['id','c'],[c.name for c in schema.metadata().tables['table1'].columns])
+		self.assertEqual('v1',schema.objects('views')[0].name)
+		with open(os.path.join(dmp.backup_dir,'_report.json')) as fh:
+			report=json.load(fh)
+		self.assertEqual('dump',report['operation'])
+		self.assertEqual(['finish_backup'],[p['name'] for p in report['phases']])
+		self.assertEqual((2,1),(report['tables']['table1']['rows'],report['tables']['table1']['blocks']))
+		self.assertEqual(['fetch','serialize','write'],sorted(report['tables']['table1']['steps'].keys()))
+
+		with self.assertRaises(Exception):
+			Dump(self.backup_dir, self.cache_dir, self.engine,'the_database','my_server',format=3)
+
+	def test_backup_tables_stream(self):
+		stream=StringIO()
+		dmp=Dump(None, self.cache_dir, self.engine,'the_database','my_server',stream=stream)
+		dmp.con=MagicMock()
+		self.assertTrue(dmp.storage.sequential)
+
+		dmp.write_meta_data()
+		dmp.info['meta']=MagicMock(tables={
+			'table1': MagicMock(**{'select.return_value': 'select from table1'})
+		})
+		res1=MagicMock(**{'fetchmany.side_effect': [['r1','r2'],[]]})
+		dmp.con.execute=MagicMock(return_value=res1)
+		dmp.backup_tables()
+		# set while the tables are dumped, after the meta data was written
+		dmp.info['snapshot']={'isolation': 'SNAPSHOT', 'started': '2016-04-27T15:33:00.000000'}
+		dmp.finsih_backup()
+
+		self.assertTrue(stream.getvalue().endswith('END\n'))
+		storage=StreamStorage(StringIO(stream.getvalue()),'r')
+		with storage.open_read('_metadata.pickle') as fh:
+			self.assertIn('started',pickle.load(fh))
+		self.assertEqual('table1',next(storage.table_order(['table1'])))
+		with storage.open_read('table1.pickle') as fh:
+			l=fh.readline()
+			self.assertEqual(['r1','r2'],pickle.loads(fh.read(int(l))))
+			self.assertEqual('EOF',fh.read())
+		with storage.open_read('_manifest.json') as fh:
+			self.assertEqual(2,json.load(fh)['tables']['table1']['rows'])
+		with storage.open_read('_trailer.json') as fh:
+			trailer=json.load(fh)
+		self.assertEqual(['finished','snapshot'],sorted(trailer.keys()))
+		self.assertEqual('2016-04-27T15:33:00.000000',trailer['snapshot']['started'])
+
+	def test_backup_tables_object_store(self):
+		client=LocalObjectStore(self.backup_dir)
+		dmp=Dump('s3://bucket/backups', self.cache_dir, self.engine,'the_database','my_server',object_store=client)
+		dmp.con=MagicMock()
+		self.assertTrue(dmp.backup_dir.startswith('s3://bucket/backups/the_database@my_server-'))
+
+		dmp.info['meta']=MagicMock(tables={
+			'table1': MagicMock(**{'select.return_value': 'select from table1'})
+		})
+		res1=MagicMock(**{'fetchmany.side_effect': [['r1','r2'],['r3'],[]]})
+		dmp.con.execute=MagicMock(return_value=res1)
+
+		dmp.backup_tables()
+		dmp.info['meta']=None
+		dmp.finsih_backup()
+
+		prefix=dmp.backup_dir[len('s3://bucket/'):]
+		self.assertEqual(
+			['_manifest.json','_metadata.pickle','_report.json','table1.idx','table1.pickle'],
+			[c['Key'][len(prefix)+1:] for c in client.list_objects_v2(Bucket='bucket',Prefix=prefix)['Contents']]
+		)
+		fh=client.get_object(Bucket='bucket',Key=prefix+'/table1.pickle')['Body']
+		l=fh.readline()
+		self.assertEqual(['r1','r2'],pickle.loads(fh.read(int(l))))
+
+	def test_backup_tables_striped(self):
+		stripe_dir=tempfile.mkdtemp(prefix='testdump_stripe_dir')
+		try:
+			dmp=Dump(self.backup_dir, self.cache_dir, self.engine,'the_database','my_server',stripe_dirs=[stripe_dir])
+			dmp.con=MagicMock()
+			stripe=os.path.join(stripe_dir,os.path.basename(dmp.backup_dir))
+
+			dmp.info['meta']=MagicMock(tables={
+				't1': MagicMock(**{'select.return_value': 'select from t1'}),
+				't2': MagicMock(**{'select.return_value': 'select from t2'})
+			})
+			dmp.con.execute=MagicMock(side_effect=lambda *args,**kwargs: MagicMock(**{'fetchmany.side_effect': [['r1'],[]]}))
+
+			dmp.backup_tables()
+			dmp.info['meta']=None
+			dmp.finsih_backup()
+
+			self.assertEqual(
+				{'paths': [dmp.backup_dir,stripe], 'policy': 'round-robin', 'files': dmp.info['stripes']['files']},
+				dmp.info['stripes']
+			)
+			self.assertEqual([0,1],sorted(dmp.info['stripes']['files'].values()))
+			self.assertEqual(['_manifest.json','_metadata.pickle','_report.json'],sorted([f for f in os.listdir(dmp.backup_dir) if f.startswith('_')]))
+			self.assertEqual(2,len(os.listdir(stripe)))
+		finally:
+			shutil.rmtree(stripe_dir)
+
+	def test_stream_no_resume(self):
+		with self.assertRaises(Exception):
+			Dump(None, self.cache_dir, self.engine,'the_database','my_server',resume_dir=self.backup_dir,stream=StringIO())
+
 	@patch('albackup.dump.sa.Index')
 	def test_fix_indexes_with_included_columns_no_change_required(self,Index):
 		ix1=MagicMock()
@@ -380,6 +939,24 @@ class TestDump(unittest.TestCase):
 		with self.assertRaises(Exception):
 			self.dmp._order_view_by_dependencies(views)
 
+	def test_order_view_by_dependencies_filtered(self):
+		self._create_db_objects()
+		self.dmp.exclude_tables=['t99']
+		views=[
+			ObjectDef('v1',None,['t1']),
+			ObjectDef('v2',None,['t99']),
+			ObjectDef('v3',None,['v2'])
+		]
+		self.assertEqual([views[0]],self.dmp._order_view_by_dependencies(views))
+
+	def test_get_triggers_filtered(self):
+		self._create_db_objects()
+		self.dmp.tables=['t*']
+		self.dmp._get_object_definitions=MagicMock(
+			return_value=[ObjectDef('tr1','create trigger tr1 on [dbo].[T1] after insert',None), ObjectDef('tr2','create trigger tr2 on t99 after insert',None)]
+		)
+		self.assertEqual(['tr1'],[t.name for t in self.dmp.get_triggers()])
+
 	def test_get_procedures(self):
 		self.dmp._get_object_definitions=MagicMock(
 			return_value=[ ObjectDef('p1',None,None), ObjectDef('p2',None,None) ]
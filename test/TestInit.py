@@ -4,7 +4,9 @@ import tempfile
 import json
 from mock import patch,MagicMock
 
-from albackup import loggerFactory,transaction,execute_resultset,DumpRestoreBase,Password
+import sqlalchemy as sa
+
+from albackup import loggerFactory,transaction,execute_resultset,DumpRestoreBase,Password,filter_names,referenced_tables,trigger_table
 
 class TestLoggerFactory(unittest.TestCase):
 
@@ -55,6 +57,34 @@ class TestExecuteResultset(unittest.TestCase):
 		res.close.assert_called_once_with()
 
 
+class TestFilterNames(unittest.TestCase):
+
+	def testFilterNames(self):
+		names=['orders','Order_Lines','users','audit_log']
+		self.assertEqual(names,filter_names(names))
+		self.assertEqual(['orders','Order_Lines'],filter_names(names,['order*']))
+		self.assertEqual(['orders'],filter_names(names,['ORDER*'],['*_lines']))
+		self.assertEqual(['orders','Order_Lines','users'],filter_names(names,None,['audit_*']))
+		self.assertEqual([],filter_names(names,['missing']))
+
+	def testReferencedTables(self):
+		meta=sa.MetaData()
+		sa.Table('t1',meta,sa.Column('id',sa.Integer,primary_key=True))
+		t2=sa.Table('t2',meta,
+			sa.Column('id',sa.Integer,primary_key=True),
+			sa.Column('t1_id',sa.Integer,sa.ForeignKey('t1.id')),
+			sa.Column('t3_id',sa.Integer,sa.ForeignKey('dbo.t3.id'))
+		)
+		self.assertEqual(set(['t1','dbo.t3']),referenced_tables(t2))
+		self.assertEqual(set(),referenced_tables(meta.tables['t1']))
+
+	def testTriggerTable(self):
+		self.assertEqual('orders',trigger_table('CREATE TRIGGER [dbo].[tr1] ON [dbo].[Orders] AFTER INSERT AS ...'))
+		self.assertEqual('orders',trigger_table('create trigger tr_on_orders\non "dbo"."orders" after update as ...'))
+		self.assertEqual('orders',trigger_table('create trigger tr1 on orders for delete as ...'))
+		self.assertIsNone(trigger_table('create view v1 as select 1'))
+
+
 class TestDumpRestoreBase(unittest.TestCase):
 
 	def setUp(self):
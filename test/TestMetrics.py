@@ -0,0 +1,86 @@
+import unittest
+import os
+import sys
+import json
+import tempfile
+import shutil
+from StringIO import StringIO
+
+_baseDir=os.path.abspath(os.path.join(os.path.dirname(__file__),'..'))
+if _baseDir not in sys.path:
+    sys.path.insert(0,_baseDir)
+
+from albackup.report import Report
+from albackup.metrics import MetricsListener,PrometheusTextfile,JsonLines
+
+
+class TestMetrics(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir=tempfile.mkdtemp(prefix='testmetrics')
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp_dir)
+
+	def _samples(self,file_name):
+		with open(file_name) as fh:
+			return [l for l in fh.read().splitlines() if not l.startswith('#')]
+
+	def test_prometheus_textfile(self):
+		file_name=os.path.join(self.tmp_dir,'albackup.prom')
+		report=Report('dump')
+		report.listeners.append(PrometheusTextfile(file_name,{'database': 'db"1'},interval=3600))
+
+		with report.phase('backup_tables'):
+			with report.table('t1') as stats:
+				self.assertIn('albackup_current_phase{database="db\\"1",operation="dump",phase="backup_tables"} 1',self._samples(file_name))
+				stats.add(rows=500,bytes=4096,blocks=1)
+				stats.add(rows=20,bytes=128,blocks=1)
+				# throttled by the interval
+				self.assertFalse(any([l.startswith('albackup_rows_total') for l in self._samples(file_name)]))
+			report.count('connection_recycles')
+
+		samples=self._samples(file_name)
+		self.assertIn('albackup_rows_total{database="db\\"1",operation="dump",table="t1"} 520',samples)
+		self.assertIn('albackup_blocks_total{database="db\\"1",operation="dump",table="t1"} 2',samples)
+		self.assertIn('albackup_connection_recycles_total{database="db\\"1",operation="dump"} 1',samples)
+		self.assertIn('albackup_finished{database="db\\"1",operation="dump"} 0',samples)
+		self.assertFalse(any([l.startswith('albackup_current_table') for l in samples]))
+
+		report.finish()
+		self.assertIn('albackup_finished{database="db\\"1",operation="dump"} 1',self._samples(file_name))
+		self.assertEqual(['albackup.prom'],os.listdir(self.tmp_dir))
+
+	def test_blocks_per_second(self):
+		report=Report('restore')
+		listener=JsonLines(StringIO())
+		listener._blocks=[(0.0,0),(50.0,10),(70.0,30)]
+		# the progress at 0.0 is out of the window
+		self.assertEqual(1.0,listener.blocks_per_second(report,70.0))
+		self.assertEqual(0.0,listener.blocks_per_second(report,125.0))
+
+	def test_emit_is_abstract(self):
+		self.assertRaises(TypeError,MetricsListener)
+
+	def test_json_lines(self):
+		out=StringIO()
+		report=Report('restore')
+		report.listeners.append(JsonLines(out,{'database': 'db1'}))
+		with report.phase('import_tables'):
+			with report.table('t1') as stats:
+				stats.add(rows=500,bytes=4096,blocks=1)
+		report.count('connection_recycles')
+		report.finish()
+
+		lines=[json.loads(l) for l in out.getvalue().splitlines()]
+		self.assertEqual(
+			['phase_started','table_started','table_progress','table_finished','phase_finished','counter','finished'],
+			[l['event'] for l in lines]
+		)
+		self.assertTrue(all([l['database']=='db1' and l['operation']=='restore' for l in lines]))
+		self.assertEqual((u't1',500,4096,1),tuple(lines[2][k] for k in ('table','rows','bytes','blocks')))
+		self.assertEqual({'connection_recycles': 1},lines[-1]['counters'])
+
+
+if __name__=="__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+import unittest
+import os
+import sys
+import tempfile
+import shutil
+from mock import MagicMock
+
+_baseDir=os.path.abspath(os.path.join(os.path.dirname(__file__),'..'))
+if _baseDir not in sys.path:
+    sys.path.insert(0,_baseDir)
+
+from albackup.objectstore import LocalObjectStore,ObjectStoreStorage,is_object_store
+from albackup.storage import open_storage
+
+
+class TestLocalObjectStore(unittest.TestCase):
+
+	def setUp(self):
+		super(TestLocalObjectStore,self).setUp()
+		self.root=tempfile.mkdtemp(prefix='testobjectstore_root')
+		self.client=LocalObjectStore(self.root)
+
+	def tearDown(self):
+		shutil.rmtree(self.root)
+		super(TestLocalObjectStore,self).tearDown()
+
+	def test_put_and_get(self):
+		self.client.put_object(Bucket='b',Key='x/y.pickle',Body='0123456789')
+		self.assertEqual('0123456789',self.client.get_object(Bucket='b',Key='x/y.pickle')['Body'].read())
+		self.assertEqual('234',self.client.get_object(Bucket='b',Key='x/y.pickle',Range='bytes=2-4')['Body'].read())
+		self.assertEqual(
+			[{'Key': 'x/y.pickle', 'Size': 10}],
+			self.client.list_objects_v2(Bucket='b',Prefix='x/')['Contents']
+		)
+		self.assertEqual([],self.client.list_objects_v2(Bucket='b',Prefix='z/')['Contents'])
+
+	def test_multipart_upload(self):
+		upload_id=self.client.create_multipart_upload(Bucket='b',Key='k')['UploadId']
+		parts=[
+			{'PartNumber': n, 'ETag': self.client.upload_part(Bucket='b',Key='k',UploadId=upload_id,PartNumber=n,Body=body)['ETag']}
+			for (n,body) in ((1,'abc'),(2,'def'))
+		]
+		self.client.complete_multipart_upload(Bucket='b',Key='k',UploadId=upload_id,MultipartUpload={'Parts': parts})
+		self.assertEqual('abcdef',self.client.get_object(Bucket='b',Key='k')['Body'].read())
+		self.assertEqual([],os.listdir(os.path.join(self.root,'.uploads')))
+
+
+class TestObjectStoreStorage(unittest.TestCase):
+
+	def setUp(self):
+		super(TestObjectStoreStorage,self).setUp()
+		self.root=tempfile.mkdtemp(prefix='testobjectstore_root')
+		self.client=LocalObjectStore(self.root)
+
+	def tearDown(self):
+		shutil.rmtree(self.root)
+		super(TestObjectStoreStorage,self).tearDown()
+
+	def _lines(self):
+		return ['line {}\n'.format(i) for i in xrange(0,1000)]
+
+	def _write(self):
+		storage=ObjectStoreStorage(self.client,'s3://bucket/backups/db1','w',workers=3,part_size=100)
+		with storage.open_write('t1.pickle') as fh, storage.open_write('t1.idx') as ix:
+			for (i,l) in enumerate(self._lines()):
+				fh.write(l)
+				ix.write('{}\n'.format(i))
+		storage.write_file('_metadata.pickle','meta data')
+		storage.close()
+
+	def test_is_object_store(self):
+		self.assertTrue(is_object_store('s3://bucket/prefix'))
+		self.assertFalse(is_object_store('backup'))
+		self.assertFalse(is_object_store(None))
+
+	def test_write(self):
+		upload_part=MagicMock(side_effect=self.client.upload_part)
+		self.client.upload_part=upload_part
+		self._write()
+
+		self.assertTrue(len(upload_part.mock_calls)>10)
+		self.assertEqual(
+			''.join(self._lines()),
+			self.client.get_object(Bucket='bucket',Key='backups/db1/t1.pickle')['Body'].read()
+		)
+		self.assertEqual(
+			'meta data',
+			self.client.get_object(Bucket='bucket',Key='backups/db1/_metadata.pickle')['Body'].read()
+		)
+
+	def test_failed_upload_is_aborted(self):
+		self.client.upload_part=MagicMock(side_effect=Exception('connection lost'))
+		self.client.abort_multipart_upload=MagicMock()
+		storage=ObjectStoreStorage(self.client,'s3://bucket/db1','w',part_size=10)
+		with self.assertRaises(Exception):
+			with storage.open_write('t1.pickle') as fh:
+				fh.write('x'*100)
+		self.assertEqual(1,len(self.client.abort_multipart_upload.mock_calls))
+		self.assertFalse(storage.exists('t1.pickle'))
+		storage.close()
+
+	def test_read(self):
+		self._write()
+
+		storage=open_storage('s3://bucket/backups/db1',self.client)
+		storage.part_size=64
+		self.assertIsInstance(storage,ObjectStoreStorage)
+		self.assertFalse(storage.supports_resume)
+		self.assertTrue(storage.exists('t1.idx'))
+		self.assertFalse(storage.exists('t2.pickle'))
+		self.assertEqual(len(''.join(self._lines())),storage.size('t1.pickle'))
+
+		with storage.open_read('t1.pickle') as fh:
+			self.assertEqual(self._lines(),list(fh))
+		with storage.open_read('t1.pickle') as fh:
+			self.assertEqual('line 0\nli',fh.read(9))
+			fh.seek(7*10)
+			self.assertEqual('line 10\n',fh.readline())
+			self.assertEqual(78,fh.tell())
+			fh.seek(-8,2)
+			self.assertEqual('line 999\n'[1:],fh.read())
+			self.assertEqual('',fh.read())
+		with storage.open_read('_metadata.pickle') as fh:
+			self.assertEqual('meta data',fh.read())
+		storage.close()
+
+
+if __name__=="__main__":
+    unittest.main()
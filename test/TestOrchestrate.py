@@ -0,0 +1,87 @@
+import unittest
+import os
+import sys
+import json
+import time
+import tempfile
+import shutil
+import threading
+
+_baseDir=os.path.abspath(os.path.join(os.path.dirname(__file__),'..'))
+if _baseDir not in sys.path:
+    sys.path.insert(0,_baseDir)
+
+from albackup.orchestrate import Job,Orchestrator,report,write_report
+
+
+class TestOrchestrator(unittest.TestCase):
+
+	def setUp(self):
+		super(TestOrchestrator,self).setUp()
+		self.lock=threading.Lock()
+		self.running={}
+		self.peak={}
+
+	def _job(self,name,servers,fail=False):
+		def run():
+			with self.lock:
+				for s in set(servers+('all',)):
+					self.running[s]=self.running.get(s,0)+1
+					self.peak[s]=max(self.peak.get(s,0),self.running[s])
+			time.sleep(0.02)
+			with self.lock:
+				for s in set(servers+('all',)):
+					self.running[s]-=1
+			if fail:
+				raise Exception('{} failed'.format(name))
+			return {'db': name}
+		return Job(name,servers,run)
+
+	def test_limits(self):
+		jobs=[self._job('a{}'.format(i),('a',)) for i in xrange(0,6)]+[self._job('b{}'.format(i),('b','restore')) for i in xrange(0,6)]
+		results=Orchestrator(jobs,workers=4,per_server=2,server_limits={'restore': 1}).run()
+
+		self.assertEqual([j.name for j in jobs],[r.name for r in results])
+		self.assertTrue(all([r.ok for r in results]))
+		self.assertEqual({'db': 'b3'},results[9].details)
+		self.assertEqual(2,self.peak['a'])
+		self.assertEqual(1,self.peak['b'])
+		self.assertEqual(1,self.peak['restore'])
+		self.assertEqual(3,self.peak['all'])
+
+	def test_same_server_twice(self):
+		results=Orchestrator([self._job('a',('s1','s1')),self._job('b',('s1','s1'))],workers=2,per_server=1).run()
+		self.assertEqual([True,True],[r.ok for r in results])
+		self.assertEqual(1,self.peak['s1'])
+
+	def test_failed_job(self):
+		results=Orchestrator([self._job('a',('s1',),fail=True),self._job('b',('s1',))]).run()
+		self.assertEqual([False,True],[r.ok for r in results])
+		self.assertEqual('a failed',results[0].error)
+		self.assertEqual({},results[0].details)
+
+	def test_invalid_limit(self):
+		with self.assertRaises(Exception):
+			Orchestrator([self._job('a',('s1',))],server_limits={'s1': 0})
+
+	def test_report(self):
+		results=Orchestrator([self._job('a',('s1',),fail=True),self._job('b',('s2',))],workers=2).run()
+		r=report(results)
+		self.assertEqual(1,r['ok'])
+		self.assertEqual(1,r['failed'])
+		self.assertEqual(['a','b'],[j['name'] for j in r['jobs']])
+		self.assertEqual(['s2'],r['jobs'][1]['servers'])
+		self.assertEqual({'db': 'b'},r['jobs'][1]['details'])
+
+		tmp_dir=tempfile.mkdtemp(prefix='testorchestrate')
+		try:
+			file_name=os.path.join(tmp_dir,'report.json')
+			write_report(file_name,results)
+			with open(file_name) as fh:
+				self.assertEqual(json.loads(json.dumps(r)),json.load(fh))
+		finally:
+			shutil.rmtree(tmp_dir)
+
+
+if __name__=="__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+import os
+import sys
+import tempfile
+import shutil
+import pstats
+
+_baseDir=os.path.abspath(os.path.join(os.path.dirname(__file__),'..'))
+if _baseDir not in sys.path:
+    sys.path.insert(0,_baseDir)
+
+from albackup.report import Report
+from albackup.profiling import Profiler
+
+
+def _deserialize(n):
+	return [(i,'row {}'.format(i)) for i in xrange(0,n)]
+
+def _reflect():
+	return {'t1': None}
+
+
+class TestProfiling(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir=tempfile.mkdtemp(prefix='testprofiling')
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp_dir)
+
+	def _functions(self,file_name):
+		stats=pstats.Stats(os.path.join(self.tmp_dir,file_name))
+		return set([f[2] for f in stats.stats])
+
+	def test_phases_and_tables(self):
+		report=Report('restore')
+		report.listeners.append(Profiler(self.tmp_dir,memory=True,tables=True))
+		with report.phase('fixTextColumns'):
+			_reflect()
+		with report.phase('import_tables'):
+			rows=[]
+			with report.table('dbo.t1'):
+				rows+=_deserialize(1000)
+			_reflect()
+		report.finish()
+
+		self.assertEqual(
+			['_memory-restore.txt','_profile-restore-fixTextColumns.pstats','_profile-restore-import_tables.pstats','_profile-restore-table-dbo.t1.pstats'],
+			sorted(os.listdir(self.tmp_dir))
+		)
+		self.assertIn('_deserialize',self._functions('_profile-restore-table-dbo.t1.pstats'))
+		self.assertNotIn('_deserialize',self._functions('_profile-restore-import_tables.pstats'))
+		self.assertIn('_reflect',self._functions('_profile-restore-import_tables.pstats'))
+
+		with open(os.path.join(self.tmp_dir,'_memory-restore.txt')) as fh:
+			lines=fh.read().splitlines()
+		self.assertEqual(['fixTextColumns','table-dbo.t1','import_tables'],[l.split(':')[0] for l in lines if not l.startswith(' ')])
+		self.assertIn('tuple',[l.split()[1] for l in lines[lines.index([l for l in lines if l.startswith('table-')][0])+1:] if l.startswith(' ')])
+
+	def test_memory_only(self):
+		report=Report('dump')
+		report.listeners.append(Profiler(self.tmp_dir,cpu=False,memory=True))
+		with report.phase('backup_tables'):
+			with report.table('t1'):
+				pass
+		self.assertEqual(['_memory-dump.txt'],os.listdir(self.tmp_dir))
+
+
+if __name__=="__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+import os
+import sys
+import json
+import tempfile
+import shutil
+from mock import patch,Mock
+
+_baseDir=os.path.abspath(os.path.join(os.path.dirname(__file__),'..'))
+if _baseDir not in sys.path:
+    sys.path.insert(0,_baseDir)
+
+from albackup.report import Report,ReportListener,TableStats
+
+
+class TestReport(unittest.TestCase):
+
+	@patch('albackup.report.time')
+	def test_table_stats(self,time):
+		time.time.side_effect=[0.0,1.0,1.0,1.5,2.0,4.0,10.0,10.5]
+		stats=TableStats('t1')
+		blocks=iter(stats.timed('fetch',['b1','b2']))
+
+		self.assertEqual('b1',next(blocks))
+		with stats.timer('write'):
+			stats.add(rows=10,bytes=100,blocks=1)
+		self.assertEqual('b2',next(blocks))
+		self.assertEqual([],list(blocks))
+		self.assertEqual(
+			{'seconds': 0.0, 'rows': 10, 'bytes': 100, 'blocks': 1, 'rows_per_second': None, 'steps': {'fetch': 3.5, 'write': 0.5}},
+			stats.as_dict()
+		)
+
+	def test_report(self):
+		report=Report('dump')
+		with report.phase('get_meta_data'):
+			pass
+		with self.assertRaises(ValueError):
+			with report.phase('backup_tables'):
+				with report.table('t1') as stats:
+					stats.add(rows=5,bytes=50,blocks=1)
+				with report.table('t1') as stats:
+					stats.add(rows=5,bytes=50,blocks=1)
+				with report.table('t2') as stats:
+					raise ValueError()
+
+		result=report.as_dict()
+		self.assertEqual(['get_meta_data','backup_tables'],[p['name'] for p in result['phases']])
+		self.assertEqual((10,100,2),tuple(result['tables']['t1'][k] for k in ('rows','bytes','blocks')))
+		self.assertEqual(0,result['tables']['t2']['rows'])
+		self.assertEqual((10,100),(result['rows'],result['bytes']))
+		report.log_summary()
+
+		tmp_dir=tempfile.mkdtemp(prefix='testreport')
+		try:
+			report.write(os.path.join(tmp_dir,'report.json'))
+			with open(os.path.join(tmp_dir,'report.json')) as fh:
+				self.assertEqual('dump',json.load(fh)['operation'])
+		finally:
+			shutil.rmtree(tmp_dir)
+
+	def test_listeners(self):
+		report=Report('restore')
+		listener=Mock(spec=ReportListener)
+		failing=Mock(spec=ReportListener)
+		failing.table_progress.side_effect=IOError('disk full')
+		report.listeners+=[failing,listener]
+
+		with report.phase('import_tables'):
+			self.assertEqual('import_tables',report.current_phase)
+			with report.table('t1') as stats:
+				stats.add(rows=5,bytes=50,blocks=1)
+			report.count('connection_recycles')
+			report.count('connection_recycles')
+		report.finish()
+
+		self.assertEqual(None,report.current_phase)
+		self.assertEqual(
+			['phase_started','table_started','table_progress','table_finished','counter_changed','counter_changed','phase_finished','finished'],
+			[c[0] for c in listener.method_calls]
+		)
+		listener.counter_changed.assert_called_with(report,'connection_recycles',2)
+		listener.table_progress.assert_called_once_with(report,stats)
+		self.assertEqual({'connection_recycles': 2},report.as_dict()['counters'])
+
+
+if __name__=="__main__":
+    unittest.main()
@@ -3,9 +3,11 @@ import os
 import sys
 import tempfile
 import shutil
+from StringIO import StringIO
 from mock import patch,MagicMock,mock_open,call
 from sqlalchemy.util import pickle,byte_buffer
 import sqlalchemy as sa
+from sqlalchemy.dialects import mssql
 
 
 _baseDir=os.path.abspath(os.path.join(os.path.dirname(__file__),'..'))
@@ -15,6 +17,12 @@ if _baseDir not in sys.path:
 
 from albackup.restore import Restore
 from albackup import ObjectDef
+from albackup.storage import ArchiveStorage,StreamStorage,StripedStorage
+from albackup.objectstore import LocalObjectStore,ObjectStoreStorage
+from albackup.codec import BinaryCodec
+from albackup.schema import write_schema
+from albackup.storage import DirectoryStorage
+from albackup.blocks import IndexEntry,LargeValue,checksum,write_block,write_index_entry,write_large_value,read_index
 
 def _breakpoint():
 	import pdb
@@ -101,6 +109,94 @@ class TestRestore(unittest.TestCase):
 					drop_all.assert_called_once_with(restore.con)
 					create_all.assert_called_once_with(restore.con)
 
+	def _selective_meta(self):
+		meta=sa.MetaData()
+		sa.Table('customers',meta,sa.Column('id',sa.Integer,primary_key=True))
+		sa.Table('orders',meta,
+			sa.Column('id',sa.Integer,primary_key=True),
+			sa.Column('customer_id',sa.Integer,sa.ForeignKey('customers.id'))
+		)
+		sa.Table('order_lines',meta,
+			sa.Column('id',sa.Integer,primary_key=True),
+			sa.Column('order_id',sa.Integer,sa.ForeignKey('orders.id'))
+		)
+		sa.Table('audit',meta,sa.Column('id',sa.Integer,primary_key=True))
+		return meta
+
+	def test_select_tables(self):
+		restore=self._newRestore({'meta': self._selective_meta()})
+		self.assertIsNone(restore.selected_tables)
+		self.assertEqual(sorted(restore.table_names),sorted(restore.restore_tables))
+
+		self.assertEqual(['order_lines','orders'],restore.select_tables(['order*']))
+		self.assertEqual(['orders'],restore.select_tables(['order*'],['*_lines']))
+		self.assertEqual(['orders'],restore.restore_tables)
+		self.assertEqual(
+			['customers','order_lines','orders'],
+			restore.select_tables(['order_lines'],with_dependencies=True)
+		)
+		with self.assertRaises(Exception):
+			restore.select_tables(['missing'])
+
+	def test_select_tables_format_v2(self):
+		write_schema(DirectoryStorage(self.backup_dir),{'format': 2, 'codec': 'binary', 'meta': self._selective_meta()})
+
+		restore=Restore(self.backup_dir,self.engine,tables=['orders'])
+		self.assertEqual(['orders'],restore.selected_tables)
+		# only the selected and the referenced tables are built
+		self.assertEqual(['customers','orders'],sorted(restore.meta.tables.keys()))
+
+		restore=Restore(self.backup_dir,self.engine,exclude_tables=['audit','customers'],with_dependencies=True)
+		self.assertEqual(['customers','order_lines','orders'],restore.selected_tables)
+
+	def test_createSchema_selected_tables(self):
+		v1=ObjectDef('v1','view 1',['orders'])
+		v2=ObjectDef('v2','view 2',['v1','customers'])
+		v3=ObjectDef('v3','view 3',['audit'])
+		restore=self._newRestore({'meta': self._selective_meta(), 'views': [v1,v2,v3]})
+		restore.select_tables(['orders'])
+		meta=restore.meta
+		restore.con=MagicMock()
+		restore.con.execute.return_value.fetchall.return_value=[
+			(u'fk_lines',u'order_lines',u'order_id',u'orders',u'id',u'CASCADE',u'NO_ACTION'),
+			(u'fk_orders',u'orders',u'customer_id',u'customers',u'id',u'NO_ACTION',u'NO_ACTION')
+		]
+		with patch.object(meta,'drop_all') as drop_all:
+			with patch.object(meta,'create_all') as create_all:
+				restore.createSchema()
+				drop_all.assert_called_once_with(restore.con,tables=[meta.tables['orders']])
+				create_all.assert_called_once_with(restore.con,tables=[meta.tables['orders']])
+
+		statements=[c[1][0] for c in restore.con.execute.mock_calls if c[0]=='' and isinstance(c[1][0],basestring)]
+		self.assertEqual(
+			[
+				"IF EXISTS (SELECT * FROM INFORMATION_SCHEMA.VIEWS WHERE table_name= 'v2') DROP VIEW v2",
+				"IF EXISTS (SELECT * FROM INFORMATION_SCHEMA.VIEWS WHERE table_name= 'v1') DROP VIEW v1",
+				'ALTER TABLE [order_lines] DROP CONSTRAINT [fk_lines]',
+				'ALTER TABLE [order_lines] WITH NOCHECK ADD CONSTRAINT [fk_lines] FOREIGN KEY ([order_id]) '+\
+					'REFERENCES [orders] ([id]) ON DELETE CASCADE ON UPDATE NO ACTION'
+			],
+			statements[1:]
+		)
+
+	def test_import_objects_selected_tables(self):
+		v1=ObjectDef('v1','view 1',['orders'])
+		v2=ObjectDef('v2','view 2',['audit'])
+		tr1=ObjectDef('tr1','CREATE TRIGGER tr1 ON "dbo"."orders" AFTER INSERT AS ...',None)
+		tr2=ObjectDef('tr2','create trigger [dbo].[tr2]\non [dbo].[audit] after update as ...',None)
+		restore=self._newRestore({'meta': self._selective_meta(), 'views': [v1,v2], 'triggers': [tr1,tr2], 'procedures': [], 'functions': []})
+		restore.select_tables(['orders'])
+		restore._import_object=MagicMock()
+
+		restore.import_objects()
+
+		self.assertEqual([v1],restore._import_object.mock_calls[0][1][1])
+		self.assertEqual([tr1],restore._import_object.mock_calls[1][1][1])
+		self.assertEqual(2,len(restore._import_object.mock_calls))
+
+		restore.select_tables(['audit'])
+		self.assertEqual([tr2],restore._affected_triggers())
+
 	def test_changeRIChecks_on(self):
 		restore=self._newRestore({})
 		restore.con=MagicMock()
@@ -113,6 +209,50 @@ class TestRestore(unittest.TestCase):
 		restore.changeRIChecks(True)
 		restore.con.execute.assert_called_once_with('EXEC sp_msforeachtable "ALTER TABLE ? NOCHECK CONSTRAINT all"')
 
+	def test_changeRIChecks_on_without_check(self):
+		restore=self._newRestore({})
+		restore.con=MagicMock()
+		restore.changeRIChecks(False,check=False)
+		restore.con.execute.assert_called_once_with('EXEC sp_msforeachtable "ALTER TABLE ? CHECK CONSTRAINT all"')
+
+	def _failingRestore(self,merge):
+		restore=self._newRestore({})
+		restore.merge=merge
+		for name in ('getTablesWithLargeColumnTypes','fixTextColumns','createCheckpoints','createSchema','changeRIChecks','changeTriggers','_recycleConnection','import_objects','dropCheckpoints'):
+			setattr(restore,name,MagicMock())
+		restore.merge_tables=MagicMock(side_effect=IOError('lost connection'))
+		restore.import_tables=MagicMock(side_effect=IOError('lost connection'))
+		restore.storage=MagicMock()
+		return restore
+
+	def test_run_closes_storage(self):
+		restore=self._failingRestore(False)
+		restore.import_tables.side_effect=None
+		restore.run()
+		restore.storage.close.assert_called_once_with()
+
+	def test_run_turns_on_checks_after_failed_merge(self):
+		restore=self._failingRestore(True)
+		with self.assertRaises(IOError):
+			restore.run()
+		self.assertEqual([call(off=True),call(off=False,check=False)],restore.changeRIChecks.mock_calls)
+		self.assertEqual([call(off=True),call(off=False)],restore.changeTriggers.mock_calls)
+		restore.storage.close.assert_called_once_with()
+
+		# errors of the checks don't hide the error of the restore
+		restore=self._failingRestore(True)
+		restore._recycleConnection.side_effect=ValueError()
+		with self.assertRaises(IOError):
+			restore.run()
+
+	def test_run_turns_on_checks_after_failed_import(self):
+		restore=self._failingRestore(False)
+		with self.assertRaises(IOError):
+			restore.run()
+		self.assertEqual([call(off=True),call(off=False,check=False)],restore.changeRIChecks.mock_calls)
+		self.assertEqual([],restore.changeTriggers.mock_calls)
+		restore.storage.close.assert_called_once_with()
+
 	def test_drop_views(self):
 		v1=ObjectDef('v1','view 1',None)
 		v2=ObjectDef('v2','view 2',None)
@@ -144,6 +284,9 @@ class TestRestore(unittest.TestCase):
 
 		self.assertEqual(3,len(restore._insertBlock.mock_calls))
 		self.assertFalse(restore._insertBlockWithLargeColumns.called)
+		stats=restore.report.tables['t1']
+		self.assertEqual(3,stats.blocks)
+		self.assertEqual(['deserialize','insert','read'],sorted(stats.steps.keys()))
 
 	def test_restore_large_columns(self):
 		restore=self._newRestore({})
@@ -211,6 +354,252 @@ class TestRestore(unittest.TestCase):
 
 		self.assertEqual(3, len(restore._recycleConnection.mock_calls))
 
+	def test_restore_records_checkpoints(self):
+		restore=self._newRestore({})
+		restore.info['meta']=MagicMock(tables={'t1': MagicMock})
+		restore._largeColumns={'t1':[]}
+		restore._getPrimaryKeyColumns=MagicMock(return_value=[])
+		restore._insertBlock=MagicMock()
+		restore._setCheckpoint=MagicMock()
+
+		self._create_backup_file('t1',3)
+
+		restore.import_tables()
+
+		restore._setCheckpoint.assert_has_calls([call('t1',0), call('t1',1), call('t1',2)])
+
+	def _create_indexed_backup_file(self,table_name,blocks,with_index=True):
+		file_name=os.path.join(self.backup_dir,'{}.pickle'.format(table_name))
+		index_name=os.path.join(self.backup_dir,'{}.idx'.format(table_name))
+
+		with open(file_name,'wb') as fh, open(index_name,'wb') as ix:
+			offset=0
+			for i in xrange(0,blocks):
+				buf=pickle.dumps(['block {}'.format(i)])
+				length=write_block(fh,buf)
+				write_index_entry(ix,IndexEntry(offset,length,1,checksum(buf)))
+				offset+=length
+			fh.write('EOF')
+
+		if not with_index:
+			os.remove(index_name)
+
+	def test_restore_resume_with_index(self):
+		restore=self._newRestore({})
+		restore.info['meta']=MagicMock(tables={'t1': MagicMock})
+		restore._largeColumns={'t1':[]}
+		restore._getPrimaryKeyColumns=MagicMock(return_value=[])
+		restore._insertBlock=MagicMock()
+		restore._setCheckpoint=MagicMock()
+		restore.checkpoints={'t1': 2}
+
+		self._create_indexed_backup_file('t1',5)
+
+		with patch('albackup.restore.read_index',wraps=read_index) as _read_index:
+			restore.import_tables()
+			self.assertTrue(_read_index.called)
+
+		self.assertEqual(
+			[call(restore.meta.tables['t1'],['block 3']), call(restore.meta.tables['t1'],['block 4'])],
+			restore._insertBlock.mock_calls
+		)
+		restore._setCheckpoint.assert_has_calls([call('t1',3), call('t1',4)])
+
+	def test_restore_resume_without_index(self):
+		restore=self._newRestore({})
+		restore.info['meta']=MagicMock(tables={'t1': MagicMock})
+		restore._largeColumns={'t1':[]}
+		restore._getPrimaryKeyColumns=MagicMock(return_value=[])
+		restore._insertBlock=MagicMock()
+		restore._setCheckpoint=MagicMock()
+		restore.checkpoints={'t1': 3}
+
+		self._create_indexed_backup_file('t1',5,with_index=False)
+
+		restore.import_tables()
+
+		self.assertEqual(
+			[call(restore.meta.tables['t1'],['block 4'])],
+			restore._insertBlock.mock_calls
+		)
+
+	def test_restore_resume_completed_table(self):
+		restore=self._newRestore({})
+		restore.info['meta']=MagicMock(tables={'t1': MagicMock})
+		restore._largeColumns={'t1':[]}
+		restore._getPrimaryKeyColumns=MagicMock(return_value=[])
+		restore._insertBlock=MagicMock()
+		restore.checkpoints={'t1': 4}
+
+		self._create_indexed_backup_file('t1',5)
+
+		restore.import_tables()
+
+		self.assertFalse(restore._insertBlock.called)
+
+	def test_restore_format_v2(self):
+		meta=sa.MetaData()
+		sa.Table('t1',meta,sa.Column('id',sa.Integer,primary_key=True))
+		write_schema(DirectoryStorage(self.backup_dir),{'format': 2, 'codec': 'binary', 'meta': meta, 'views': []})
+		with open(os.path.join(self.backup_dir,'t1.blocks'),'wb') as fh:
+			for i in xrange(0,2):
+				write_block(fh,BinaryCodec().encode([{'id': i}]))
+			fh.write('EOF')
+
+		restore=Restore(self.backup_dir,self.engine)
+		self.assertNotIn('meta',restore.info)
+		self.assertEqual(['t1'],restore.table_names)
+		self.assertNotIn('meta',restore.info)
+		self.assertEqual([],restore.views)
+		restore.getTablesWithLargeColumnTypes()
+		self.assertEqual(['t1'],restore.meta.tables.keys())
+		restore._insertBlock=MagicMock()
+
+		restore.import_tables()
+
+		self.assertEqual(
+			[call(restore.meta.tables['t1'],[{'id': i}]) for i in xrange(0,2)],
+			restore._insertBlock.mock_calls
+		)
+
+	def test_restore_from_archive(self):
+		archive_name=os.path.join(self.backup_dir,'backup.tar')
+		storage=ArchiveStorage(archive_name,'w')
+		with storage.open_write('t1.pickle') as fh:
+			for i in xrange(0,3):
+				write_block(fh,pickle.dumps(['block {}'.format(i)]))
+			fh.write('EOF')
+		storage.write_file('_metadata.pickle',pickle.dumps({'views': []}))
+		storage.close()
+
+		restore=Restore(archive_name,self.engine)
+		restore.info['meta']=MagicMock(tables={'t1': MagicMock})
+		restore._largeColumns={'t1':[]}
+		restore._getPrimaryKeyColumns=MagicMock(return_value=[])
+		restore._insertBlock=MagicMock()
+
+		restore.import_tables()
+
+		self.assertEqual(
+			[call(restore.meta.tables['t1'],['block {}'.format(i)]) for i in xrange(0,3)],
+			restore._insertBlock.mock_calls
+		)
+
+	def test_restore_from_stream(self):
+		stream=StringIO()
+		storage=StreamStorage(stream,'w')
+		storage.write_file('_metadata.pickle',pickle.dumps({'views': []}))
+		for t in ('t2','t1'):
+			with storage.open_write(t+'.pickle') as fh, storage.open_write(t+'.idx') as ix:
+				for i in xrange(0,2):
+					write_block(fh,pickle.dumps(['{} block {}'.format(t,i)]))
+					ix.write('index entry\n')
+				fh.write('EOF')
+		storage.write_file('_manifest.json','{}')
+		storage.write_file('_trailer.json','{"snapshot": {"started": "2016-04-27T15:33:00.000000"}, "subset": {"rows": {"t1": 2}}}')
+		storage.close()
+
+		restore=Restore('-',self.engine,stream=StringIO(stream.getvalue()))
+		restore.info['meta']=MagicMock(tables={'t1': MagicMock(), 't2': MagicMock()})
+		restore._largeColumns={'t1':[],'t2':[]}
+		restore._getPrimaryKeyColumns=MagicMock(return_value=[])
+		restore._insertBlock=MagicMock()
+
+		restore.import_tables()
+
+		self.assertEqual(
+			[call(restore.meta.tables[t],['{} block {}'.format(t,i)]) for t in ('t2','t1') for i in xrange(0,2)],
+			restore._insertBlock.mock_calls
+		)
+		# the info from the end of the stream is merged
+		self.assertEqual('2016-04-27T15:33:00.000000',restore.info['snapshot']['started'])
+		self.assertEqual({'rows': {'t1': 2}},restore.info['subset'])
+
+	def test_restore_from_object_store(self):
+		client=LocalObjectStore(self.backup_dir)
+		storage=ObjectStoreStorage(client,'s3://bucket/db1','w',part_size=16)
+		with storage.open_write('t1.pickle') as fh:
+			for i in xrange(0,3):
+				write_block(fh,pickle.dumps(['block {}'.format(i)]))
+			fh.write('EOF')
+		storage.write_file('_metadata.pickle',pickle.dumps({'views': []}))
+		storage.close()
+
+		restore=Restore('s3://bucket/db1',self.engine,object_store=client)
+		restore.storage.part_size=16
+		restore.info['meta']=MagicMock(tables={'t1': MagicMock()})
+		restore._largeColumns={'t1':[]}
+		restore._getPrimaryKeyColumns=MagicMock(return_value=[])
+		restore._insertBlock=MagicMock()
+
+		restore.import_tables()
+
+		self.assertEqual(
+			[call(restore.meta.tables['t1'],['block {}'.format(i)]) for i in xrange(0,3)],
+			restore._insertBlock.mock_calls
+		)
+
+	def test_restore_striped(self):
+		stripe_root=tempfile.mkdtemp(prefix='testrestore_stripe_dir')
+		try:
+			backup=os.path.join(self.backup_dir,'db@host')
+			stripe=os.path.join(stripe_root,'db@host')
+			os.makedirs(backup)
+			os.makedirs(stripe)
+			storage=StripedStorage([backup,stripe])
+			for t in ('t1','t2'):
+				with storage.open_write(t+'.pickle') as fh:
+					write_block(fh,pickle.dumps(['{} block'.format(t)]))
+					fh.write('EOF')
+			storage.write_file('_metadata.pickle',pickle.dumps({'views': [], 'stripes': storage.layout()}))
+
+			# the stripes moved since the dump
+			moved_root=os.path.join(stripe_root,'moved')
+			os.makedirs(moved_root)
+			os.rename(stripe,os.path.join(moved_root,'db@host'))
+
+			restore=Restore(backup,self.engine,stripe_dirs=[moved_root])
+			self.assertIsInstance(restore.storage,StripedStorage)
+			restore.info['meta']=MagicMock(tables={'t1': MagicMock(), 't2': MagicMock()})
+			restore._largeColumns={'t1':[],'t2':[]}
+			restore._getPrimaryKeyColumns=MagicMock(return_value=[])
+			restore._insertBlock=MagicMock()
+
+			restore.import_tables()
+
+			self.assertEqual(
+				sorted([call(restore.meta.tables[t],['{} block'.format(t)]) for t in ('t1','t2')]),
+				sorted(restore._insertBlock.mock_calls)
+			)
+		finally:
+			shutil.rmtree(stripe_root)
+
+	def test_restore_from_stream_no_resume(self):
+		with self.assertRaises(Exception):
+			Restore('-',self.engine,resume=True,stream=StringIO())
+
+	def test_setCheckpoint(self):
+		restore=self._newRestore({})
+		restore.con=MagicMock()
+
+		restore._setCheckpoint('t1',0)
+		restore._setCheckpoint('t1',1)
+
+		self.assertEqual({'t1': 1},restore.checkpoints)
+		self.assertEqual(
+			({'table_name': 't1', 'block': 0},),
+			restore.con.execute.mock_calls[0][1][1:]
+		)
+		self.assertIn('UPDATE',str(restore.con.execute.mock_calls[1][1][0]))
+
+	def test_readCheckpoints(self):
+		restore=self._newRestore({'views': []})
+		res=MagicMock(**{'fetchall.return_value': [('t1',3),('t2',0)]})
+		restore.con=MagicMock(**{'execute.return_value': res})
+
+		self.assertEqual({'t1': 3, 't2': 0},restore.readCheckpoints())
+		res.close.assert_called_once_with()
+
 	class ColumnsList(list):
 
 		def __init__(self,*args,**kwargs):
@@ -290,6 +679,59 @@ class TestRestore(unittest.TestCase):
 			]
 		)
 
+	def test_insertBlockWithLargeColumns_chunked_values(self):
+		restore=self._newRestore({})
+		restore.con=MagicMock()
+		restore._insertBlock=MagicMock()
+
+		pk=MagicMock()
+		pk.name='pk'
+		restore._getPrimaryKeyColumns=MagicMock(return_value=[pk])
+
+		def add_statement(col,value):
+			return col.name+"='"+value+"'"
+
+		long1=MagicMock()
+		long1.name='long1'
+		long1.__add__=add_statement
+		long2=MagicMock()
+		long2.name='long2'
+		long2.__add__=add_statement
+		restore._largeColumns={'t1': [long1,long2]}
+
+		values=MagicMock(return_value=MagicMock(**{'where.return_value': '<update statement>'}))
+		table=MagicMock(**{
+			'insert.return_value': '<insert statement>',
+			'update.return_value': MagicMock(**{'values': values}),
+			'columns': TestRestore.ColumnsList([pk,long1,long2])
+		})
+		table.name='t1'
+
+		rows=[
+			{'pk': 1, 'long1': 'abc', 'long2': None},
+			{'pk': 2, 'long1': LargeValue('long1',6,True), 'long2': LargeValue('long2',3,False)}
+		]
+		fh=StringIO()
+		write_large_value(fh,[u'ab\xe9',u'def'])
+		write_large_value(fh,['xyz'])
+		fh.write('EOF')
+		fh.seek(0)
+
+		restore._insertBlockWithLargeColumns(table,rows,fh)
+
+		restore._insertBlock.assert_called_once_with(table,[rows[0]])
+		restore.con.execute.assert_has_calls([
+			call('<insert statement>', {'long1': u'', 'long2': u'', 'pk': 2})
+		])
+		self.assertEqual(
+			[	call(long1=u"long1='ab\xe9'"),
+				call(long1=u"long1='def'"),
+				call(long2="long2='xyz'")
+			],
+			values.mock_calls
+		)
+		self.assertEqual('EOF',fh.read())
+
 	def test_insertBlock(self):
 		restore=self._newRestore({})
 		restore.con=MagicMock()
@@ -375,7 +817,7 @@ class TestRestore(unittest.TestCase):
 		pickle.dump(info,fh)
 		fh.seek(0)
 		
-		with patch('albackup.restore.open') as _open:
+		with patch('albackup.storage.open') as _open:
 			_open.return_value=fh
 			fh.__enter__=MagicMock(return_value=fh)
 			fh.__exit__=MagicMock()
@@ -385,5 +827,120 @@ class TestRestore(unittest.TestCase):
 		return ret
 
 
+class TestMergeRestore(unittest.TestCase):
+
+	def setUp(self):
+		super(TestMergeRestore,self).setUp()
+		self.backup_dir=tempfile.mkdtemp(prefix='testrestore_merge')
+		# connections are recycled during the restore, so the database is a file
+		self.engine=sa.create_engine('sqlite:///'+os.path.join(self.backup_dir,'target.db'))
+		self.meta=sa.MetaData()
+		sa.Table('t1',self.meta,sa.Column('id',sa.Integer,primary_key=True),sa.Column('name',sa.String(20)))
+		sa.Table('t2',self.meta,sa.Column('a',sa.Integer,primary_key=True),sa.Column('b',sa.Integer,primary_key=True))
+		sa.Table('t3',self.meta,sa.Column('id',sa.Integer,primary_key=True),sa.Column('body',sa.TEXT))
+		sa.Table('t4',self.meta,sa.Column('a',sa.Integer,primary_key=True),sa.Column('b',sa.Integer,primary_key=True),sa.Column('v',sa.String(20)))
+		self.meta.create_all(self.engine)
+		storage=DirectoryStorage(self.backup_dir)
+		write_schema(storage,{'format': 2, 'codec': 'binary', 'pk_ordered': True, 'meta': self.meta})
+		self._write_table('t1',[
+			[{'id': 1, 'name': 'a'},{'id': 2, 'name': 'b'}],
+			[{'id': 4, 'name': 'd'},{'id': 5, 'name': 'e'}]
+		])
+		self._write_table('t2',[[{'a': 1, 'b': 1},{'a': 1, 'b': 2}]])
+		self._write_table('t3',[[{'id': 1, 'body': LargeValue('body',6,False)},{'id': 2, 'body': 'same'}]],['abc','def'])
+		self._write_table('t4',[
+			[{'a': 1, 'b': 1, 'v': 'x'},{'a': 1, 'b': 2, 'v': 'y'}],
+			[{'a': 2, 'b': 1, 'v': 'z'}]
+		])
+
+	def tearDown(self):
+		shutil.rmtree(self.backup_dir)
+		super(TestMergeRestore,self).tearDown()
+
+	def _write_table(self,name,blocks,chunks=None):
+		with open(os.path.join(self.backup_dir,name+'.blocks'),'wb') as fh:
+			for rows in blocks:
+				write_block(fh,BinaryCodec().encode(rows))
+				if chunks:
+					write_large_value(fh,chunks)
+			fh.write('EOF')
+
+	def _rows(self,name):
+		return sorted(tuple(r) for r in self.engine.execute(self.meta.tables[name].select()).fetchall())
+
+	def test_merge_tables(self):
+		for sql in (
+			"insert into t1 values (1,'a'),(2,'x'),(3,'c'),(5,'e'),(6,'f')",
+			"insert into t2 values (1,1),(1,3),(9,9)",
+			"insert into t3 values (1,'old'),(2,'same')",
+			"insert into t4 values (1,1,'x'),(1,2,'old'),(1,3,'gone'),(2,1,'z')"
+		):
+			self.engine.execute(sql)
+
+		restore=Restore(self.backup_dir,self.engine,merge=True)
+		restore.getTablesWithLargeColumnTypes()
+		restore.createCheckpoints()
+		stats=restore.merge_tables()
+
+		self.assertEqual([(1,'a'),(2,'b'),(4,'d'),(5,'e')],self._rows('t1'))
+		self.assertEqual([(1,1),(1,2)],self._rows('t2'))
+		self.assertEqual([(1,'abcdef'),(2,'same')],self._rows('t3'))
+		# rows with the same first key column are told apart by the whole key
+		self.assertEqual([(1,1,'x'),(1,2,'y'),(2,1,'z')],self._rows('t4'))
+		self.assertEqual({'t1': (1,1,2), 't2': (1,0,2), 't3': (0,1,0), 't4': (0,1,1)},stats)
+
+		# a second merge finds no differences
+		restore=Restore(self.backup_dir,self.engine,merge=True)
+		restore.getTablesWithLargeColumnTypes()
+		restore.createCheckpoints()
+		restore._insertBlock=MagicMock()
+		self.assertEqual({'t1': (0,0,0), 't2': (0,0,0), 't3': (0,0,0), 't4': (0,0,0)},restore.merge_tables())
+		self.assertEqual([],restore._insertBlock.mock_calls)
+
+	def test_update_from_stage_statement(self):
+		restore=Restore(self.backup_dir,self.engine,merge=True)
+		table=restore.meta.tables['t4']
+		stage=restore._stageTable(table)
+		sql=str(restore._updateFromStageStatement(table,restore._getPrimaryKeyColumns(table),stage).compile(dialect=mssql.dialect()))
+		self.assertEqual(
+			'UPDATE t4 SET v=[#albackup_stage_t4].v FROM t4, [#albackup_stage_t4] '
+			'WHERE t4.a = [#albackup_stage_t4].a AND t4.b = [#albackup_stage_t4].b',
+			sql
+		)
+
+	def test_merge_empty_target(self):
+		restore=Restore(self.backup_dir,self.engine,merge=True,tables=['t1'])
+		restore.getTablesWithLargeColumnTypes()
+		self.assertEqual({'t1': (4,0,0)},restore.merge_tables())
+		self.assertEqual([(1,'a'),(2,'b'),(4,'d'),(5,'e')],self._rows('t1'))
+		stats=restore.report.tables['t1']
+		self.assertEqual((4,2),(stats.rows,stats.blocks))
+		self.assertEqual(['merge','read'],sorted(stats.steps.keys()))
+
+	def test_merge_unordered(self):
+		self.engine.execute("insert into t1 values (1,'a'),(3,'c')")
+		self._write_table('t1',[
+			[{'id': 1, 'name': 'a'},{'id': 4, 'name': 'd'}],
+			[{'id': 2, 'name': 'b'},{'id': 5, 'name': 'e'}]
+		])
+		restore=Restore(self.backup_dir,self.engine,merge=True,tables=['t1'])
+		restore.getTablesWithLargeColumnTypes()
+		with self.assertRaises(Exception) as cm:
+			restore.merge_tables()
+		self.assertIn('not in primary key order at key (2,)',str(cm.exception))
+		# the block out of order is not applied
+		self.assertEqual([(1,'a'),(4,'d')],self._rows('t1'))
+
+		# older backups don't record the order
+		del restore.info['pk_ordered']
+		with self.assertRaises(Exception) as cm:
+			restore.merge_tables()
+		self.assertIn('was not dumped in primary key order',str(cm.exception))
+
+	def test_merge_and_resume(self):
+		with self.assertRaises(Exception):
+			Restore(self.backup_dir,self.engine,merge=True,resume=True)
+
+
 if __name__=="__main__":
     unittest.main()
\ No newline at end of file
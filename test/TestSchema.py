@@ -0,0 +1,139 @@
+import unittest
+import os
+import sys
+import json
+import tempfile
+import shutil
+from StringIO import StringIO
+from mock import MagicMock
+import sqlalchemy as sa
+from sqlalchemy.dialects import mssql
+from sqlalchemy.schema import CreateTable,CreateIndex
+
+_baseDir=os.path.abspath(os.path.join(os.path.dirname(__file__),'..'))
+if _baseDir not in sys.path:
+    sys.path.insert(0,_baseDir)
+
+from albackup import ObjectDef
+from albackup.schema import BackupSchema,write_schema,type_to_dict,type_from_dict,table_to_dict,table_from_dict
+from albackup.storage import DirectoryStorage,StreamStorage
+
+
+def _ddl(table):
+	# the lines of the DDL of a table and its indexes, the order of the
+	# constraints isn't preserved
+	dialect=mssql.dialect()
+	ddl=[str(CreateTable(table).compile(dialect=dialect))]+[
+		str(CreateIndex(ix).compile(dialect=dialect))
+		for ix in table.indexes
+	]
+	return sorted([l.strip().rstrip(',') for d in ddl for l in d.split('\n') if l.strip()])
+
+
+class TestSchema(unittest.TestCase):
+
+	def _meta(self):
+		meta=sa.MetaData()
+		sa.Table('t0',meta,sa.Column('id',mssql.INTEGER,primary_key=True))
+		t1=sa.Table(
+			't1',
+			meta,
+			sa.Column('id',mssql.INTEGER,sa.Sequence('id_identity',start=10,increment=2),primary_key=True,autoincrement=True),
+			sa.Column('pos',mssql.SMALLINT,primary_key=True,autoincrement=False),
+			sa.Column('name',mssql.NVARCHAR(length='max',collation='Latin1_General_CI_AS')),
+			sa.Column('amount',mssql.NUMERIC(10,2),server_default=sa.text('((0))')),
+			sa.Column('created',mssql.DATETIME2(precision=3),nullable=False),
+			sa.Column('t0_id',mssql.INTEGER,sa.ForeignKey('t0.id',name='fk_t0',ondelete='CASCADE')),
+			sa.Column('version',mssql.TIMESTAMP),
+			sa.Column('data',mssql.VARBINARY('max')),
+			sa.Column('text',mssql.TEXT(collation=u'SQL_Latin1_General_CP1_CI_AS')),
+			sa.UniqueConstraint('created',name='uq_created')
+		)
+		sa.Index('ix_name',t1.c.name,t1.c.amount,mssql_include=['created'],mssql_clustered=False)
+		sa.Index('ix_created',t1.c.created,unique=True)
+		return meta
+
+	def test_type(self):
+		for type_ in (mssql.NVARCHAR(50),mssql.BIT(),mssql.DATETIME2(precision=7),mssql.NUMERIC(5,1),mssql.UNIQUEIDENTIFIER()):
+			d=json.loads(json.dumps(type_to_dict(type_)))
+			self.assertEqual(repr(type_),repr(type_from_dict(d)))
+
+	def test_unsupported_type(self):
+		class MyType(sa.types.TypeDecorator):
+			impl=sa.Integer
+		with self.assertRaises(Exception):
+			type_to_dict(MyType())
+		with self.assertRaises(Exception):
+			type_from_dict({'type': 'os.system', 'args': {}})
+
+	def test_table(self):
+		meta=self._meta()
+		new_meta=sa.MetaData()
+		for name in ('t0','t1'):
+			d=json.loads(json.dumps(table_to_dict(meta.tables[name])))
+			table_from_dict(new_meta,d)
+			self.assertEqual(_ddl(meta.tables[name]),_ddl(new_meta.tables[name]))
+		self.assertEqual(['id','pos'],[c.name for c in new_meta.tables['t1'].primary_key.columns])
+
+	def _info(self):
+		return {
+			'started': 'now',
+			'finished': 'later',
+			'format': 2,
+			'codec': 'binary',
+			'meta': self._meta(),
+			'views': [ObjectDef('v1','create view v1 as select 1 as c',['t1'])],
+			'procedures': [],
+			'functions': [ObjectDef('f1','create function f1 ...',None)],
+			'triggers': []
+		}
+
+	def test_backup_schema(self):
+		backup_dir=tempfile.mkdtemp(prefix='testschema_backup_dir')
+		try:
+			info=self._info()
+			write_schema(DirectoryStorage(backup_dir),info)
+			self.assertEqual(['_schema.json','_schema.jsonl'],sorted(os.listdir(backup_dir)))
+
+			storage=DirectoryStorage(backup_dir)
+			storage.read_range=MagicMock(side_effect=storage.read_range)
+			schema=BackupSchema.load(storage)
+			new_info=schema.info()
+			self.assertEqual(0,len(storage.read_range.mock_calls))
+			self.assertEqual(['codec','finished','format','started'],sorted(new_info.keys()))
+			self.assertEqual(['t0','t1'],schema.table_names())
+
+			self.assertEqual(info['views'],schema.objects('views'))
+			self.assertEqual(info['functions'],schema.objects('functions'))
+			with self.assertRaises(KeyError):
+				schema.objects('sequences')
+
+			# only the requested tables are read
+			storage.read_range.reset_mock()
+			meta=schema.metadata(['t0'])
+			self.assertEqual(['t0'],meta.tables.keys())
+			self.assertEqual(1,len(storage.read_range.mock_calls))
+
+			meta=schema.metadata()
+			self.assertEqual(['t0','t1'],sorted(meta.tables.keys()))
+			self.assertEqual(_ddl(info['meta'].tables['t1']),_ddl(meta.tables['t1']))
+		finally:
+			shutil.rmtree(backup_dir)
+
+	def test_backup_schema_stream(self):
+		stream=StringIO()
+		storage=StreamStorage(stream,'w')
+		write_schema(storage,self._info())
+		storage.close()
+
+		schema=BackupSchema.load(StreamStorage(StringIO(stream.getvalue()),'r'))
+		self.assertEqual(['t0','t1'],sorted(schema.metadata().tables.keys()))
+		self.assertEqual('v1',schema.objects('views')[0].name)
+
+	def test_unsupported_format(self):
+		with self.assertRaises(Exception):
+			BackupSchema({'format': 3},None)
+
+
+if __name__=="__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+import os
+import sys
+import sqlalchemy as sa
+
+_baseDir=os.path.abspath(os.path.join(os.path.dirname(__file__),'..'))
+if _baseDir not in sys.path:
+    sys.path.insert(0,_baseDir)
+
+from albackup.sqltrace import SQLTracer,statement_shape
+
+
+class TestSqlTrace(unittest.TestCase):
+
+	def test_statement_shape(self):
+		self.assertEqual("exec sp_helptext ?",statement_shape("exec sp_helptext 'dbo.v_orders'"))
+		self.assertEqual("exec sp_helptext ?",statement_shape("exec  sp_helptext N'it''s'"))
+		self.assertEqual(
+			"SELECT t1.a FROM t1 WHERE t1.id IN (?, ...) AND t1.b > ? AND t1.c = ?",
+			statement_shape("SELECT t1.a FROM t1\n\tWHERE t1.id IN (1, 2,3) AND t1.b > -1.5 AND t1.c = 0x1F")
+		)
+		self.assertEqual("SELECT name FROM sys.indexes WHERE object_id = ?",statement_shape("SELECT name FROM sys.indexes WHERE object_id = ?"))
+
+	def test_tracer(self):
+		engine=sa.create_engine('sqlite://')
+		tracer=SQLTracer()
+		tracer.attach(engine)
+		con=engine.connect()
+		con.execute('CREATE TABLE t1 (id INTEGER PRIMARY KEY, name VARCHAR(20))')
+		for i in xrange(0,5):
+			con.execute("INSERT INTO t1 (id,name) VALUES ({},'row {}')".format(i,i))
+		with self.assertRaises(sa.exc.OperationalError):
+			con.execute('SELECT * FROM missing')
+		con.execute('SELECT count(*) FROM t1').fetchall()
+		tracer.detach(engine)
+		con.execute('SELECT count(*) FROM t1').fetchall()
+		con.close()
+
+		report=tracer.report(top=2)
+		self.assertEqual((8,4),(report['statements'],report['shapes']))
+		self.assertEqual(
+			{'shape': 'INSERT INTO t1 (id,name) VALUES (?, ...)', 'count': 5, 'errors': 0},
+			{k: report['most_frequent'][0][k] for k in ('shape','count','errors')}
+		)
+		self.assertEqual(2,len(report['slowest']))
+		self.assertEqual(1,tracer.statements['SELECT * FROM missing'].errors)
+		tracer.log_report()
+
+
+if __name__=="__main__":
+    unittest.main()
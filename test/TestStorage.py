@@ -0,0 +1,272 @@
+import unittest
+import os
+import sys
+import tempfile
+import shutil
+import tarfile
+from StringIO import StringIO
+from mock import patch
+
+_baseDir=os.path.abspath(os.path.join(os.path.dirname(__file__),'..'))
+if _baseDir not in sys.path:
+    sys.path.insert(0,_baseDir)
+
+from albackup.storage import DirectoryStorage,ArchiveStorage,StreamStorage,StripedStorage,open_storage,stripe_paths
+
+
+class TestDirectoryStorage(unittest.TestCase):
+
+	def setUp(self):
+		super(TestDirectoryStorage,self).setUp()
+		self.backup_dir=tempfile.mkdtemp(prefix='teststorage_backup_dir')
+		self.storage=DirectoryStorage(self.backup_dir)
+
+	def tearDown(self):
+		shutil.rmtree(self.backup_dir)
+		super(TestDirectoryStorage,self).tearDown()
+
+	def test_write_and_read(self):
+		self.assertFalse(self.storage.exists('t1.pickle'))
+		with self.storage.open_write('t1.pickle') as fh:
+			fh.write('abc')
+		with self.storage.open_write('t1.pickle',append=True) as fh:
+			fh.write('def')
+
+		self.assertTrue(self.storage.exists('t1.pickle'))
+		self.assertEqual(6,self.storage.size('t1.pickle'))
+		with self.storage.open_read('t1.pickle') as fh:
+			self.assertEqual('abcdef',fh.read())
+
+	def test_truncate(self):
+		with self.storage.open_write('t1.pickle') as fh:
+			fh.write('abcdef')
+		self.storage.truncate('t1.pickle',2)
+
+		with self.storage.open_read('t1.pickle') as fh:
+			self.assertEqual('ab',fh.read())
+
+	def test_write_file(self):
+		self.storage.write_file('_manifest.json','{}')
+
+		self.assertEqual(['_manifest.json'],os.listdir(self.backup_dir))
+		with self.storage.open_read('_manifest.json') as fh:
+			self.assertEqual('{}',fh.read())
+
+
+class TestArchiveStorage(unittest.TestCase):
+
+	def setUp(self):
+		super(TestArchiveStorage,self).setUp()
+		self.backup_dir=tempfile.mkdtemp(prefix='teststorage_backup_dir')
+		self.file_name=os.path.join(self.backup_dir,'backup.tar')
+
+	def tearDown(self):
+		shutil.rmtree(self.backup_dir)
+		super(TestArchiveStorage,self).tearDown()
+
+	def _write_archive(self):
+		storage=ArchiveStorage(self.file_name,'w')
+		with storage.open_write('t1.pickle') as fh, storage.open_write('t1.idx') as ix:
+			for i in xrange(0,1000):
+				fh.write('line {}\n'.format(i))
+				ix.write('{}\n'.format(i))
+		self.assertTrue(storage.exists('t1.pickle'))
+		self.assertTrue(storage.exists('t1.idx'))
+
+		with storage.open_write('t2.pickle') as fh:
+			fh.write('EOF')
+		storage.write_file('_metadata.pickle','meta data')
+		storage.close()
+
+	def test_write(self):
+		self._write_archive()
+
+		tar=tarfile.open(self.file_name)
+		self.assertEqual(
+			['t1.pickle','t1.idx','t2.pickle','_metadata.pickle'],
+			tar.getnames()
+		)
+		self.assertEqual(
+			''.join(['line {}\n'.format(i) for i in xrange(0,1000)]),
+			tar.extractfile('t1.pickle').read()
+		)
+		self.assertEqual('EOF',tar.extractfile('t2.pickle').read())
+		self.assertEqual('meta data',tar.extractfile('_metadata.pickle').read())
+
+	def test_read(self):
+		self._write_archive()
+
+		storage=open_storage(self.file_name)
+		self.assertIsInstance(storage,ArchiveStorage)
+		self.assertFalse(storage.supports_resume)
+		self.assertTrue(storage.exists('t1.idx'))
+		self.assertFalse(storage.exists('t3.pickle'))
+
+		with storage.open_read('t1.pickle') as fh:
+			self.assertEqual('line 0\n',fh.readline())
+			fh.seek(7*10)
+			self.assertEqual('line 10\n',fh.readline())
+
+		with storage.open_read('_metadata.pickle') as fh:
+			self.assertEqual('meta data',fh.read())
+		storage.close()
+
+	def test_append(self):
+		storage=ArchiveStorage(self.file_name,'w')
+		with self.assertRaises(Exception):
+			storage.open_write('t1.pickle',append=True)
+		storage.close()
+
+	def test_open_storage_directory(self):
+		self.assertIsInstance(open_storage(self.backup_dir),DirectoryStorage)
+
+
+class TestStripedStorage(unittest.TestCase):
+
+	def setUp(self):
+		super(TestStripedStorage,self).setUp()
+		self.dirs=[tempfile.mkdtemp(prefix='teststorage_stripe{}'.format(i)) for i in xrange(0,3)]
+
+	def tearDown(self):
+		for d in self.dirs:
+			shutil.rmtree(d)
+		super(TestStripedStorage,self).tearDown()
+
+	def _write(self,storage):
+		for t in ('t1','t2','t3','t4'):
+			with storage.open_write(t+'.pickle') as fh, storage.open_write(t+'.idx') as ix:
+				fh.write(''.join(['{} line {}\n'.format(t,i) for i in xrange(0,100)]))
+				ix.write('index')
+		storage.write_file('_metadata.pickle','meta data')
+		storage.write_file('_manifest.json','{}')
+		storage.write_file('_report.json','{}')
+
+	def test_round_robin(self):
+		storage=StripedStorage(self.dirs)
+		self._write(storage)
+
+		self.assertEqual(['_manifest.json','_metadata.pickle','_report.json','t1.idx','t1.pickle','t4.idx','t4.pickle'],sorted(os.listdir(self.dirs[0])))
+		self.assertEqual(['t2.idx','t2.pickle'],sorted(os.listdir(self.dirs[1])))
+		self.assertEqual(['t3.idx','t3.pickle'],sorted(os.listdir(self.dirs[2])))
+		self.assertEqual(
+			{'paths': self.dirs, 'policy': 'round-robin', 'files': {'t1': 0, 't2': 1, 't3': 2, 't4': 0}},
+			storage.layout()
+		)
+
+	@patch('albackup.storage.free_space')
+	def test_free_space(self,free_space):
+		free_space.side_effect=lambda path: 100 if path==self.dirs[1] else 10
+		storage=StripedStorage(self.dirs,'free-space')
+		with storage.open_write('t1.pickle') as fh:
+			fh.write('EOF')
+		self.assertTrue(os.path.exists(os.path.join(self.dirs[1],'t1.pickle')))
+
+		with self.assertRaises(Exception):
+			StripedStorage(self.dirs,'random')
+
+	def test_existing_files(self):
+		with open(os.path.join(self.dirs[2],'t1.pickle'),'wb') as fh:
+			fh.write('abc')
+		storage=StripedStorage(self.dirs)
+		self.assertTrue(storage.exists('t1.pickle'))
+		self.assertEqual(3,storage.size('t1.pickle'))
+		self.assertEqual(2,storage.layout()['files']['t1'])
+
+	def test_read(self):
+		self._write(StripedStorage(self.dirs))
+
+		storage=StripedStorage(self.dirs,layout={'t1': 0, 't2': 1, 't3': 2, 't4': 0})
+		storage.part_size=64
+		with storage.open_read('_metadata.pickle') as fh:
+			self.assertEqual('meta data',fh.read())
+		for t in storage.table_order(['t3','t2','t1']):
+			if t!='t3':
+				self.assertIn(t+'.pickle',storage._prefetched)
+			with storage.open_read(t+'.pickle') as fh:
+				self.assertEqual(['{} line {}\n'.format(t,i) for i in xrange(0,100)],list(fh))
+		self.assertEqual({},storage._prefetched)
+		storage.close()
+
+	def test_stripe_paths(self):
+		self.assertEqual(
+			[os.path.join('/d2','db@host'),os.path.join('/d3','db@host')],
+			stripe_paths('/d1/db@host/',['/d2','/d3'])
+		)
+
+
+class TestStreamStorage(unittest.TestCase):
+
+	def _write_stream(self):
+		stream=StringIO()
+		storage=StreamStorage(stream,'w')
+		storage.write_file('_metadata.pickle','meta data')
+		with storage.open_write('t1.pickle') as fh, storage.open_write('t1.idx') as ix:
+			for i in xrange(0,100):
+				fh.write('line {}\n'.format(i))
+				ix.write('{}\n'.format(i))
+		self.assertTrue(storage.exists('t1.pickle'))
+		with storage.open_write('t2.pickle') as fh:
+			fh.write('EOF')
+		storage.close()
+		return StringIO(stream.getvalue())
+
+	def test_write(self):
+		stream=self._write_stream()
+		self.assertEqual('ALBACKUP-STREAM 1\n',stream.readline())
+		self.assertEqual('9 _metadata.pickle\n',stream.readline())
+		self.assertEqual('meta data',stream.read(9))
+		self.assertEqual('0 _metadata.pickle\n',stream.readline())
+		self.assertEqual('7 t1.pickle\n',stream.readline())
+		self.assertTrue(stream.getvalue().endswith('3 t2.pickle\nEOF0 t2.pickle\nEND\n'))
+
+	def test_read(self):
+		storage=StreamStorage(self._write_stream(),'r')
+		self.assertFalse(storage.supports_resume)
+		self.assertTrue(storage.sequential)
+
+		with storage.open_read('_metadata.pickle') as fh:
+			self.assertEqual('meta data',fh.read())
+		self.assertEqual(['t1','t2'],list(storage.table_order(['t2','t1'])))
+
+	def test_read_interleaved(self):
+		storage=StreamStorage(self._write_stream(),'r')
+		with storage.open_read('_metadata.pickle') as fh:
+			self.assertEqual('meta',fh.read(4))
+
+		with storage.open_read('t1.pickle') as fh:
+			self.assertEqual(['line {}\n'.format(i) for i in xrange(0,100)],list(fh))
+		# the block index in between isn't kept in memory
+		self.assertFalse(storage.exists('t1.idx'))
+		self.assertEqual({},storage._pending)
+
+		# the rest of a file is skipped, if it is closed early
+		storage=StreamStorage(self._write_stream(),'r')
+		with storage.open_read('_metadata.pickle') as fh:
+			pass
+		with storage.open_read('t1.pickle') as fh:
+			self.assertEqual('line 0\n',fh.readline())
+		with storage.open_read('t2.pickle') as fh:
+			self.assertEqual('EOF',fh.read())
+
+	def test_skip_unknown_tables(self):
+		storage=StreamStorage(self._write_stream(),'r')
+		with storage.open_read('_metadata.pickle') as fh:
+			self.assertEqual('meta data',fh.read())
+		self.assertEqual(['t2'],list(storage.table_order(['t2'])))
+
+	def test_invalid_stream(self):
+		with self.assertRaises(Exception):
+			StreamStorage(StringIO('something else\n'),'r')
+
+		storage=StreamStorage(StringIO('ALBACKUP-STREAM 1\n10 t1.pickle\nabc'),'r')
+		with self.assertRaises(Exception):
+			storage.open_read('t1.pickle').read()
+
+	def test_append(self):
+		storage=StreamStorage(StringIO(),'w')
+		with self.assertRaises(Exception):
+			storage.open_write('t1.pickle',append=True)
+
+
+if __name__=="__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import os
+import sys
+import sqlalchemy as sa
+
+_baseDir=os.path.abspath(os.path.join(os.path.dirname(__file__),'..'))
+if _baseDir not in sys.path:
+    sys.path.insert(0,_baseDir)
+
+from albackup.subset import Subset,key_condition,batches
+
+
+class TestSubset(unittest.TestCase):
+
+	def setUp(self):
+		super(TestSubset,self).setUp()
+		self.engine=sa.create_engine('sqlite://')
+		for sql in (
+			'create table countries (code varchar(2) primary key, name varchar(20))',
+			'create table customers (id integer primary key, country varchar(2) references countries(code), referrer_id integer references customers(id))',
+			'create table products (sku varchar(10), variant integer, id integer unique, primary key (sku,variant))',
+			'create table orders (id integer primary key, customer_id integer references customers(id), product_id integer references products(id))',
+			'create table audit (id integer primary key)'
+		):
+			self.engine.execute(sql)
+		for sql in (
+			"insert into countries values ('NZ','New Zealand'),('DE','Germany'),('US','United States')",
+			"insert into customers values (1,'NZ',null),(2,'DE',1),(3,'US',null),(4,'DE',2)",
+			"insert into products values ('a',1,10),('a',2,11),('b',1,12)",
+			"insert into orders values (100,4,11),(101,3,12),(102,4,null)",
+			"insert into audit values (1)"
+		):
+			self.engine.execute(sql)
+		self.meta=sa.MetaData()
+		self.meta.reflect(bind=self.engine)
+		self.con=self.engine.connect()
+
+	def tearDown(self):
+		self.con.close()
+		super(TestSubset,self).tearDown()
+
+	def test_collect(self):
+		keys=Subset(self.con,self.meta,{'orders': 'customer_id=4'}).collect()
+		self.assertEqual(
+			{
+				'countries': [('DE',),('NZ',)],
+				'customers': [(1,),(2,),(4,)],
+				'products': [('a',2)],
+				'orders': [(100,),(102,)],
+				'audit': []
+			},
+			keys
+		)
+
+	def test_collect_several_seeds(self):
+		keys=Subset(self.con,self.meta,{'cust*': 'id=3', 'audit': '1=1'}).collect()
+		self.assertEqual([('US',)],keys['countries'])
+		self.assertEqual([(3,)],keys['customers'])
+		self.assertEqual([(1,)],keys['audit'])
+		self.assertEqual([],keys['orders'])
+
+	def test_collect_missing_seed(self):
+		with self.assertRaises(Exception):
+			Subset(self.con,self.meta,{'missing': '1=1'}).collect()
+
+	def test_key_condition(self):
+		products=self.meta.tables['products']
+		rows=self.con.execute(
+			sa.select([products.c.id]).where(key_condition([products.c.sku,products.c.variant],[('a',2),('b',1)]))
+		).fetchall()
+		self.assertEqual([11,12],sorted(r[0] for r in rows))
+
+	def test_batches(self):
+		columns=[self.meta.tables['orders'].c.id]
+		self.assertEqual([500,500,1],[len(b) for b in batches(range(0,1001),columns)])
+		self.assertEqual(2000,sum(len(b) for b in batches(range(0,2000),columns*10)))
+		self.assertEqual(200,len(next(batches(range(0,2000),columns*10))))
+
+
+if __name__=="__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+import unittest
+import os
+import sys
+import tempfile
+import shutil
+from sqlalchemy.util import pickle
+import sqlalchemy as sa
+
+_baseDir=os.path.abspath(os.path.join(os.path.dirname(__file__),'..'))
+if _baseDir not in sys.path:
+    sys.path.insert(0,_baseDir)
+
+from albackup.verify import Verify,TableVerification,open_worker_storage,verify_table
+from albackup.codec import BinaryCodec,PickleCodec
+from albackup.schema import write_schema
+from albackup.storage import DirectoryStorage,ArchiveStorage
+from albackup.blocks import Manifest,IndexEntry,LargeValue,block_digest,table_checksum,write_block,write_large_value,write_index_entry
+
+
+class TestVerify(unittest.TestCase):
+
+	def setUp(self):
+		super(TestVerify,self).setUp()
+		self.backup_dir=tempfile.mkdtemp(prefix='testverify_backup_dir')
+		self.meta=sa.MetaData()
+		sa.Table('t1',self.meta,sa.Column('id',sa.Integer,primary_key=True))
+		sa.Table('t2',self.meta,sa.Column('id',sa.Integer,primary_key=True),sa.Column('body',sa.TEXT))
+
+	def tearDown(self):
+		shutil.rmtree(self.backup_dir)
+		super(TestVerify,self).tearDown()
+
+	def _write_table(self,storage,manifest,file_name,blocks,codec):
+		entries=[]
+		offset=0
+		with storage.open_write(file_name) as fh, storage.open_write(os.path.splitext(file_name)[0]+'.idx') as ix:
+			for (rows,large_values) in blocks:
+				buf=codec.encode(rows)
+				digest=block_digest(buf)
+				length=write_block(fh,buf)
+				for chunks in large_values:
+					length+=write_large_value(fh,chunks,digest)
+				entry=IndexEntry(offset,length,len(rows),digest.hexdigest())
+				write_index_entry(ix,entry)
+				entries.append(entry)
+				offset+=length
+			fh.write('EOF')
+		manifest.mark_complete(os.path.splitext(file_name)[0],sum([e.rows for e in entries]),len(entries),table_checksum(entries))
+
+	def _write_backup(self,storage,version=1):
+		codec=BinaryCodec() if version==2 else PickleCodec()
+		suffix='.blocks' if version==2 else '.pickle'
+		manifest=Manifest(storage)
+		self._write_table(storage,manifest,'t1'+suffix,[([{'id': i} for i in xrange(b*10,b*10+10)],[]) for b in xrange(0,3)],codec)
+		self._write_table(storage,manifest,'t2'+suffix,[
+			([{'id': 1, 'body': 'short'},{'id': 2, 'body': LargeValue('body',6,False)}],[['abc','def']])
+		],codec)
+		manifest.save()
+		if version==2:
+			write_schema(storage,{'format': 2, 'codec': 'binary', 'meta': self.meta})
+		else:
+			storage.write_file('_metadata.pickle',pickle.dumps({'meta': self.meta}))
+		storage.close()
+
+	def _corrupt(self,file_name,offset,data):
+		with open(os.path.join(self.backup_dir,file_name),'r+b') as fh:
+			fh.seek(offset)
+			fh.write(data)
+
+	def test_verify(self):
+		self._write_backup(DirectoryStorage(self.backup_dir))
+		self.assertEqual(
+			[TableVerification('t1',True,30,3,[]),TableVerification('t2',True,2,1,[])],
+			Verify(self.backup_dir,processes=2).run()
+		)
+
+	def test_verify_archive_format_v2(self):
+		archive=os.path.join(self.backup_dir,'backup.tar')
+		self._write_backup(ArchiveStorage(archive,'w'),2)
+		self.assertEqual([True,True],[r.ok for r in Verify(archive,processes=2).run()])
+
+	def test_corrupted_block(self):
+		self._write_backup(DirectoryStorage(self.backup_dir))
+		with open(os.path.join(self.backup_dir,'t1.pickle'),'rb') as fh:
+			data=fh.read()
+		self._corrupt('t1.pickle',data.index('\n')+20,'X')
+
+		(t1,t2)=Verify(self.backup_dir,processes=2).run()
+		self.assertFalse(t1.ok)
+		self.assertTrue(t2.ok)
+		self.assertIn('Block 0',t1.errors[0])
+
+	def test_truncated_file(self):
+		self._write_backup(DirectoryStorage(self.backup_dir))
+		path=os.path.join(self.backup_dir,'t2.pickle')
+		with open(path,'rb') as fh:
+			data=fh.read()
+		with open(path,'wb') as fh:
+			fh.write(data[:-8])
+
+		open_worker_storage((self.backup_dir,None,None))
+		result=verify_table(('t2','t2.pickle','pickle',True,{'rows': 2, 'blocks': 1, 'checksum': ''}))
+		self.assertFalse(result.ok)
+		self.assertEqual(['Large value after block 0 is truncated'],result.errors)
+
+	def test_manifest_differs(self):
+		self._write_backup(DirectoryStorage(self.backup_dir))
+		open_worker_storage((self.backup_dir,None,None))
+		result=verify_table(('t1','t1.pickle','pickle',True,{'rows': 31, 'blocks': 3, 'checksum': ''}))
+		self.assertEqual(
+			['Manifest has 31 rows, the table file 30','Checksum of the table file differs from the manifest'],
+			result.errors
+		)
+		result=verify_table(('t3','t3.pickle','pickle',True,None))
+		self.assertEqual(
+			['Table file t3.pickle is missing','Table is not recorded in the manifest'],
+			result.errors
+		)
+
+	def test_verify_without_manifest(self):
+		self._write_backup(DirectoryStorage(self.backup_dir))
+		os.remove(os.path.join(self.backup_dir,'_manifest.json'))
+		self.assertEqual(
+			[TableVerification('t1',True,30,3,[]),TableVerification('t2',True,2,1,[])],
+			Verify(self.backup_dir,processes=2).run()
+		)
+
+		self._corrupt('t1.pickle',30,'X')
+		(t1,t2)=Verify(self.backup_dir,processes=2).run()
+		self.assertFalse(t1.ok)
+		self.assertTrue(t2.ok)
+
+
+if __name__=="__main__":
+    unittest.main()
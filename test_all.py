@@ -4,12 +4,17 @@ import argparse
 import sqlalchemy as sa
 import pyodbc
 import copy
+import os
+import sys
+from functools import partial
 
 from sqlalchemy.pool import NullPool
 from albackup import loggerFactory
 from albackup.dump import Dump
 from albackup.restore import Restore
-from albackup.compare import DbCompare
+from albackup.compare import DbCompare,SchemaCompare
+from albackup.datacompare import DataCompare
+from albackup.orchestrate import Job,Orchestrator,write_report
 
 _getLogger=loggerFactory('test_all')
 
@@ -84,11 +89,28 @@ class DatabaseRecreator(object):
 		)
 		_getLogger('DatabaseRecreate').info('Database %s re-created',db_name)
 
+	def drop(self,db_name=None):
+		''' Deletes a given database, or the database from the configuration '''
+		if db_name is None:
+			db_name=self.db
+		self.con.execute('drop database {}'.format(db_name))
+		_getLogger('DatabaseRecreate').info('Database %s dropped',db_name)
+
+	def close(self):
+		''' Closes the connection to the master database '''
+		self.con.close()
+
 
 
 parser=argparse.ArgumentParser("Test prog to backup restore all databases and comparing them")
 parser.add_argument('--debug','-d',action="store_true",default=False,help="Run in debug mode")
-parser.add_argument('--sqlwb',action='store',default='../sqlworkbench',help='Location of the sqlworkbench tools')
+parser.add_argument('--sqlwb',action='store',default=None,help='Location of the sqlworkbench tools to compare the schemas with instead of the built-in compare')
+parser.add_argument('--verify-data',action="store_true",default=False,help="Compare the data of the source and the restored database as well")
+parser.add_argument('--verify-workers',type=int,default=4,help="Number of tables whose data is compared at the same time")
+parser.add_argument('--parallel',type=int,default=1,help="Number of databases tested at the same time")
+parser.add_argument('--parallel-per-server',type=int,default=2,help="Number of tests working on the same server at the same time")
+parser.add_argument('--keep-restore',action="store_true",default=False,help="Keep the scratch databases of passed tests")
+parser.add_argument('--report',action='store',default='test_all-report.json',help="JSON file with the results of all tests")
 parser.add_argument('--test-cfg',action='store',default='test_all.json',help="The json config file to be used")
 args=parser.parse_args()
 
@@ -108,10 +130,75 @@ with open(args.test_cfg) as fh:
 	cfg=json.load(fh)
 	logger.info('Read configuration from %s',args.test_cfg)
 
-recreator=DatabaseRecreator(cfg['restore'])
+def test_database(test_cfg,restore_cfg):
+	''' Tests one database: dumps it, restores the dump into the scratch database of
+		restore_cfg and compares both. The scratch database is dropped if the test
+		passed. Returns the details for the report.
+	'''
+	logger.info('Starting Test for %s',test_cfg['name'])
+	details={'restore_db': restore_cfg['db_name']}
+	engine=create_engine(test_cfg)
+
+	# run dump
+	dump=Dump('./backup', None, engine, test_cfg['db_name'], test_cfg['db_server'])
+	dump.run()
+	logger.info('Dump finished. Backup in %s',dump.backup_dir)
+	details['backup_dir']=dump.backup_dir
+	engine.dispose()
+
+	# re-create database
+	recreator=DatabaseRecreator(restore_cfg)
+	recreator.recreate()
+
+	# now the restore
+	backup_dir=dump.backup_dir
+	engine=create_engine(restore_cfg,poolclass=NullPool)
+	enable_ri_check=test_cfg['enable_ri_check']
+			
+	restore=Restore(backup_dir,engine)
+	restore.run()
+	if enable_ri_check:
+		restore.changeRIChecks(off=False)
+	else:
+		logger.info('RI checks where left off')
+	logger.info('Restore finished')
+	restore.con.close()
+	engine.dispose()
+
+	# compare the two
+	passed=True
+	if args.sqlwb:
+		comp=DbCompare(test_cfg,restore_cfg,args.sqlwb)
+		comp.run()
+	else:
+		ref_engine=create_engine(test_cfg,poolclass=NullPool)
+		engine=create_engine(restore_cfg,poolclass=NullPool)
+		diff=SchemaCompare(ref_engine,engine,test_cfg['name'],restore_cfg['name']).run()
+		details['schema_differs']=SchemaCompare.has_differences(diff)
+		passed=not details['schema_differs']
+		ref_engine.dispose()
+		engine.dispose()
+
+	if args.verify_data:
+		ref_engine=create_engine(test_cfg)
+		engine=create_engine(restore_cfg)
+		checks=DataCompare(ref_engine,engine,dump.meta,workers=args.verify_workers).run()
+		details['tables_differ']=[c.table for c in checks if not c.ok]
+		passed=passed and not details['tables_differ']
+		ref_engine.dispose()
+		engine.dispose()
+
+	if passed and not args.keep_restore:
+		recreator.drop()
+	recreator.close()
+	details['passed']=passed
+	return details
 
 
-# iterate over all configs
+# one job per database, each restoring into its own scratch database
+if not os.path.exists('diffs'):
+	os.mkdir('diffs')
+jobs=[]
 for cur_cfg in cfg['databases']:
 	test_cfg={
 		'skip': False,
@@ -119,42 +206,22 @@ for cur_cfg in cfg['databases']:
 	}
 	test_cfg.update(cur_cfg)
 
-	restore_cfg=copy.copy(cfg['restore'])
-
 	if test_cfg['skip']:
 		logger.warn('Test for %s skipped',test_cfg['name'])
-	else:
-		logger.info('Starting Test for %s',test_cfg['name'])
-		engine=create_engine(test_cfg)
-
-		# run dump
-		dump=Dump('./backup', None, engine, test_cfg['db_name'], test_cfg['db_server'])
-		dump.run()
-		logger.info('Dump finished. Backup in %s',dump.backup_dir)
-		engine.dispose()
-
-		# re-create database
-		restore_name=test_cfg['restore_name'] if 'restore_name' in test_cfg else restore_cfg['db_name']
-		restore_cfg['db_name']=restore_name
-		recreator.recreate(restore_name)
+		continue
 
-		# now the restore
-		backup_dir=dump.backup_dir
-		engine=create_engine(restore_cfg,poolclass=NullPool)
-		enable_ri_check=test_cfg['enable_ri_check']
-				
-		restore=Restore(backup_dir,engine)
-		restore.run()
-		if enable_ri_check:
-			restore.changeRIChecks(off=False)
-		else:
-			logger.info('RI checks where left off')
-		logger.info('Restore finished')
-		restore.con.close()
-		engine.dispose()
-
-		# compare the two
-		comp=DbCompare(test_cfg,restore_cfg,args.sqlwb)
-		comp.run()
-
-logger.info('Done with all databases.')
\ No newline at end of file
+	restore_cfg=copy.copy(cfg['restore'])
+	restore_cfg['db_name']=test_cfg.get('restore_name','{}_{}'.format(restore_cfg['db_name'],test_cfg['name']))
+	jobs.append(Job(
+		test_cfg['name'],
+		(test_cfg['db_server'],restore_cfg['db_server']),
+		partial(test_database,test_cfg,restore_cfg)
+	))
+
+results=Orchestrator(jobs,workers=args.parallel,per_server=args.parallel_per_server,server_limits=cfg.get('server_limits')).run()
+write_report(args.report,results)
+failed=[r.name for r in results if not r.ok or not r.details.get('passed')]
+if failed:
+	logger.error('Tests failed for %s',', '.join(failed))
+	sys.exit(1)
+logger.info('All %d tests passed',len(results))